@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import aiohttp
+from config import config
+from log import setup_logger
+from metrics import metrics
+from azure.core.exceptions import AzureError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobServiceClient
+from azure.cosmos.aio import CosmosClient
+from azAsync import AsyncBlobStorage, AsyncCosmosContainer
+from azDedupStorage import AZDedupStorage
+from main import FileTracker
+
+logger=setup_logger(__name__)
+
+class AsyncFileTracker(FileTracker):
+    """FileTracker whose sync runs on asyncio with the aio Blob Storage and CosmosDB clients.
+    The local scan, the DB scan and the blob listing run at the same time, then every
+    transfer is followed by its own DB update while the other transfers go on.
+    Transfers and DB requests are each limited to self.workers at a time.
+    """
+    def __init__(self, **params):
+        """Same settings as FileTracker.
+
+        Raises:
+            ValueError: storage_backend=dedup, delta_min_mb, large_file_mb, state_backend=blob or 
+                container_manifest, which only main.py supports.
+        """
+        super().__init__(**params)
+        if (isinstance(self.storage_resource, AZDedupStorage) or self.storage_resource.delta_min_size
+                or self.storage_resource.large_file_size):
+            raise ValueError("storage_backend=dedup, delta_min_mb and large_file_mb are only supported by main.py")
+        if self.blob_state or self.storage_resource.container_manifest is not None:
+            raise ValueError("state_backend=blob and container_manifest are only supported by main.py")
+
+
+    def _transport(self, session: aiohttp.ClientSession) -> AioHttpTransport:
+        """Transport over the shared aiohttp session, closed by run only.
+
+        Args:
+            session (aiohttp.ClientSession): Session with a pool of self.clients.pool_size connections.
+
+        Returns:
+            AioHttpTransport: azure-core transport for an aio client pipeline.
+        """
+        return AioHttpTransport(
+            session=session, session_owner=False,
+            connection_timeout=self.clients.conn_timeout, read_timeout=self.clients.read_timeout)
+
+
+    async def _push(self, blobs: AsyncBlobStorage, db: AsyncCosmosContainer,
+                    file: str, file_hash: str, after_local: dict) -> None:
+        """Uploads one file then records it in the DB.
+        A failed upload is left out of after_local so the next run retries it.
+        """
+        try:
+            response = await blobs.upload(file, file_hash)
+        except (AzureError, OSError) as err:
+            logger.error("Couldn't put AZ object %s. Here's why: %s ", file, err)
+            after_local.pop(file, None)
+            self.hash_cache.forget([file])
+            return
+
+        await db.upsert(file, response['last_modified'].timestamp(), file_hash)
+
+
+    async def _pull(self, blobs: AsyncBlobStorage, db: AsyncCosmosContainer, file: str,
+                    blob_time: float, after_local: dict, download: bool=True) -> None:
+        """Downloads one blob then records it in the DB.
+        A failed download is left out of after_local so the next run retries it.
+        """
+        if download:
+            try:
+                await blobs.download(file)
+            except (AzureError, OSError, ValueError) as err:
+                logger.error("Couldn't get AZ object %s. Here's why: %s", file, err)
+                return
+
+        after_local[file] = os.path.getmtime(self.working_dir + file)
+        await db.upsert(file, blob_time, self.storage_resource.cloud_hashes.get(file))
+
+
+    async def _remove_local(self, db: AsyncCosmosContainer, file_list: dict, after_local: dict) -> None:
+        """Deletes local files removed in the cloud and their DB items."""
+        await asyncio.to_thread(self.delete_files, list(file_list))
+        for file in file_list:
+            after_local.pop(file, None)
+        await asyncio.gather(*(db.delete(file) for file in file_list))
+
+
+    async def _remove_cloud(self, blobs: AsyncBlobStorage, db: AsyncCosmosContainer,
+                            file_list: dict, after_local: dict) -> None:
+        """Deletes blobs of files removed locally and their DB items.
+        Blobs that failed to delete stay in after_local so the next run retries them.
+        """
+        failed = await blobs.delete(file_list)
+        after_local.update({file: file_list[file] for file in failed})
+        await asyncio.gather(*(db.delete(file) for file in file_list if file not in failed))
+
+
+    async def sync_all_async(self, blobs: AsyncBlobStorage, db: AsyncCosmosContainer) -> None:
+        """sync_all on asyncio: same change detection, all transfers and DB updates at once.
+
+        Args:
+            blobs (AsyncBlobStorage): aio Blob Storage of this run.
+            db (AsyncCosmosContainer): aio CosmosDB container of this run.
+        """
+        start = time.perf_counter()
+        before_local = self.before_save_local
+        after_local, before_cloud, after_cloud = await asyncio.gather(
+            asyncio.to_thread(lambda: self.file_time_list), db.scan(), blobs.list_times())
+        logger.info(f'Local, DB and Blob Storage scanned in {time.perf_counter() - start:.2f}s')
+        logger.info(f"Local Directory file count before: {len(before_local)}")
+
+        plan = await asyncio.to_thread(self.plan_sync, before_local, after_local, before_cloud, after_cloud)
+        logger.info(f"Sync plan: {plan.counts}")
+
+        pushed = {**plan.upload_new, **plan.upload_changed}
+        hashes = {}
+        if self.hash_check and pushed:
+            hashes = await asyncio.to_thread(lambda: {
+                key: self.hash_cache.file_hash(key, self.file_size(key), value) for key, value in pushed.items()})
+
+        jobs = []
+        if plan.download or plan.keep_local:
+            logger.info(f"|1|3| Cloud Added or Changed: Downloading: {plan.download.keys()}")
+            jobs += [self._pull(blobs, db, key, after_cloud[key], after_local, key in plan.download)
+                     for key in {**plan.download, **plan.keep_local}]
+        if plan.delete_local:
+            logger.info(f"|2| Cloud Removed: Deleting locally: {plan.delete_local.keys()}")
+            jobs.append(self._remove_local(db, plan.delete_local, after_local))
+        if pushed:
+            logger.info(f"|4|6| Local Added or Changed, Upload to Cloud: {pushed.keys()}")
+            jobs += [self._push(blobs, db, key, hashes.get(key), after_local) for key in pushed]
+        if plan.delete_cloud:
+            logger.info(f"|5| Local Removed.. Delete Cloud: {plan.delete_cloud.keys()}")
+            jobs.append(self._remove_cloud(blobs, db, plan.delete_cloud, after_local))
+        if plan.forget:
+            logger.info(f"Removed on both sides, DB items dropped: {plan.forget.keys()}")
+            jobs += [db.delete(key) for key in plan.forget]
+        if not jobs:
+            logger.info("No Local or Cloud File Changes Detected..")
+
+        await asyncio.gather(*jobs)
+
+        self.after_save_local(after_local)
+        self.hash_cache.prune(after_local)
+        self.hash_cache.save()
+
+        logger.info(f'Local Directory file count after: {len(after_local)}')
+        logger.info(f'Transfer bytes local/wire and codec CPU: {self.storage_resource.pop_transfer_stats()}')
+        logger.info(f'Async sync done in {time.perf_counter() - start:.2f}s')
+
+
+    async def run(self, runs: int=50) -> None:
+        """Opens the aio clients once and runs sync_all_async every self.t_sec seconds.
+
+        Args:
+            runs (int, optional): Number of syncs, like the main.py loop. Defaults to 50.
+        """
+        connector = aiohttp.TCPConnector(limit=self.clients.pool_size)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            blob_service_client = BlobServiceClient.from_connection_string(
+                conn_str=self.conn_str, transport=self._transport(session))
+            cosmos_client = CosmosClient(
+                self.uri, self.key, transport=self._transport(session),
+                connection_timeout=self.clients.conn_timeout)
+
+            async with blob_service_client, cosmos_client:
+                blobs = AsyncBlobStorage(
+                    self.storage_resource, blob_service_client.get_container_client(self.sto_container), self.workers)
+                db = AsyncCosmosContainer(
+                    self.db_resource, cosmos_client.get_database_client(self.db_name).get_container_client(
+                        self.db_resource.container_name), self.workers)
+
+                for i in range(runs):
+                    print('--------------------------------------------------------------------------------------------------------------------')
+                    print('Run:', i)
+                    with metrics.phase('sync_all_async'):
+                        await self.sync_all_async(blobs, db)
+                    metrics.flush()
+                    logger.info(f'All Done waiting:{self.t_sec} seconds.')
+                    await asyncio.sleep(self.t_sec)
+
+
+if __name__ == "__main__":
+
+    params = config()
+    my_backup_folder = AsyncFileTracker(**params)
+    asyncio.run(my_backup_folder.run())
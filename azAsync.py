@@ -0,0 +1,294 @@
+import os
+import sys
+import asyncio
+import time
+from log import setup_logger
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.cosmos.partition_key import NonePartitionKeyValue
+from containerManifest import MANIFEST_BLOB
+from fileIndex import FileIndex
+from azStorage import AZBlobStorage, PARTIAL_SUFFIX, DELETE_BATCH_LIMIT, HASH_KEY, MANIFEST_KEY, local_path, stat_metadata, listed_stats
+from azCosmosContainer import AzCosmosContainer, SCAN_QUERY, to_item_id, to_file_name
+from blobCodec import CODEC_KEY, CHUNK_SIZE, decompressor, worth_compressing
+
+logger=setup_logger(__name__)
+
+
+async def in_thread(pieces):
+    """Yields the items of a blocking iterator, each one produced on a worker thread
+    so file reads and compression never hold up the event loop.
+
+    Args:
+        pieces (iterable): Blocking iterator of bytes, like a file read or AZBlobStorage._compress.
+
+    Returns:
+        async generator: the same items.
+    """
+    pieces = iter(pieces)
+    while True:
+        piece = await asyncio.to_thread(next, pieces, None)
+        if piece is None:
+            return
+        yield piece
+
+
+class AsyncBlobStorage:
+    """aio transfers for an AZBlobStorage. The listing snapshot, content hashes,
+    codec setting and transfer counters stay on the AZBlobStorage, so FileTracker
+    reads them the same way for both engines.
+    """
+    def __init__(self, storage: AZBlobStorage, container_client: object, workers: int=8):
+        """
+        Args:
+            storage (AZBlobStorage): Settings and snapshot shared with the blocking engine.
+            container_client (object): azure.storage.blob.aio ContainerClient.
+            workers (int, optional): Max transfers at the same time. Defaults to 8.
+        """
+        self.storage = storage
+        self.container_client = container_client
+        self.semaphore = asyncio.Semaphore(max(1, int(workers)))
+
+
+    async def list_times(self) -> FileIndex:
+        """Lists the container once and keeps it as the snapshot, like AZBlobStorage.blob_file_time_list.
+
+        Returns:
+            FileIndex: {"path\\filename": float}
+        """
+        rows = []
+        try:
+            async for blob in self.container_client.list_blobs(include=['metadata']):
+                if blob.name == MANIFEST_BLOB:
+                    continue
+                metadata = blob.metadata
+                rows.append((blob.name.replace("/", os.sep), blob.last_modified.timestamp(), blob.etag,
+                             metadata and metadata.get(HASH_KEY), listed_stats(metadata)))
+
+        except AzureError as err:
+            logger.error("Couldn't list AZ container %s. Here's why: %s", self.storage.container, err)
+            raise
+
+        self.storage._index_listed(rows)
+        return self.storage.cloud_index
+
+
+    async def upload(self, file_name: str, file_hash: str=None) -> dict:
+        """Uploads one file, compressed when the storage codec is set and it pays off.
+        The file is opened, sampled, read and compressed on worker threads.
+
+        Args:
+            file_name (str): "path/filename"
+            file_hash (str, optional): Content hash saved as blob metadata. Defaults to None.
+
+        Returns:
+            dict: upload_blob response with last_modified and etag.
+        """
+        storage = self.storage
+        async with self.semaphore:
+            blob_client = self.container_client.get_blob_client(blob=file_name)
+
+            file_data = await asyncio.to_thread(open, local_path(storage.working_dir, file_name), 'rb')
+            try:
+                stat = os.fstat(file_data.fileno())
+                metadata = stat_metadata(stat)
+                if file_hash:
+                    metadata[HASH_KEY] = file_hash
+                if storage.compression and await asyncio.to_thread(worth_compressing, file_name, file_data):
+                    metadata[CODEC_KEY] = storage.compression
+                    counter = dict(raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0)
+                    response = await blob_client.upload_blob(
+                        in_thread(storage._compress(file_data, counter)), overwrite=True, metadata=metadata)
+                    storage._count_transfer(**counter)
+                else:
+                    response = await blob_client.upload_blob(
+                        in_thread(iter(lambda: file_data.read(CHUNK_SIZE), b'')), length=stat.st_size, 
+                        overwrite=True, metadata=metadata)
+                    storage._count_transfer(raw_bytes=stat.st_size, wire_bytes=stat.st_size)
+            finally:
+                file_data.close()
+
+        storage._index_put(file_name, response, file_hash, (stat.st_mtime, stat.st_size))
+        logger.info(f'Upload: {file_name}: {response}')
+        return response
+
+
+    async def download(self, file_name: str) -> None:
+        """Downloads one blob to a temp file next to the target and renames it into place.
+        Each chunk is decompressed and written on a worker thread.
+
+        Args:
+            file_name (str): "path/filename"
+        """
+        storage = self.storage
+        file_path = local_path(storage.working_dir, file_name)
+        part_path = file_path + PARTIAL_SUFFIX
+        counter = dict(raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0)
+
+        def write(data, chunk):
+            if decompress is not None:
+                start = time.thread_time()
+                try:
+                    chunk = decompress.decompress(chunk)
+                except Exception as err:
+                    raise ValueError(f"Couldn't decompress {codec} blob {file_name}: {err}") from err
+                counter['codec_cpu_sec'] += time.thread_time() - start
+            counter['raw_bytes'] += len(chunk)
+            data.write(chunk)
+
+        async with self.semaphore:
+            try:
+                await asyncio.to_thread(os.makedirs, os.path.dirname(file_path), exist_ok=True)
+                blob_data = await self.container_client.get_blob_client(blob=file_name).download_blob()
+                metadata = blob_data.properties.metadata or {}
+                if MANIFEST_KEY in metadata:
+                    raise ValueError(f"Blob {file_name} is a chunk manifest, set storage_backend=dedup and use main.py")
+                codec = metadata.get(CODEC_KEY)
+                decompress = decompressor(codec) if codec else None
+
+                data = await asyncio.to_thread(open, part_path, "wb")
+                try:
+                    async for chunk in blob_data.chunks():
+                        counter['wire_bytes'] += len(chunk)
+                        await asyncio.to_thread(write, data, chunk)
+                finally:
+                    await asyncio.to_thread(data.close)
+                await asyncio.to_thread(os.replace, part_path, file_path)
+
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+            finally:
+                storage._count_transfer(**counter)
+
+        logger.info(f'Downloaded: {file_name}')
+
+
+    async def _delete_batch(self, batch: list) -> list:
+        async with self.semaphore:
+            responses = await self.container_client.delete_blobs(*batch, raise_on_any_failure=False)
+            return [(blob, response.status_code) for blob, response in zip(batch, [r async for r in responses])]
+
+
+    async def delete(self, del_list) -> dict:
+        """Deletes blobs in batches of DELETE_BATCH_LIMIT.
+
+        Args:
+            del_list (list): ["path/filename"]
+
+        Returns:
+            dict: {"path/filename": status code or error} of the blobs that could not be deleted.
+        """
+        del_list = list(del_list)
+        batches = [del_list[i:i + DELETE_BATCH_LIMIT] for i in range(0, len(del_list), DELETE_BATCH_LIMIT)]
+        results = await asyncio.gather(*(self._delete_batch(batch) for batch in batches), return_exceptions=True)
+
+        failed = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, AzureError):
+                    raise result
+                logger.error("Couldn't delete AZ batch of %s objects. Here's why: %s", len(batch), result)
+                failed.update({blob: result for blob in batch})
+                continue
+            for blob, status in result:
+                # 404: already gone, nothing left to delete
+                if status in (200, 202, 404):
+                    self.storage._index_delete(blob)
+                else:
+                    failed[blob] = status
+                    logger.error(f'Blob Deletion Failed: {blob}: {status}')
+
+        logger.info(f'Blob Deletion Done: {len(del_list) - len(failed)} ok, {len(failed)} failed, {len(batches)} batches')
+        return failed
+
+
+class AsyncCosmosContainer:
+    """aio reads and writes for an AzCosmosContainer, item ids and tombstones
+    follow the AzCosmosContainer rules.
+    """
+    def __init__(self, db: AzCosmosContainer, container: object, workers: int=8):
+        """
+        Args:
+            db (AzCosmosContainer): Settings and hash cache shared with the blocking engine.
+            container (object): azure.cosmos.aio ContainerProxy.
+            workers (int, optional): Max requests at the same time. Defaults to 8.
+        """
+        self.db = db
+        self.container = container
+        self.semaphore = asyncio.Semaphore(max(1, int(workers)))
+
+
+    async def scan(self) -> FileIndex:
+        """Reads SCAN_QUERY in pages of page_size, tombstones are left out.
+
+        Returns:
+            FileIndex: {fileName:str, fileTime:float}
+        """
+        rows = []
+        start = time.perf_counter()
+        try:
+            async for item in self.container.query_items(query=SCAN_QUERY, max_item_count=self.db.page_size):
+                rows.append((sys.intern(to_file_name(item["id"])), float(item['fileTime'])))
+
+        except AzureError as err:
+            logger.error("Couldn't scan for items. Here's why: %s", err)
+            raise
+
+        file_time_list = FileIndex(rows)
+        logger.info(f'Container: {self.db.container_name} scanned {len(file_time_list)} items, '
+                    f'{time.perf_counter() - start:.2f}s')
+        return file_time_list
+
+
+    async def upsert(self, file_name: str, file_time: float, file_hash: str=None) -> bool:
+        """Adds or updates one item, errors are logged.
+
+        Args:
+            file_name (str): "path/filename"
+            file_time (float): Blob time.
+            file_hash (str, optional): Content hash. Defaults to None.
+
+        Returns:
+            bool: True when written.
+        """
+        item = dict(id=to_item_id(file_name), fileTime=str(file_time))
+        if file_hash:
+            item["fileHash"] = file_hash
+
+        try:
+            async with self.semaphore:
+                await self.container.upsert_item(item)
+            return True
+
+        except AzureError as err:
+            logger.error("Couldn't add file %s to table %s. Here's why: %s", file_name, self.db.container_name, err)
+            return False
+
+
+    async def delete(self, file_name: str) -> bool:
+        """Deletes one item, or writes a tombstone in change_feed mode. Errors are logged.
+
+        Args:
+            file_name (str): "path/filename"
+
+        Returns:
+            bool: True when removed or already gone.
+        """
+        item_id = to_item_id(file_name)
+
+        try:
+            async with self.semaphore:
+                if self.db.change_feed:
+                    # The change feed does not report deletes, leave a tombstone instead
+                    await self.container.upsert_item(dict(id=item_id, fileTime="0", deleted=True))
+                else:
+                    await self.container.delete_item(item=item_id, partition_key=NonePartitionKeyValue)
+            return True
+
+        except ResourceNotFoundError:
+            return True
+        except AzureError as err:
+            logger.error(f'Item: {file_name} Deletion of Table Item Failed: {err}')
+            return False
@@ -0,0 +1,177 @@
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.exceptions import AzureError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+from azure.cosmos import CosmosClient
+from log import setup_logger
+from metrics import metrics
+
+logger=setup_logger(__name__)
+
+# Responses the Azure SDK retry policies try again
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class CountingTransport(RequestsTransport):
+    """RequestsTransport that counts every HTTP try, retries included, in metrics.
+    """
+    def send(self, request, **kwargs):
+        if not metrics.enabled:
+            return super().send(request, **kwargs)
+        
+        service = 'cosmos' if 'documents' in (urlparse(request.url).hostname or '') else 'blob'
+        try:
+            response = super().send(request, **kwargs)
+        except AzureError:
+            metrics.count('http_requests_total', service=service, method=request.method, status='error')
+            metrics.count('http_retryable_total', service=service)
+            raise
+        
+        metrics.count('http_requests_total', service=service, method=request.method, status=str(response.status_code))
+        if response.status_code in RETRY_STATUS:
+            metrics.count('http_retryable_total', service=service)
+        return response
+
+
+class AzClientPool:
+    """Long lived Azure clients shared by AZBlobStorage and AzCosmosContainer.
+    Clients are built once and reuse one pooled HTTP session for the life of the process.
+    """
+    def __init__(self, conn_str: str=None, uri: str=None, key: str=None,
+                 pool_size: int=16, conn_timeout: int=20, read_timeout: int=60):
+        """Builds the shared HTTP session, clients are created on first use.
+
+        Args:
+            conn_str (str, optional): Azure Blob Storage Connection String. Defaults to None.
+            uri (str, optional): URI for CosmosDB connection. Defaults to None.
+            key (str, optional): Unique Key as Per Azure Acct. Defaults to None.
+            pool_size (int, optional): Max keep-alive connections per host. Defaults to 16.
+            conn_timeout (int, optional): Seconds to wait for a connection. Defaults to 20.
+            read_timeout (int, optional): Seconds to wait for a response. Defaults to 60.
+        """
+        self.conn_str = conn_str
+        self.uri = uri
+        self.key = key
+        self.pool_size = int(pool_size)
+        self.conn_timeout = int(conn_timeout)
+        self.read_timeout = int(read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._blob_service_client = None
+        self._container_clients = {}
+        self._cosmos_client = None
+        self.clients_created = 0
+        self.clients_reused = 0
+
+
+    def _transport(self) -> RequestsTransport:
+        """Transport over the shared session, the session is closed by self.close only.
+
+        Returns:
+            RequestsTransport: azure-core transport for a client pipeline.
+        """
+        return CountingTransport(
+            session=self.session, session_owner=False,
+            connection_timeout=self.conn_timeout, read_timeout=self.read_timeout)
+
+
+    def _count(self, created: bool) -> None:
+        if created:
+            self.clients_created += 1
+        else:
+            self.clients_reused += 1
+
+
+    @property
+    def blob_service_client(self) -> BlobServiceClient:
+        """Shared BlobServiceClient, built from conn_str on first use.
+
+        Returns:
+            BlobServiceClient: Blob Storage account client.
+        """
+        with self._lock:
+            created = self._blob_service_client is None
+            if created:
+                self._blob_service_client = BlobServiceClient.from_connection_string(
+                    conn_str=self.conn_str, transport=self._transport())
+            self._count(created)
+            return self._blob_service_client
+
+
+    def container_client(self, container: str) -> object:
+        """Shared ContainerClient per container name.
+
+        Args:
+            container (str): Storage Actual Name
+
+        Returns:
+            object: ContainerClient for the container.
+        """
+        blob_service_client = self.blob_service_client
+        with self._lock:
+            created = container not in self._container_clients
+            if created:
+                self._container_clients[container] = blob_service_client.get_container_client(container=container)
+            self._count(created)
+            return self._container_clients[container]
+
+
+    @property
+    def cosmos_client(self) -> CosmosClient:
+        """Shared CosmosClient, built from uri and key on first use.
+
+        Returns:
+            CosmosClient: Cosmos DB account client.
+        """
+        with self._lock:
+            created = self._cosmos_client is None
+            if created:
+                self._cosmos_client = CosmosClient(
+                    self.uri, self.key, transport=self._transport(),
+                    connection_timeout=self.conn_timeout)
+            self._count(created)
+            return self._cosmos_client
+
+
+    @property
+    def stats(self) -> dict:
+        """Client and HTTP connection reuse counters.
+
+        Returns:
+            dict: {"clients_created": int, "clients_reused": int,
+            "connections_opened": int, "requests_sent": int, "connections_reused": int}
+        """
+        opened = sent = 0
+        for adapter in set(self.session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    sent += pool.num_requests
+
+        return {"clients_created": self.clients_created,
+                "clients_reused": self.clients_reused,
+                "connections_opened": opened,
+                "requests_sent": sent,
+                "connections_reused": max(sent - opened, 0)}
+
+
+    def close(self) -> None:
+        """Closes the clients and the shared session.
+        """
+        logger.info(f'Closing Azure clients: {self.stats}')
+        with self._lock:
+            if self._blob_service_client is not None:
+                self._blob_service_client.close()
+            self._blob_service_client = None
+            self._container_clients = {}
+            self._cosmos_client = None
+        self.session.close()
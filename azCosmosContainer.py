@@ -1,16 +1,41 @@
 #https://github.com/Azure/azure-sdk-for-python/blob/main/sdk/cosmos/azure-cosmos/samples/examples.py
 
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import config
 from log import setup_logger
-from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos import PartitionKey
+from azure.cosmos.partition_key import NonePartitionKeyValue
 from azure.core.exceptions import AzureError
+from azClients import AzClientPool
+from metrics import metrics
+from fileIndex import FileIndex
 
 logger=setup_logger(__name__)
 
+# Cosmos DB limit of operations in one transactional batch.
+BATCH_LIMIT = 100
+# Only the fields the file index needs, tombstones are left out.
+SCAN_QUERY = "SELECT c.id, c.fileTime FROM c WHERE NOT IS_DEFINED(c.deleted)"
+
+
+def to_item_id(file_name:str) -> str:
+    """Item id of a file name, both '/' and '\\' become '&'."""
+    return file_name.replace('/', '&').replace('\\', '&')
+
+
+def to_file_name(item_id:str) -> str:
+    """File name of an item id, with the path separator of this OS."""
+    return item_id.replace('&', os.sep)
+
+
 class AzCosmosContainer:
     """Encapsulates an Azure Cosmos DB table: fileName and fileTime data.
     """
-    def __init__(self, uri:str, key:str, database_name:str, container_name:str):
+    def __init__(self, uri:str, key:str, database_name:str, container_name:str, clients:AzClientPool=None, 
+                 workers:int=8, change_feed:bool=False, page_size:int=1000, state:object=None):
         """Required to implement the Azure DB container
 
         Args:
@@ -18,15 +43,30 @@ class AzCosmosContainer:
             key (str): Database KEY found in Cosmos DB/setting/keys
             database_name (str): Database Name
             container_name (str): Container name 
+            clients (AzClientPool, optional): Shared clients, one is created when not given. Defaults to None.
+            workers (int, optional): Max batches sent at the same time. Defaults to 8.
+            change_feed (bool, optional): Track the table through its change feed, deletes are 
+                written as tombstones so they show up in the feed. Defaults to False.
+            page_size (int, optional): Items per page when scanning the table. Defaults to 1000.
+            state (LocalState, optional): Keeps the table cached for the change feed and its token 
+                between runs, without it the first read of each run is a full scan. Defaults to None.
         """    
         self.uri = uri
         self.key = key
         self.container_name = container_name
-        self.client = CosmosClient(self.uri, self.key)
+        self.clients = clients or AzClientPool(uri=uri, key=key)
+        self.client = self.clients.cosmos_client
         self.database_name = database_name
         self.container = None
         self.partitionkey = "/partitionKey"
         self.database = None
+        self.workers = max(1, int(workers))
+        self.change_feed = change_feed
+        self.page_size = int(page_size)
+        self.state = state
+        # FileIndex {fileName: fileTime} of the table as of self.continuation, for the change feed
+        self.cloud_items = None
+        self.continuation = None
     
     @property
     def create_load_db(self):
@@ -71,7 +111,7 @@ class AzCosmosContainer:
             attr_val (float): fileTime, Example: 42425435345.4243
         """
         try:
-            id_key_val = id_key_val.replace("\\", "&")
+            id_key_val = to_item_id(id_key_val)
             response = self.container.upsert_item(dict(id=id_key_val, fileTime=str(attr_val)))
             
             logger.info(f'Container: {self.container_name} Inserted: {response}')
@@ -84,30 +124,141 @@ class AzCosmosContainer:
             raise
         
                
-    def add_update_dictionary(self, dictionary:dict):
-        """Adds or Updates a dictionary of items in the cosmos DB Conatiner Table
+    @staticmethod
+    def _operation_id(operation:tuple) -> str:
+        """Item id of a batch operation: ("upsert", (item,)) or ("delete", (item_id,))"""
+        return operation[1][0] if operation[0] == "delete" else operation[1][0]["id"]
+    
+    
+    def _run_single(self, operation:tuple, par_key) -> float:
+        """Runs one batch operation on its own, used when its batch failed.
 
         Args:
-            dictionary (dict): Format: {fileName: fileTime}, 
-            Example: {'file11.txt': 464564564.564, 'file2.txt': 54465454.564} 
+            operation (tuple): ("upsert", (item,)) or ("delete", (item_id,))
+            par_key: Partition key value of the item.
+
+        Returns:
+            float: Request Units charged.
+        """
+        headers = {}
+        hook = lambda response_headers, result: headers.update(response_headers)
+        
+        if operation[0] == "upsert":
+            self.container.upsert_item(operation[1][0], response_hook=hook)
+        else:
+            self.container.delete_item(item=operation[1][0], partition_key=par_key, response_hook=hook)
+        
+        return float(headers.get('x-ms-request-charge', 0))
+    
+    
+    def _run_batch(self, par_key, operations:list) -> tuple:
+        """Runs one transactional batch, falls back to single requests if the batch fails.
+
+        Args:
+            par_key: Partition key value shared by all operations.
+            operations (list): Up to BATCH_LIMIT batch operations.
+
+        Returns:
+            tuple: ({item_id: "batch" | "single" | error}, Request Units, seconds)
         """
+        start = time.perf_counter()
+        outcome = {}
         try:
+            results = self.container.execute_item_batch(batch_operations=operations, partition_key=par_key)
+            charge = float(results.get_response_headers().get('x-ms-request-charge', 0))
+            outcome = {self._operation_id(operation): "batch" for operation in operations}
+        
+        except AzureError as err:
+            logger.error("Batch of %s failed, sending items one at a time. Here's why: %s", len(operations), err)
+            charge = 0.0
+            for operation in operations:
+                item_id = self._operation_id(operation)
+                try:
+                    charge += self._run_single(operation, par_key)
+                    outcome[item_id] = "single"
+                except AzureError as item_err:
+                    outcome[item_id] = item_err
+        
+        return outcome, charge, time.perf_counter() - start
+    
+    
+    def _run_batches(self, operations:list) -> dict:
+        """Groups operations per partition key into batches of BATCH_LIMIT 
+        and runs up to self.workers batches at the same time.
+
+        Args:
+            operations (list): [(partition key, batch operation)]
+
+        Returns:
+            dict: {item_id: "batch" | "single" | error}
+        """
+        if self.container is None:
             self.container = self.database.get_container_client(self.container_name)
+        
+        grouped = {}
+        for par_key, operation in operations:
+            grouped.setdefault(par_key, []).append(operation)
+        batches = [(par_key, ops[i:i + BATCH_LIMIT]) for par_key, ops in grouped.items() 
+                   for i in range(0, len(ops), BATCH_LIMIT)]
+        
+        outcome = {}
+        total_charge = 0.0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._run_batch, par_key, ops) for par_key, ops in batches]
+            
+            for future in as_completed(futures):
+                batch_outcome, charge, seconds = future.result()
+                outcome.update(batch_outcome)
+                total_charge += charge
+                logger.info(f'Container: {self.container_name} Batch: {len(batch_outcome)} items, '
+                            f'{charge:.2f} RU, {seconds * 1000:.0f} ms')
+        
+        failed = sum(1 for status in outcome.values() if isinstance(status, Exception))
+        if metrics.enabled:
+            kinds = {self._operation_id(operation): operation[0] for _, operation in operations}
+            tally = {}
+            for item_id, status in outcome.items():
+                key = (kinds.get(item_id, 'upsert'), 'failed' if isinstance(status, Exception) else status)
+                tally[key] = tally.get(key, 0) + 1
+            for (kind, result), items in tally.items():
+                metrics.count('db_items_total', items, op=kind, result=result)
+            metrics.count('db_batches_total', len(batches))
+            metrics.count('db_request_units_total', total_charge, op='write')
+        logger.info(f'Container: {self.container_name} {len(outcome)} items in {len(batches)} batches, '
+                    f'{failed} failed, {total_charge:.2f} RU, {time.perf_counter() - start:.2f}s')
+        return outcome
+    
+               
+    def add_update_dictionary(self, dictionary:dict, hashes:dict=None) -> dict:
+        """Adds or Updates a dictionary of items in the cosmos DB Conatiner Table.
+        Items are sent in transactional batches per partition key.
 
-            for key,value in dictionary.items():
-                
-                key = key.replace('/', '\\')
-                #key = os.path.abspath(key)
-                
-                response = self.container.upsert_item(dict(id=key.replace("\\", "&"), fileTime=str(value)))
-                
-                logger.info(f'Container: {self.container_name} Inserted: {response}')
+        Args:
+            dictionary (dict): Format: {fileName: fileTime}, 
+            Example: {'file11.txt': 464564564.564, 'file2.txt': 54465454.564} 
+            hashes (dict, optional): Format: {fileName: fileHash}, stored with fileTime. Defaults to None.
+
+        Returns:
+            dict: {id: "batch" | "single" | error} outcome per item.
+        """
+        operations = []
+        hashes = hashes or {}
+        for key,value in dictionary.items():
+            
+            file_hash = hashes.get(key)
+            item = dict(id=to_item_id(key), fileTime=str(value))
+            if file_hash:
+                item["fileHash"] = file_hash
+            operations.append((NonePartitionKeyValue, ("upsert", (item,))))
+        
+        try:
+            return self._run_batches(operations)
                 
         except AzureError as err:
             logger.error(
-                "Couldn't add file %s to table %s. Here's why: %s: %s",
-                dictionary, self.table.name,
-                err.message['Error']['Code'], err.message['Error']['Message'])
+                "Couldn't add file %s to table %s. Here's why: %s",
+                dictionary, self.container_name, err)
             raise
             
     
@@ -120,10 +271,9 @@ class AzCosmosContainer:
         """
         try:
             
-            item = item.replace('/', '\\')
             #item = os.path.abspath(item)
             
-            response = self.container.delete_item(item=item.replace("\\", "&"), partition_key=par_key)
+            response = self.container.delete_item(item=to_item_id(item), partition_key=par_key)
             
             logger.info(f'Item: {item} Deletion of Table Item Complete')
         
@@ -134,53 +284,51 @@ class AzCosmosContainer:
             raise
 
     
-    def delete_item_list(self, item_list:list, par_key={}):
-        """Deletes a item from the table.
+    def delete_item_list(self, item_list:list, par_key={}) -> dict:
+        """Deletes a list of items from the table in transactional batches.
 
         Args:
             item_list (list): fileName, The str() of the item to delete.
             par_key (dict, optional): Partition Key if needed. Defaults to {}.
+
+        Returns:
+            dict: {id: "batch" | "single" | error} outcome per item.
         """
+        # {} is the items without a partitionKey field
+        par_key = NonePartitionKeyValue if par_key == {} else par_key
+        item_ids = [to_item_id(item) for item in item_list]
+        
+        if self.change_feed:
+            # The change feed does not report deletes, leave a tombstone instead
+            operations = [(par_key, ("upsert", (dict(id=item_id, fileTime="0", deleted=True),))) for item_id in item_ids]
+        else:
+            operations = [(par_key, ("delete", (item_id,))) for item_id in item_ids]
+        
         try:
+            outcome = self._run_batches(operations)
             
-            for item in item_list:
-            
-                item = item.replace('/', '\\')
-                #item = os.path.abspath(item)
-                
-                response = self.container.delete_item(item=item.replace("\\", "&"), partition_key=par_key)
-                
-                logger.info(f'Item: {item} Deletion of Table Item Complete {response}')
+            for item, status in outcome.items():
+                if isinstance(status, Exception):
+                    logger.error(f'Item: {item} Deletion of Table Item Failed: {status}')
+            return outcome
         
         except AzureError as err:
             logger.error(
-                "Couldn't delete item %s. Here's why: %s: %s", item, par_key,
-                err.message['Error']['Code'], err.message['Error']['Message'])
+                "Couldn't delete items %s. Here's why: %s", item_list, err)
             raise
     
     
-    def delete_item_dict(self, dictionary:dict, par_key={}):
+    def delete_item_dict(self, dictionary:dict, par_key={}) -> dict:
         """Deletes a dictionary of items from the table.
 
         Args:
             dictionary (dict): {fileName, fileTime}, dict of items to delete from table
             par_key (dict, optional): Partition Key if needed. Defaults to {}.
-        """
-        try:
-            for item in dictionary:
-                
-                item = item.replace("/", "\\")
-                #item = os.path.abspath(item)
-                response = self.container.delete_item(item=item.replace("\\", "&"), partition_key=par_key)
-                
-                logger.info(f'Item: {item} Deletion Complete {response}')
 
-                
-        except AzureError as err:
-            logger.error(
-                "Couldn't delete dictionary %s. Here's why: %s: %s", response,
-                err.message['Error']['Code'], err.message['Error']['Message'])
-            raise
+        Returns:
+            dict: {id: "batch" | "single" | error} outcome per item.
+        """
+        return self.delete_item_list(list(dictionary), par_key=par_key)
     
     
     def get_item(self, item:str, par_key={}) -> dict:
@@ -210,8 +358,8 @@ class AzCosmosContainer:
 
 
     @property
-    def scan_all_items(self) -> dict:
-        """Scans 'All Items and converts to dictionary format ' 
+    def scan_all_documents(self) -> dict:
+        """Scans 'All Items as full documents and converts to dictionary format ' 
 
         Returns:
             dict: All items in the give container_name table. 
@@ -224,7 +372,9 @@ class AzCosmosContainer:
             
             for item in items:
                 
-                file_time_list[item["id"].replace('&', '\\')] = float(item['fileTime'])
+                if item.get("deleted"):
+                    continue
+                file_time_list[to_file_name(item["id"])] = float(item['fileTime'])
                         
         except AzureError as err:
             logger.error(
@@ -234,6 +384,158 @@ class AzCosmosContainer:
         
         else:
             return file_time_list
+    
+    
+    def _scan_range(self, rows:list, feed_range:dict=None) -> tuple:
+        """Streams one feed range of SCAN_QUERY into rows, page by page.
+
+        Args:
+            rows (list): Format: [(fileName:str, fileTime:float)]
+            feed_range (dict, optional): Feed range to query, whole table when None. Defaults to None.
+
+        Returns:
+            tuple: (pages read, Request Units)
+        """
+        charges = []
+        hook = lambda response_headers, result: charges.append(float(response_headers.get('x-ms-request-charge', 0)))
+        
+        if feed_range is None:
+            pager = self.container.query_items(
+                query=SCAN_QUERY, enable_cross_partition_query=True, 
+                max_item_count=self.page_size, response_hook=hook)
+        else:
+            pager = self.container.query_items(
+                query=SCAN_QUERY, feed_range=feed_range, 
+                max_item_count=self.page_size, response_hook=hook)
+        
+        pages = 0
+        for page in pager.by_page():
+            for item in page:
+                rows.append((sys.intern(to_file_name(item["id"])), float(item['fileTime'])))
+            pages += 1
+        
+        return pages, sum(charges)
+    
+    
+    @property
+    def scan_all_items(self) -> FileIndex:
+        """Scans 'All Items and converts to dictionary format ' 
+        Only id and fileTime are fetched, in pages of self.page_size, 
+        with each feed range (physical partition) read in parallel.
+
+        Returns:
+            FileIndex: All items in the give container_name table. 
+            Format: {fileName:str, fileTime:float}
+        """
+        rows = []
+        start = time.perf_counter()
+        
+        try:
+            try:
+                feed_ranges = list(self.container.read_feed_ranges())
+            except (AzureError, AttributeError):
+                feed_ranges = [None]
+            
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(feed_ranges)) or 1) as pool:
+                results = list(pool.map(lambda feed_range: self._scan_range(rows, feed_range), feed_ranges))
+            file_time_list = FileIndex(rows)
+                        
+        except AzureError as err:
+            logger.error(
+                "Couldn't scan for items. Here's why: %s", err)
+            raise
+        
+        else:
+            metrics.count('db_scan_pages_total', sum(pages for pages, _ in results))
+            metrics.count('db_request_units_total', sum(charge for _, charge in results), op='scan')
+            metrics.gauge('db_scanned_items', len(file_time_list))
+            logger.info(f'Container: {self.container_name} scanned {len(file_time_list)} items, '
+                        f'{sum(pages for pages, _ in results)} pages from {len(feed_ranges)} ranges, '
+                        f'{sum(charge for _, charge in results):.2f} RU, {time.perf_counter() - start:.2f}s')
+            return file_time_list
+    
+    
+    def _read_changes(self, file_time_list:FileIndex, changed:dict=None, **kwargs) -> tuple:
+        """Applies the change feed to file_time_list in place.
+
+        Args:
+            file_time_list (FileIndex or dict): Format: {fileName:str, fileTime:float}
+            changed (dict, optional): Filled with {fileName: fileTime or None} of each change. Defaults to None.
+            **kwargs: continuation or start_time for query_items_change_feed.
+
+        Returns:
+            tuple: (number of changes, continuation token)
+        """
+        changes = 0
+        for item in self.container.query_items_change_feed(**kwargs):
+            
+            file_name = to_file_name(item["id"])
+            file_time = None if item.get("deleted") else float(item['fileTime'])
+            if file_time is None:
+                file_time_list.pop(file_name, None)
+            else:
+                file_time_list[file_name] = file_time
+            if changed is not None:
+                changed[file_name] = file_time
+            changes += 1
+        
+        return changes, self.container.client_connection.last_response_headers.get('etag')
+    
+    
+    @property
+    def scan_changes(self) -> FileIndex:
+        """Reads only the items changed since the last call from the change feed 
+        and applies them to the cached table. The table is kept in memory between calls 
+        and in self.state between runs, where only the changed items are written. 
+        Falls back to scan_all_items on first run or when the token is lost.
+
+        Returns:
+            FileIndex: All items in the give container_name table. 
+            Format: {fileName:str, fileTime:float}
+        """
+        if self.cloud_items is None and self.state is not None:
+            self.cloud_items, self.continuation = self.state.load_cloud_items()
+        
+        if self.cloud_items is not None and self.continuation:
+            try:
+                changed = {}
+                changes, token = self._read_changes(self.cloud_items, changed, continuation=self.continuation)
+                metrics.count('db_feed_changes_total', changes)
+                logger.info(f'Container: {self.container_name} change feed: {changes} changes')
+                if changes or token != self.continuation:
+                    self._save_cloud_items(changed, token)
+                return self.cloud_items
+            
+            except AzureError as err:
+                logger.error("Change feed token rejected, doing a full scan. Here's why: %s", err)
+        
+        try:
+            # Take the token first so nothing written during the scan is missed
+            changes, token = self._read_changes({}, start_time="Now")
+            file_time_list = self.scan_all_items
+            logger.info(f'Container: {self.container_name} full scan: {len(file_time_list)} items')
+        
+        except AzureError as err:
+            logger.error(
+                "Couldn't read the change feed. Here's why: %s", err)
+            raise
+        
+        self.cloud_items = file_time_list
+        self._save_cloud_items(file_time_list, token, replace=True)
+        return file_time_list
+    
+    
+    def _save_cloud_items(self, changes:dict, token:str, replace:bool=False) -> None:
+        """Moves to token, and writes changes to self.state when there is one.
+
+        Args:
+            changes (FileIndex or dict): Format: {fileName: fileTime or None}
+            token (str): Continuation token of the change feed.
+            replace (bool, optional): changes is the whole table. Defaults to False.
+        """
+        self.continuation = token
+        if self.state is not None:
+            self.state.save_cloud_items(changes, token, replace=replace)
 
 
 if __name__ == "__main__":
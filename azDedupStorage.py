@@ -0,0 +1,359 @@
+import io
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from log import setup_logger
+from azure.core.exceptions import AzureError
+from azClients import AzClientPool
+from azStorage import AZBlobStorage, PARTIAL_SUFFIX, HASH_KEY, MANIFEST_KEY, local_path, stat_metadata
+from blobCodec import CODEC_KEY, compressor, worth_compressing
+from chunker import chunk_sizes, iter_chunks
+
+logger=setup_logger(__name__)
+
+# Blob name prefix of the shared chunk store, file names never start with it.
+CHUNK_PREFIX = '.azchunks/'
+# Chunks are kept this long after this client first saw them unreferenced,
+# another client may be about to commit a manifest that uses them.
+SWEEP_GRACE_SEC = 86400
+
+class AZDedupStorage(AZBlobStorage):
+
+    """AZBlobStorage that keeps each unique chunk of content once.
+
+    Files are cut with content-defined chunking and every chunk is stored as
+    CHUNK_PREFIX + sha256. The blob at the file's name holds a small JSON
+    manifest of its chunks, so the listing, times, hashes and DB records
+    work as with AZBlobStorage. Copies, renames and appends only send the
+    chunks the store doesn't have yet. Files smaller than one chunk are
+    stored as plain blobs.
+    """
+
+    def __init__(self, working_dir: str, conn_str: str, container: str, workers: int=8,
+                 clients: AzClientPool=None, chunk_kb: int=1024, compression: str='',
+                 cache_name: str='dedup-manifests.json', list_workers: int=1):
+        """
+        :param container: container name. 'example-container'
+        :param conn_str: str() found in Azure Console storage container key section.
+        :param workers: int() max number of concurrent transfers.
+        :param clients: AzClientPool() shared clients, one is created when not given.
+        :param chunk_kb: int() average chunk size in KB, chunks are 1/4 to 4 times it.
+        :param compression: str() 'zstd' or 'gzip' compresses chunks, '' sends them as they are.
+        :param cache_name: str() local copy of the manifests, refreshed by etag.
+        :param list_workers: int() top-level prefixes listed at the same time, 1 lists the container as one.
+        """
+        super().__init__(working_dir=working_dir, conn_str=conn_str, container=container,
+                         workers=workers, clients=clients, compression=compression, list_workers=list_workers)
+        self.min_size, self.avg_size, self.max_size = chunk_sizes(chunk_kb)
+        self.cache_name = cache_name
+        self._chunk_lock = threading.Lock()
+        # {"sha256": float} chunks in the store, from the last listing and uploads since
+        self.chunk_index = None
+        # {"blob name": [etag, ["sha256"]]} chunk lists of the manifests in the container
+        self.manifests = {}
+        # {"sha256": float} when each chunk was first seen unreferenced by this client
+        self.unreferenced = {}
+        # {"blob name": etag} manifests seen by the current listing
+        self._listed_manifests = {}
+
+        if os.path.exists(self.cache_name):
+            try:
+                with open(self.cache_name, 'r') as data:
+                    cache = json.loads(data.read())
+                if isinstance(cache.get("manifests"), dict):
+                    self.manifests = cache["manifests"]
+                    self.unreferenced = cache.get("unreferenced", {})
+                else:
+                    # cache of an older version, manifests only
+                    self.manifests = cache
+            except (OSError, ValueError, AttributeError) as err:
+                logger.error("Failed: %s Issue: manifest cache unreadable, starting empty" % err)
+
+
+    def _upload(self, container_client, file_name, file_hash=None) ->tuple:
+        """Uploads the chunks of a file the store doesn't have, then its manifest.
+
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param file_name: str() filename.
+            :param file_hash: str() content hash saved as manifest metadata.
+
+         Returns:
+            tuple(): (manifest upload response, bytes sent, (local mtime, size) saved as metadata)
+        """
+        file_path = local_path(self.working_dir, file_name)
+        if os.path.getsize(file_path) < self.min_size:
+            return super()._upload(container_client, file_name, file_hash)
+
+        chunk_index = self._chunk_index(container_client)
+        chunks = []
+        sent = 0
+        size = 0
+        new_chunks = 0
+        with open(file_path, 'rb') as file_data:
+            stat = os.fstat(file_data.fileno())
+            for chunk in iter_chunks(file_data, self.min_size, self.avg_size, self.max_size):
+                chunk_hash = hashlib.sha256(chunk).hexdigest()
+                size += len(chunk)
+                chunks.append(chunk_hash)
+                if chunk_hash in chunk_index:
+                    continue
+
+                sent += self._put_chunk(container_client, file_name, chunk_hash, chunk)
+                new_chunks += 1
+                with self._chunk_lock:
+                    chunk_index[chunk_hash] = time.time()
+
+        manifest = json.dumps({"size": size, "chunks": chunks}).encode()
+        metadata = dict(stat_metadata(stat), **{MANIFEST_KEY: '1'})
+        if file_hash:
+            metadata[HASH_KEY] = file_hash
+        response = container_client.get_blob_client(blob=file_name).upload_blob(
+            manifest, overwrite=True, metadata=metadata)
+        sent += len(manifest)
+
+        with self._chunk_lock:
+            # same name as the listing, the service stores '\\' as '/'
+            self.manifests[file_name.replace("\\", "/")] = [response['etag'], chunks]
+        self._count_transfer(raw_bytes=size, wire_bytes=sent)
+        logger.info(f'Dedup Upload: {file_name}: {new_chunks} of {len(chunks)} chunks sent')
+
+        return response, sent, (stat.st_mtime, stat.st_size)
+
+
+    def _put_chunk(self, container_client, file_name, chunk_hash, chunk) ->int:
+        """Uploads one chunk, compressed when self.compression is set and it pays off.
+
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param file_name: str() file the chunk came from, its extension decides compression.
+            :param chunk_hash: str() sha256 of the chunk.
+            :param chunk: bytes() chunk content.
+
+         Returns:
+            int(): bytes sent
+        """
+        data = chunk
+        metadata = None
+        if self.compression and worth_compressing(file_name, io.BytesIO(chunk)):
+            start = time.thread_time()
+            compress = compressor(self.compression)
+            data = compress.compress(chunk) + compress.flush()
+            self._count_transfer(codec_cpu_sec=time.thread_time() - start)
+            metadata = {CODEC_KEY: self.compression}
+
+        container_client.get_blob_client(blob=CHUNK_PREFIX + chunk_hash).upload_blob(
+            data, overwrite=True, metadata=metadata)
+        return len(data)
+
+
+    def _chunk_index(self, container_client) ->dict:
+        """Chunks in the store, listed once when blob_file_time_list hasn't run yet.
+
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+
+         Returns:
+            dict(): {"sha256": float}
+        """
+        with self._chunk_lock:
+            if self.chunk_index is None:
+                self.chunk_index = {
+                    blob.name[len(CHUNK_PREFIX):]: blob.last_modified.timestamp()
+                    for blob in container_client.list_blobs(name_starts_with=CHUNK_PREFIX)}
+            return self.chunk_index
+
+
+    def _download(self, container_client, file_name) ->str:
+        """Downloads a file to a temp file next to the target and renames it into place.
+        A manifest is rebuilt from its chunks, each checked against its sha256,
+        other blobs are written as they are.
+
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param file_name: str() of blob.
+
+         Returns:
+            str(): Call Back Status
+        """
+        file_path = local_path(self.working_dir, file_name)
+        part_path = file_path + PARTIAL_SUFFIX
+        blob_client = container_client.get_blob_client(blob=file_name)
+
+        try:
+            blob_data = blob_client.download_blob()
+            with open(part_path, "wb") as data:
+                if MANIFEST_KEY in (blob_data.properties.metadata or {}):
+                    manifest = json.loads(blob_data.readall())
+                    for chunk_hash in manifest['chunks']:
+                        data.write(self._get_chunk(container_client, chunk_hash))
+                else:
+                    self._write_blob(blob_data, data)
+            os.replace(part_path, file_path)
+
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+        return f'Downloaded: {blob_data.properties}'
+
+
+    def _get_chunk(self, container_client, chunk_hash) ->bytes:
+        """Downloads one chunk and checks its content against chunk_hash.
+
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param chunk_hash: str() sha256 of the chunk.
+
+         Returns:
+            bytes(): chunk content
+        """
+        buffer = io.BytesIO()
+        blob_data = container_client.get_blob_client(blob=CHUNK_PREFIX + chunk_hash).download_blob()
+        self._write_blob(blob_data, buffer)
+        chunk = buffer.getvalue()
+        if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+            raise ValueError(f"Chunk {chunk_hash} is corrupt")
+        return chunk
+
+
+    def _skip_listed(self, blob) ->bool:
+        """Keeps chunks out of the snapshot and notes the manifests seen.
+
+        Args:
+            :param blob: BlobProperties from list_blobs.
+        """
+        if blob.name.startswith(CHUNK_PREFIX):
+            self.chunk_index[blob.name[len(CHUNK_PREFIX):]] = blob.last_modified.timestamp()
+            return True
+        if blob.metadata and MANIFEST_KEY in blob.metadata:
+            self._listed_manifests[blob.name] = blob.etag
+        return False
+
+
+    @property
+    def blob_file_time_list(self) ->dict:
+        """Lists the container like AZBlobStorage.blob_file_time_list, chunks left out.
+        Manifests whose etag changed are read again, then chunks no manifest
+        has referenced for SWEEP_GRACE_SEC are deleted.
+
+         Returns:
+            FileIndex(): {"path\\filename": float}, the live snapshot.
+        """
+        with self._chunk_lock:
+            self.chunk_index = {}
+            self._listed_manifests = {}
+
+        cloud_list = super().blob_file_time_list
+        if self.cloud_index is cloud_list and self._refresh_manifests():
+            self._sweep_chunks()
+        self._save_cache()
+        return cloud_list
+
+
+    def _refresh_manifests(self) ->bool:
+        """Reads the manifests listed with a new etag and drops the ones that are gone.
+
+         Returns:
+            bool(): True when every listed manifest is known.
+        """
+        listed = self._listed_manifests
+        stale = [name for name, etag in listed.items() if self.manifests.get(name, [None])[0] != etag]
+        complete = True
+
+        container_client = self.clients.container_client(self.container)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._read_manifest, container_client, name): name for name in stale}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    self.manifests[name] = future.result()
+                except (AzureError, ValueError, KeyError) as err:
+                    complete = False
+                    logger.error("Couldn't read manifest %s. Here's why: %s", name, err)
+
+        for name in [name for name in self.manifests if name not in listed]:
+            del self.manifests[name]
+
+        return complete
+
+
+    def _save_cache(self) ->None:
+        """Writes the manifests and the unreferenced chunk times to self.cache_name.
+        """
+        try:
+            with open(self.cache_name, 'w') as data:
+                data.write(json.dumps({"manifests": self.manifests, "unreferenced": self.unreferenced}))
+        except OSError as err:
+            logger.error("Failed: %s Issue" % err)
+
+
+    def _read_manifest(self, container_client, name) ->list:
+        """Downloads one manifest.
+
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param name: str() blob name.
+
+         Returns:
+            list(): [etag, ["sha256"]]
+        """
+        blob_data = container_client.get_blob_client(blob=name).download_blob()
+        return [blob_data.properties.etag, json.loads(blob_data.readall())['chunks']]
+
+
+    def _referenced(self) ->set:
+        """Chunks used by at least one manifest.
+
+         Returns:
+            set(): {"sha256"}
+        """
+        return {chunk_hash for _, chunks in self.manifests.values() for chunk_hash in chunks}
+
+
+    def _sweep_chunks(self) ->None:
+        """Deletes chunks no manifest has referenced for SWEEP_GRACE_SEC.
+        The grace counts from when this client first saw the chunk unreferenced, not from
+        the chunk's upload, since a client reusing an old chunk doesn't write it again.
+        The manifests are listed and read again right before deleting, a chunk a manifest
+        took up in the meantime is kept.
+        """
+        referenced = self._referenced()
+        now = time.time()
+        self.unreferenced = {chunk_hash: self.unreferenced.get(chunk_hash, now) 
+                             for chunk_hash in self.chunk_index if chunk_hash not in referenced}
+        cutoff = now - SWEEP_GRACE_SEC
+        if not any(seen < cutoff for seen in self.unreferenced.values()):
+            return
+
+        # a client may have committed a manifest using them since the listing
+        with self._chunk_lock:
+            self.chunk_index = {}
+            self._listed_manifests = {}
+        try:
+            self._list_container(include=['metadata'], skip=lambda blob: self._skip_listed(blob) or True)
+        except AzureError as err:
+            logger.error("Couldn't list the manifests again, sweep skipped. Here's why: %s", err)
+            return
+        if not self._refresh_manifests():
+            return
+
+        referenced = self._referenced()
+        orphans = [chunk_hash for chunk_hash, seen in self.unreferenced.items() 
+                   if seen < cutoff and chunk_hash not in referenced and chunk_hash in self.chunk_index]
+        for chunk_hash in referenced.intersection(self.unreferenced):
+            del self.unreferenced[chunk_hash]
+        if not orphans:
+            return
+
+        logger.info(f'Dedup Sweep: deleting {len(orphans)} unreferenced chunks')
+        self.delete_list([CHUNK_PREFIX + chunk_hash for chunk_hash in orphans])
+        for chunk_hash in orphans:
+            if CHUNK_PREFIX + chunk_hash not in self.failed:
+                self.chunk_index.pop(chunk_hash, None)
+                self.unreferenced.pop(chunk_hash, None)
+        self.failed = {}
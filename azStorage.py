@@ -1,26 +1,119 @@
 # https://github.com/Azure/azure-sdk-for-python/tree/main/sdk/storage/azure-storage-blob/samplessto
 
 import os
+import sys
+import mmap
+import time
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import config
 from log import setup_logger
-from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import AzureError
-from azure.storage.blob import BlobClient
+from metrics import metrics
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock, BlobPrefix
+from azClients import AzClientPool
+from containerManifest import ContainerManifest, MANIFEST_BLOB
+from fileIndex import FileIndex, sorted_columns
+from blobCodec import CODEC_KEY, CHUNK_SIZE, available, compressor, decompressor, worth_compressing
 
 logger=setup_logger(__name__)
 
+# Downloads are written here first and renamed when complete.
+PARTIAL_SUFFIX = '.azpart'
+# Blob Storage limit of sub-requests in one batch request.
+DELETE_BATCH_LIMIT = 256
+# Blob metadata key holding the sha256 of the uploaded file.
+HASH_KEY = 'contenthash'
+# Blob metadata key marking a chunk manifest written by AZDedupStorage.
+MANIFEST_KEY = 'azmanifest'
+# Blob metadata keys holding the local mtime and size of the uploaded file.
+MTIME_KEY = 'azmtime'
+SIZE_KEY = 'azsize'
+# Blocks a block blob can commit, bigger files get bigger blocks.
+MAX_BLOCKS = 50000
+# Levels walked down while the delimiter listing finds a single prefix, blob names
+# start with a separator so the first level is only the root '/'.
+PREFIX_DEPTH = 4
+
+
+def local_path(working_dir: str, file_name: str) -> str:
+    """working_dir joined with a file or blob name, '/' and '\\' both read as separators.
+    
+    :param working_dir: str() backup folder.
+    :param file_name: str() "path/filename" or "path\\filename".
+    """
+    return os.path.join(working_dir, *file_name.replace('\\', '/').split('/'))
+
+
+def stat_metadata(stat: os.stat_result) -> dict:
+    """Blob metadata recording the local mtime and size of an uploaded file.
+    
+    :param stat: os.stat_result of the file.
+    """
+    return {MTIME_KEY: repr(stat.st_mtime), SIZE_KEY: str(stat.st_size)}
+
+
+def listed_stats(metadata: dict) -> tuple:
+    """(mtime, size) recorded by stat_metadata, None when the blob has none.
+    
+    :param metadata: dict() blob metadata.
+    """
+    try:
+        return float(metadata[MTIME_KEY]), int(metadata[SIZE_KEY])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
 class AZBlobStorage:
     
     """Encapsulates an Azure Blob Storage Container."""
     
-    def __init__(self, working_dir: str, conn_str: str, container: str):
+    def __init__(self, working_dir: str, conn_str: str, container: str, workers: int=8, 
+                 clients: AzClientPool=None, delta_min_size: int=0, block_size: int=4194304, 
+                 compression: str='', container_manifest: bool=False, list_workers: int=1, 
+                 large_file_size: int=0, block_workers: int=4):
         """
         :param container: container name. 'example-container'
         :param conn_str: str() found in Azure Console storage container key section.
+        :param workers: int() max number of concurrent transfers.
+        :param clients: AzClientPool() shared clients, one is created when not given.
+        :param delta_min_size: int() files this big or bigger only send changed blocks, 0 turns it off.
+        :param block_size: int() block size in bytes for delta and large file uploads.
+        :param compression: str() 'zstd' or 'gzip' compresses uploads, '' sends files as they are.
+        :param container_manifest: bool() read the listing from a manifest blob kept by the writers.
+        :param list_workers: int() top-level prefixes listed at the same time, 1 lists the container as one.
+        :param large_file_size: int() files this big or bigger are sent as blocks staged in parallel, 0 turns it off.
+        :param block_workers: int() blocks of one file staged at the same time.
         """
         self.working_dir = working_dir
         self.conn_str = conn_str
         self.container = container
+        self.clients = clients or AzClientPool(conn_str=conn_str)
+        self.workers = max(1, int(workers))
+        self.list_workers = max(1, int(list_workers))
+        self.delta_min_size = int(delta_min_size)
+        self.block_size = int(block_size)
+        self.large_file_size = int(large_file_size)
+        self.block_workers = max(1, int(block_workers))
+        self.compression = compression if compression in ('zstd', 'gzip') else ''
+        if self.compression and not available(self.compression):
+            logger.error(f"Codec {self.compression} not installed, using gzip")
+            self.compression = 'gzip'
+        self.failed = {}
+        # Bytes read/written locally vs sent/received, and codec CPU seconds
+        self._stats_lock = threading.Lock()
+        self.transfer_stats = dict(raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0)
+        # Listing snapshot, FileIndex {"path\\filename": float} taken by blob_file_time_list,
+        # the etags, hashes and stats below are FileIndex over the same names once listed
+        self.cloud_index = None
+        self.cloud_etags = {}
+        self.cloud_hashes = {}
+        # {"path\\filename": (mtime, size)} of the local file each listed blob was uploaded from
+        self.cloud_stats = {}
+        # Manifest blob standing in for the listing, None lists the container every run
+        self.container_manifest = ContainerManifest(self.clients, container) if container_manifest else None
         
     
     def create_container(self,new_container) ->str:
@@ -29,7 +122,7 @@ class AZBlobStorage:
         :param new_container: new container string
         """
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
+            blob_service_client = self.clients.blob_service_client
             response = blob_service_client.create_container(new_container)
 
             logger.info(response.url)
@@ -51,7 +144,7 @@ class AZBlobStorage:
         :param container: container string
         """        
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
+            blob_service_client = self.clients.blob_service_client
             response = blob_service_client.delete_container(container=container)
         
         except AzureError as err:
@@ -78,12 +171,9 @@ class AZBlobStorage:
             str(): Call Back Status
         """
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
-            blob_client = blob_service_client.get_blob_client(container=self.container, blob=file_name)
-                
-            with open(self.working_dir + "\\" + file_name, 'rb') as file_data:
-                response = blob_client.upload_blob(file_data, overwrite=True)
+            response, _, stats = self._upload(self.clients.container_client(self.container), file_name)
             
+            self._index_put(file_name, response, stats=stats)
             logger.info(f'Upload: {file_name}: {response}')
             
         except AzureError as err:
@@ -96,29 +186,225 @@ class AZBlobStorage:
         return f"Uploaded: {file_name}: {response}"
             
      
-    def put_list(self, file_list) ->list:
-        """Uploads or Puts a list of files to container
+    def _upload(self, container_client, file_name, file_hash=None) ->tuple:
+        """Uploads a single file with a shared container client, used by the put_list workers.
+        Files of self.delta_min_size or more go through _upload_delta, other files of 
+        self.large_file_size or more through _upload_blocks, the rest is one upload_blob.
+        
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param file_name: str() filename.
+            :param file_hash: str() content hash saved as blob metadata.
+        
+         Returns:
+            tuple(): (upload response, bytes sent, (local mtime, size) saved as blob metadata)
+        """
+        blob_client = container_client.get_blob_client(blob=file_name)
+        with open(local_path(self.working_dir, file_name), 'rb') as file_data:
+            stat = os.fstat(file_data.fileno())
+            size = stat.st_size
+            metadata = stat_metadata(stat)
+            if file_hash:
+                metadata[HASH_KEY] = file_hash
+            if self.delta_min_size and size >= self.delta_min_size:
+                response, sent = self._upload_delta(blob_client, file_data, metadata)
+            
+            elif self.large_file_size and size >= self.large_file_size:
+                response, sent = self._upload_blocks(blob_client, file_data, size, metadata)
+            
+            elif self.compression and worth_compressing(file_name, file_data):
+                metadata[CODEC_KEY] = self.compression
+                counter = dict(raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0)
+                response = blob_client.upload_blob(
+                    self._compress(file_data, counter), overwrite=True, metadata=metadata)
+                self._count_transfer(**counter)
+                return response, counter['wire_bytes'], (stat.st_mtime, size)
+            
+            else:
+                response = blob_client.upload_blob(file_data, overwrite=True, metadata=metadata)
+                sent = size
+        
+        self._count_transfer(raw_bytes=size, wire_bytes=sent)
+        return response, sent, (stat.st_mtime, size)
+    
+    
+    def _compress(self, file_data, counter) ->object:
+        """Reads file_data in CHUNK_SIZE pieces and yields them compressed.
+        
+        Args:
+            :param file_data: file object open for reading.
+            :param counter: dict() raw_bytes, wire_bytes and codec_cpu_sec, added to in place.
+        
+         Returns:
+            generator: compressed chunks for upload_blob.
+        """
+        compress = compressor(self.compression)
+        for chunk in iter(lambda: file_data.read(CHUNK_SIZE), b''):
+            start = time.thread_time()
+            out = compress.compress(chunk)
+            counter['codec_cpu_sec'] += time.thread_time() - start
+            counter['raw_bytes'] += len(chunk)
+            if out:
+                counter['wire_bytes'] += len(out)
+                yield out
+        
+        start = time.thread_time()
+        out = compress.flush()
+        counter['codec_cpu_sec'] += time.thread_time() - start
+        if out:
+            counter['wire_bytes'] += len(out)
+            yield out
+    
+    
+    def _count_transfer(self, raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0) ->None:
+        with self._stats_lock:
+            self.transfer_stats['raw_bytes'] += raw_bytes
+            self.transfer_stats['wire_bytes'] += wire_bytes
+            self.transfer_stats['codec_cpu_sec'] += codec_cpu_sec
+        metrics.count('transfer_bytes_total', raw_bytes, kind='raw')
+        metrics.count('transfer_bytes_total', wire_bytes, kind='wire')
+        if codec_cpu_sec:
+            metrics.count('codec_cpu_seconds_total', codec_cpu_sec)
+    
+    
+    def pop_transfer_stats(self) ->dict:
+        """Returns the transfer counters since the last call and resets them.
+        
+         Returns:
+            dict(): raw_bytes, wire_bytes and codec_cpu_sec
+        """
+        with self._stats_lock:
+            stats = self.transfer_stats
+            self.transfer_stats = dict(raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0)
+        return stats
+    
+    
+    def _upload_delta(self, blob_client, file_data, metadata=None) ->tuple:
+        """Uploads only the blocks that changed since the last upload.
+        The file is cut into self.block_size blocks and each block id is the 
+        sha256 of its bytes, so the committed block list of the blob is the 
+        record of per-block hashes. Blocks already committed are reused 
+        by id in Put Block List, only new ones are sent with Put Block.
+        
+        Args:
+            :param blob_client: BlobClient of the target blob.
+            :param file_data: file object open for reading.
+            :param metadata: dict() blob metadata.
+        
+         Returns:
+            tuple(): (commit response, bytes sent)
+        """
+        try:
+            committed, _ = blob_client.get_block_list('committed')
+            committed = {block.id for block in committed}
+        except ResourceNotFoundError:
+            committed = set()
+        
+        return self._upload_blocks(blob_client, file_data, os.fstat(file_data.fileno()).st_size, metadata, committed)
+    
+    
+    def _upload_blocks(self, blob_client, file_data, size, metadata=None, committed=frozenset()) ->tuple:
+        """Stages the file as blocks, self.block_workers at a time, then commits the block list.
+        The file is cut into self.block_size blocks (bigger when it would take more than 
+        MAX_BLOCKS), each block id is the sha256 of its bytes like _upload_delta. Blocks are 
+        read with os.pread, or from a memory map where there is none (Windows, which refuses 
+        to truncate a mapped file), so a file cut short while it uploads fails with OSError 
+        instead of a fault on the map. Every block is sent with validate_content, the SDK 
+        sends its MD5 and the service rejects a block that doesn't match it.
+        
+        Args:
+            :param blob_client: BlobClient of the target blob.
+            :param file_data: file object open for reading.
+            :param size: int() file size, more than 0.
+            :param metadata: dict() blob metadata.
+            :param committed: set() of block ids the blob already has, reused instead of sent.
+        
+         Returns:
+            tuple(): (commit response, bytes sent)
+        """
+        block_size = max(self.block_size, -(-size // MAX_BLOCKS))
+        staged = set()
+        staged_lock = threading.Lock()
+        fd = file_data.fileno()
+        view = None if hasattr(os, 'pread') else mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        
+        def stage(offset):
+            length = min(block_size, size - offset)
+            block = os.pread(fd, length, offset) if view is None else view[offset:offset + length]
+            if len(block) != length:
+                raise OSError(f'{blob_client.blob_name} shrank while it was uploaded')
+            block_id = base64.b64encode(hashlib.sha256(block).digest()).decode()
+            with staged_lock:
+                if block_id in committed or block_id in staged:
+                    return block_id, 0
+                staged.add(block_id)
+            
+            blob_client.stage_block(block_id=block_id, data=block, length=length, validate_content=True)
+            return block_id, length
+        
+        pool = ThreadPoolExecutor(max_workers=self.block_workers)
+        try:
+            blocks = list(pool.map(stage, range(0, size, block_size)))
+        finally:
+            # a failed block stops the blocks not started yet
+            pool.shutdown(wait=True, cancel_futures=True)
+            if view is not None:
+                view.close()
+        
+        response = blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id, _ in blocks], 
+                                                 metadata=metadata)
+        sent = sum(length for _, length in blocks)
+        metrics.count('blob_blocks_total', len(staged), result='sent')
+        metrics.count('blob_blocks_total', len(blocks) - len(staged), result='reused')
+        logger.info(f'Block Upload: {blob_client.blob_name}: {len(staged)} of {len(blocks)} blocks sent, '
+                    f'{block_size / 1048576:g} MB blocks')
+        
+        return response, sent
+    
+     
+    def put_list(self, file_list, hashes=None) ->list:
+        """Uploads or Puts a list of files to container. 
+        Up to self.workers files are uploaded at once, a failed file is recorded 
+        in self.failed and does not stop the rest of the batch.
         
         Args:
             :param key: list of filenames.
+            :param hashes: dict() {filename: content hash} saved as blob metadata.
         
          Returns:
             list(): Call Back Status
         """
         response_list = []
+        self.failed = {}
+        file_list = list(file_list)
+        hashes = hashes or {}
+        total_bytes = 0
+        start = time.perf_counter()
         
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
+            container_client = self.clients.container_client(self.container)
             
-            for file in file_list:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._upload, container_client, file, hashes.get(file)): file 
+                           for file in file_list}
                 
-                blob_client = blob_service_client.get_blob_client(container=self.container, blob=file)
+                for future in as_completed(futures):
+                    file = futures[future]
+                    try:
+                        response, size, stats = future.result()
                     
-                with open(self.working_dir + "\\" + file, 'rb') as file_data:
-                    response = blob_client.upload_blob(file_data, overwrite=True)
-
-                response_list.append(f'Upload: {file}: {response}')
-                logger.info(f'Upload: {response_list}')
+                    except (AzureError, OSError) as err:
+                        self.failed[file] = err
+                        logger.error(
+                            "Couldn't put AZ object %s. Here's why: %s ", 
+                            file,
+                            err)
+                        continue
+                    
+                    total_bytes += size
+                    self._index_put(file, response, hashes.get(file), stats)
+                    response_list.append(f'Upload: {file}: {response}')
+                    logger.info(f'Upload: {file}: {response}')
         
         except AzureError as err:
             logger.error(
@@ -127,7 +413,15 @@ class AZBlobStorage:
                 err.message)
             raise
         
-        finally:     
+        finally:
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            metrics.count('blob_files_total', len(response_list), op='upload', result='ok')
+            metrics.count('blob_files_total', len(self.failed), op='upload', result='failed')
+            metrics.count('blob_upload_bytes_total', total_bytes)
+            logger.info(
+                f'Upload Done: {len(response_list)} ok, {len(self.failed)} failed, '
+                f'{total_bytes} bytes in {elapsed:.2f}s '
+                f'({len(response_list) / elapsed:.1f} files/s, {total_bytes / elapsed / 1048576:.2f} MB/s)')
             return response_list
     
     
@@ -142,9 +436,9 @@ class AZBlobStorage:
             str(): Call Back Status
         """
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
-            blob_client = blob_service_client.get_blob_client(container=self.container)
+            blob_client = self.clients.container_client(self.container)
             response = blob_client.delete_blob(blob)
+            self._index_delete(blob)
 
             if response is None:
                 response = f'Deletion Successful: {blob}'
@@ -162,8 +456,24 @@ class AZBlobStorage:
     
     
     # Delete list of files from AZ container
+    def _delete_batch(self, container_client, batch) ->list:
+        """Deletes up to DELETE_BATCH_LIMIT blobs in one batch request.
+        
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param batch: list of filenames.
+        
+         Returns:
+            list(): [(filename, status code)]
+        """
+        responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+        return [(blob, response.status_code) for blob, response in zip(batch, responses)]
+    
+    
     def delete_list(self, del_list) ->list:
-        """Deletes a list of blobs from container
+        """Deletes a list of blobs from container using the Blob batch API, 
+        up to self.workers batches run at once. Blobs that could not be 
+        deleted are recorded in self.failed.
         
         Args:
             :param key: list of filenames.
@@ -172,27 +482,50 @@ class AZBlobStorage:
             list(): Call Back Status
         """
         response_list = []
+        self.failed = {}
+        del_list = list(del_list)
+        batches = [del_list[i:i + DELETE_BATCH_LIMIT] for i in range(0, len(del_list), DELETE_BATCH_LIMIT)]
         try:
-            for blob in del_list:
+            blob_client = self.clients.container_client(self.container)
+            
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._delete_batch, blob_client, batch): batch for batch in batches}
                 
-                blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
-    
-                blob_client = blob_service_client.get_container_client(container=self.container)
-                response = blob_client.delete_blob(blob)
-
-                if response is None:
-                    response = f'Blob Deletion Successful: {blob}'
-                    logger.info(response)
-                    response_list.append(response)
+                for future in as_completed(futures):
+                    try:
+                        results = future.result()
+                    
+                    except AzureError as err:
+                        for blob in futures[future]:
+                            self.failed[blob] = err
+                        logger.error(
+                            "Couldn't delete AZ batch of %s objects. Here's why: %s ", 
+                            len(futures[future]),
+                            err)
+                        continue
+                    
+                    for blob, status in results:
+                        # 404: already gone, nothing left to delete
+                        if status in (200, 202, 404):
+                            self._index_delete(blob)
+                            response = f'Blob Deletion Successful: {blob}'
+                            response_list.append(response)
+                        else:
+                            self.failed[blob] = status
+                            logger.error(f'Blob Deletion Failed: {blob}: {status}')
                           
         except AzureError as err:
             logger.error(
-                "Couldn't delete AZ object %s. %s. Here's why: %s ", 
+                "Couldn't delete AZ object %s. Here's why: %s ", 
                 del_list,
-                err.message)
+                err)
             raise
         
         finally:
+            metrics.count('blob_files_total', len(response_list), op='delete', result='ok')
+            metrics.count('blob_files_total', len(self.failed), op='delete', result='failed')
+            metrics.count('blob_delete_batches_total', len(batches))
+            logger.info(f'Blob Deletion Done: {len(response_list)} ok, {len(self.failed)} failed, {len(batches)} batches')
             return response_list
     
               
@@ -227,9 +560,9 @@ class AZBlobStorage:
             
             with open(self.working_dir + file_name, "wb") as data:
                 
-                blob_client = BlobClient.from_connection_string(conn_str=self.conn_str, container_name=self.container, blob_name=file_name)
+                blob_client = self.clients.container_client(self.container).get_blob_client(blob=file_name)
                 blob_data = blob_client.download_blob()
-                blob_data.readinto(data)
+                self._write_blob(blob_data, data)
                 response = f'Downloaded: {blob_data.properties}'
                 logger.info(response)
             
@@ -243,8 +576,78 @@ class AZBlobStorage:
             return response
         
     
+    def _download(self, container_client, file_name) ->str:
+        """Downloads a single blob to a temp file next to the target and renames it 
+        into place, so a partial download never shows up as a local change.
+        
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param file_name: str() of blob.
+        
+         Returns:
+            str(): Call Back Status
+        """
+        file_path = local_path(self.working_dir, file_name)
+        part_path = file_path + PARTIAL_SUFFIX
+        blob_client = container_client.get_blob_client(blob=file_name)
+        
+        try:
+            with open(part_path, "wb") as data:
+                blob_data = blob_client.download_blob()
+                self._write_blob(blob_data, data)
+            os.replace(part_path, file_path)
+        
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        
+        return f'Downloaded: {blob_data.properties}'
+    
+    
+    def _write_blob(self, blob_data, data) ->None:
+        """Writes a download to data, decompressing it when the blob metadata names a codec.
+        A codec this client doesn't know, or a chunk manifest, raises ValueError 
+        instead of writing the wrong bytes.
+        
+        Args:
+            :param blob_data: StorageStreamDownloader from download_blob.
+            :param data: file object open for writing.
+        """
+        metadata = blob_data.properties.metadata or {}
+        if MANIFEST_KEY in metadata:
+            raise ValueError(f"Blob {blob_data.properties.name} is a chunk manifest, set storage_backend=dedup to read it")
+        
+        codec = metadata.get(CODEC_KEY)
+        if not codec:
+            size = blob_data.readinto(data)
+            self._count_transfer(raw_bytes=size, wire_bytes=size)
+            return
+        
+        decompress = decompressor(codec)
+        counter = dict(raw_bytes=0, wire_bytes=0, codec_cpu_sec=0.0)
+        try:
+            for chunk in blob_data.chunks():
+                start = time.thread_time()
+                out = decompress.decompress(chunk)
+                counter['codec_cpu_sec'] += time.thread_time() - start
+                counter['wire_bytes'] += len(chunk)
+                counter['raw_bytes'] += len(out)
+                data.write(out)
+        
+        except (AzureError, OSError):
+            raise
+        except Exception as err:
+            raise ValueError(f"Couldn't decompress {codec} blob {blob_data.properties.name}: {err}") from err
+        
+        finally:
+            self._count_transfer(**counter)
+    
+    
     def get_list(self, file_list) ->list:
-        """Gets/Downloads a list of files/blobs from container
+        """Gets/Downloads a list of files/blobs from container.
+        Parent folders are created once up front, then up to self.workers 
+        blobs are downloaded at once. Failures are recorded in self.failed.
         
         Args:
             :param key: list() of filenames.
@@ -253,59 +656,301 @@ class AZBlobStorage:
             FileObject: downloads to specific folder 
         """
         response_list = []
+        self.failed = {}
+        file_list = list(file_list)
         try:
             
-            for file_name in file_list:
-                
-                path = file_name.replace(os.path.basename(file_name), '')
-                
-                if path:
-                    path = os.path.join(self.working_dir, path)
-
-                    if os.path.exists(path=path) == False:
-                        os.mkdir(path,)
-                        logger.info("Success: %s mkdir:" % path)
-                    else:
-                        logger.info("iSpath: %s no mkdir done:" % path)
-                        
-                else:
-                    logger.info("no sub dir: %s mkdir:" % path)
-                    pass 
+            folders = {os.path.dirname(local_path(self.working_dir, file_name)) for file_name in file_list}
+            for path in folders:
+                if path and os.path.exists(path=path) == False:
+                    os.makedirs(path, exist_ok=True)
+                    logger.info("Success: %s mkdir:" % path)
+            
+            container_client = self.clients.container_client(self.container)
+            
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._download, container_client, file_name): file_name for file_name in file_list}
                 
-                blob_client = BlobClient.from_connection_string(conn_str=self.conn_str, container_name=self.container, blob_name=file_name)
-                  
-                with open(self.working_dir + file_name.replace('/', '\\'), "wb") as data:
-                                    
-                    blob_data = blob_client.download_blob()
-                    blob_data.readinto(data)
-                    response = f'Downloaded: {blob_data.properties}'
+                for future in as_completed(futures):
+                    file_name = futures[future]
+                    try:
+                        response = future.result()
+                    
+                    except (AzureError, OSError, ValueError) as err:
+                        self.failed[file_name] = err
+                        logger.error(
+                            "Couldn't get AZ object %s. Here's why: %s", file_name, err)
+                        continue
+                    
                     logger.info(response)
                     response_list.append(response)
             
         except AzureError as err:
             logger.error(
-                "Couldn't get AZ object %s. Here's why: %s: %s", file_list,
-                err.message['Error']['Code'], err.message['Error']['Message'])
+                "Couldn't get AZ object %s. Here's why: %s", file_list, err.message)
             raise
 
         finally:
+            metrics.count('blob_files_total', len(response_list), op='download', result='ok')
+            metrics.count('blob_files_total', len(self.failed), op='download', result='failed')
             return response_list
 
     
+    def _index_listed(self, rows) ->tuple:
+        """Replaces the listing snapshot with the listed blobs.
+        
+        Args:
+            :param rows: list() of ("path\\filename", blob time, etag, content hash or None, 
+                         (mtime, size) or None), sorted in place.
+        
+         Returns:
+            tuple(): ([names], times, [etags], [hashes], [stats]), the columns in name order.
+        """
+        names, times, etags, hashes, stats = sorted_columns(rows, ('d', None, None, None))
+        self.cloud_index = FileIndex.from_sorted(names, times)
+        self.cloud_etags = FileIndex.from_sorted(names, etags, typecode=None)
+        hashed = [(name, sys.intern(file_hash)) for name, file_hash in zip(names, hashes) if file_hash]
+        self.cloud_hashes = FileIndex.from_sorted([name for name, _ in hashed], [file_hash for _, file_hash in hashed], 
+                                                  typecode=None)
+        stated = [(name, stat) for name, stat in zip(names, stats) if stat]
+        self.cloud_stats = FileIndex.from_sorted([name for name, _ in stated], [stat for _, stat in stated], 
+                                                 typecode=None)
+        return names, times, etags, hashes, stats
+    
+    
+    def _index_put(self, file_name, response, file_hash=None, stats=None) ->None:
+        """Updates the listing snapshot from an upload response.
+        
+        Args:
+            :param file_name: str() filename.
+            :param response: dict() upload_blob response with last_modified and etag.
+            :param file_hash: str() content hash sent as metadata.
+            :param stats: tuple() (local mtime, size) sent as metadata.
+        """
+        if self.cloud_index is None:
+            return
+        blob_name = file_name.replace("/", os.sep)
+        self.cloud_index[blob_name] = response['last_modified'].timestamp()
+        self.cloud_etags[blob_name] = response['etag']
+        if file_hash:
+            self.cloud_hashes[blob_name] = file_hash
+        else:
+            self.cloud_hashes.pop(blob_name, None)
+        if stats:
+            self.cloud_stats[blob_name] = stats
+        else:
+            self.cloud_stats.pop(blob_name, None)
+        if self.container_manifest is not None:
+            self.container_manifest.pending[blob_name] = self._manifest_entry(blob_name)
+    
+    
+    def _index_delete(self, file_name) ->None:
+        """Removes a deleted blob from the listing snapshot.
+        
+        Args:
+            :param file_name: str() filename.
+        """
+        if self.cloud_index is None:
+            return
+        blob_name = file_name.replace("/", os.sep)
+        self.cloud_index.pop(blob_name, None)
+        self.cloud_etags.pop(blob_name, None)
+        self.cloud_hashes.pop(blob_name, None)
+        self.cloud_stats.pop(blob_name, None)
+        if self.container_manifest is not None:
+            self.container_manifest.pending[blob_name] = None
+    
+    
+    def _manifest_entry(self, blob_name) ->list:
+        """Container manifest entry of a blob in the listing snapshot.
+        
+        Args:
+            :param blob_name: str() "path\\filename".
+        
+         Returns:
+            list(): [blob time, etag, content hash, local mtime, local size], None when unknown.
+        """
+        mtime, size = self.cloud_stats.get(blob_name) or (None, None)
+        return [self.cloud_index[blob_name], self.cloud_etags.get(blob_name), 
+                self.cloud_hashes.get(blob_name), mtime, size]
+    
+    
+    def _apply_manifest(self, changes) ->None:
+        """Applies the entries that changed in the container manifest to the listing snapshot.
+        
+        Args:
+            :param changes: dict() {"path\\filename": entry, or None when removed}.
+        """
+        for blob_name, entry in changes.items():
+            if entry is None:
+                self.cloud_index.pop(blob_name, None)
+                self.cloud_etags.pop(blob_name, None)
+                self.cloud_hashes.pop(blob_name, None)
+                self.cloud_stats.pop(blob_name, None)
+                continue
+            
+            blob_time, etag, file_hash, mtime, size = entry
+            self.cloud_index[blob_name] = blob_time
+            self.cloud_etags[blob_name] = etag
+            if file_hash:
+                self.cloud_hashes[blob_name] = file_hash
+            else:
+                self.cloud_hashes.pop(blob_name, None)
+            if mtime is not None and size is not None:
+                self.cloud_stats[blob_name] = (mtime, size)
+            else:
+                self.cloud_stats.pop(blob_name, None)
+    
+    
+    def save_manifest(self) ->bool:
+        """Writes the uploads and deletes of this client to the container manifest.
+        
+         Returns:
+            bool(): False when the manifest could not be written.
+        """
+        if self.container_manifest is None:
+            return True
+        return self.container_manifest.save()
+    
+    
+    def _skip_listed(self, blob) ->bool:
+        """Hook for blob_file_time_list, True leaves a listed blob out of the snapshot.
+        
+        Args:
+            :param blob: BlobProperties from list_blobs.
+        """
+        return False
+    
+    
+    def _list_pages(self, container_client, prefix=None, include=None, skip=None) ->tuple:
+        """Lists the blobs under prefix page by page.
+        
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param prefix: str() blob name prefix, the whole container when None.
+            :param include: list() of extra data to list, ['metadata'] for the snapshot.
+            :param skip: function(blob) -> bool, True leaves a listed blob out.
+        
+         Returns:
+            tuple(): ([("path\\filename", blob time, etag, content hash, (mtime, size))], pages)
+        """
+        rows = []
+        pages = 0
+        for page in container_client.list_blobs(name_starts_with=prefix, include=include).by_page():
+            pages += 1
+            for blob in page:
+                if skip is not None and skip(blob):
+                    continue
+                metadata = blob.metadata
+                rows.append((blob.name.replace("/", os.sep), blob.last_modified.timestamp(), blob.etag, 
+                             metadata and metadata.get(HASH_KEY), listed_stats(metadata)))
+        return rows, pages
+    
+    
+    def _list_prefixes(self, container_client, prefixes=None, include=None, skip=None) ->tuple:
+        """Lists each prefix on its own worker, list_workers at a time. Without prefixes 
+        the top-level ones are found first with one delimiter listing, which also 
+        returns the blobs at the top level. A level with a single prefix, like the 
+        root '/' all names start with, is walked one level deeper.
+        
+        Args:
+            :param container_client: ContainerClient shared by all workers.
+            :param prefixes: list() of blob name prefixes, None lists the whole container.
+            :param include: list() of extra data to list, ['metadata'] for the snapshot.
+            :param skip: function(blob) -> bool, True leaves a listed blob out.
+        
+         Returns:
+            tuple(): ([rows as _list_pages], pages, prefixes listed)
+        """
+        rows = []
+        pages = 0
+        if prefixes is None:
+            prefixes = [None]
+            for _ in range(PREFIX_DEPTH):
+                if len(prefixes) != 1:
+                    break
+                start = prefixes.pop()
+                for page in container_client.walk_blobs(name_starts_with=start, include=include, delimiter='/').by_page():
+                    pages += 1
+                    for item in page:
+                        if isinstance(item, BlobPrefix):
+                            prefixes.append(item.name)
+                        elif skip is None or not skip(item):
+                            metadata = item.metadata
+                            rows.append((item.name.replace("/", os.sep), item.last_modified.timestamp(), item.etag, 
+                                         metadata and metadata.get(HASH_KEY), listed_stats(metadata)))
+        
+        with ThreadPoolExecutor(max_workers=min(self.list_workers, len(prefixes)) or 1) as pool:
+            futures = [pool.submit(self._list_pages, container_client, prefix, include, skip) for prefix in prefixes]
+            # prefixes are added in the order walk_blobs returned them, each listed in name
+            # order, so the snapshot sort only merges the top-level rows with one sorted run
+            for future in futures:
+                part, part_pages = future.result()
+                rows.extend(part)
+                pages += part_pages
+        return rows, pages, len(prefixes)
+    
+    
+    def _list_container(self, include=None, skip=None) ->list:
+        """Lists the whole container, split by top-level prefix when list_workers > 1.
+        
+        Args:
+            :param include: list() of extra data to list, ['metadata'] for the snapshot.
+            :param skip: function(blob) -> bool, True leaves a listed blob out.
+        
+         Returns:
+            list(): rows as _list_pages.
+        """
+        start = time.perf_counter()
+        container_client = self.clients.container_client(self.container)
+        if self.list_workers > 1:
+            rows, pages, prefixes = self._list_prefixes(container_client, include=include, skip=skip)
+        else:
+            rows, pages = self._list_pages(container_client, include=include, skip=skip)
+            prefixes = 0
+        
+        seconds = time.perf_counter() - start
+        metrics.count('blob_list_pages_total', pages)
+        metrics.gauge('blob_list_pages_per_sec', pages / seconds if seconds else 0)
+        logger.info(f'Container: {self.container} listed {len(rows)} blobs, {pages} pages'
+                    f'{f" from {prefixes} prefixes" if prefixes else ""}, '
+                    f'{pages / seconds if seconds else 0:.1f} pages/s, {seconds:.2f}s')
+        return rows
+    
+    
     @property
-    def blob_file_time_list(self) ->list:
+    def blob_file_time_list(self) ->dict:
+        """Lists the whole container once and keeps it as the snapshot for this run.
+        put_list and delete_list keep the snapshot current, so 
+        blob_file_select_time_list never has to list the container again.
+        
+         Returns:
+            FileIndex(): {"path\\filename": float}, the live snapshot. 
+            Etags, content hashes and local stats from blob metadata are kept in 
+            self.cloud_etags, self.cloud_hashes and self.cloud_stats.
+        """
+        manifest = self.container_manifest
+        if manifest is not None and not manifest.stale and self.cloud_index is not None:
+            # one conditional GET, a 304 when no client wrote since the last run
+            try:
+                self._apply_manifest(manifest.fetch())
+                metrics.gauge('blob_listed', len(self.cloud_index))
+                return self.cloud_index
+            except (AzureError, ValueError) as err:
+                logger.error("Couldn't read the container manifest, listing the container. Here's why: %s", err)
         
         cloud_list = {}
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
-            blob_client = blob_service_client.get_container_client(container=self.container)
-            blob_names = blob_client.list_blobs()
-            
-            for blob in blob_names:
-                
-                blob_name = blob.name
-                blob_name = blob_name.replace("/", "\\")
-                cloud_list[blob_name] = blob.last_modified.timestamp()
+            rows = self._list_container(
+                include=['metadata'], skip=lambda blob: blob.name == MANIFEST_BLOB or self._skip_listed(blob))
+            names, times, etags, hashes, stats = self._index_listed(rows)
+            del rows
+            cloud_list = self.cloud_index
+            metrics.gauge('blob_listed', len(cloud_list))
+            if manifest is not None:
+                entries = [[blob_time, etag, file_hash, *(stat or (None, None))] 
+                           for blob_time, etag, file_hash, stat in zip(times, etags, hashes, stats)]
+                manifest.rebuild(FileIndex.from_sorted(names, entries, typecode=None))
 
         except AzureError as err:
             logger.error(
@@ -317,19 +962,37 @@ class AZBlobStorage:
             return cloud_list
         
 
-    def blob_file_select_time_list(self, query_list) ->list:
+    def blob_file_select_time_list(self, query_list) ->dict:
+        """Looks up blob times for the given names in the snapshot, 
+        the container is only listed when no snapshot was taken yet. 
+        With list_workers > 1 only the top-level prefixes of the names are listed, 
+        each on its own worker.
+        
+        Args:
+            :param query_list: list() of filenames.
         
+         Returns:
+            dict(): {"path\\filename": float}
+        """
+        if self.cloud_index is not None:
+            cloud_index = self.cloud_index
+            return {blob_name: cloud_index[blob_name] for blob_name in (
+                name.replace("/", os.sep) for name in query_list) if blob_name in cloud_index}
+        
+        query_list = set(query_list)
         cloud_list = {}    
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(conn_str=self.conn_str)
-            blob_client = blob_service_client.get_container_client(container=self.container)
-            blob_names = blob_client.list_blobs()
-
-            for blob in blob_names:
-                blob_name = blob.name
-                blob_name = blob_name.replace("/", "\\")
+            if self.list_workers > 1:
+                # "/top/..." lists "/top/", a name at the top level lists itself
+                prefixes = sorted({name[:name.find('/', name.startswith('/')) + 1] or name for name in (
+                    name.replace(os.sep, "/") for name in query_list)})
+                rows, _, _ = self._list_prefixes(self.clients.container_client(self.container), prefixes)
+            else:
+                rows = self._list_container()
+            
+            for blob_name, blob_time, *_ in rows:
                 if blob_name in query_list:
-                    cloud_list[blob_name] = blob.last_modified.timestamp()
+                    cloud_list[blob_name] = blob_time
         
         except AzureError as err:
             logger.error(
@@ -0,0 +1,140 @@
+"""Dedup ratio and chunking throughput of chunker.py on a synthetic corpus.
+
+Builds base files in memory and the near copies users keep next to them
+(exact copies, appended, edited in the middle, partly rewritten), then
+compares the unique bytes a chunk store keeps with content-defined chunks
+against fixed-size blocks. Chunking throughput is measured with the numpy
+gear hash (when numpy is installed) and the pure Python fallback, on one
+thread and on --threads threads. Nothing is sent to Azure.
+
+    python benchmarks/dedup_bench.py --files 4 --size-mb 4 --chunk-kb 1024 --threads 4
+"""
+import io
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chunker
+from chunker import chunk_sizes, iter_chunks
+
+
+def build_corpus(files: int, size_mb: float, seed: int) -> dict:
+    """Synthetic working_dir content.
+
+    Args:
+        files (int): Number of base files.
+        size_mb (float): Size of each base file in MB.
+        seed (int): Random seed.
+
+    Returns:
+        dict: {"path/filename": bytes}
+    """
+    rng = random.Random(seed)
+    size = int(size_mb * 1048576)
+    words = [bytes(rng.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+    corpus = {}
+    for i in range(files):
+        if i % 2:
+            base = rng.randbytes(size)
+        else:
+            # text compresses and repeats itself, closer to documents and logs
+            base = b' '.join(rng.choice(words) for _ in range(size // 5))[:size]
+        corpus[f'/base/file{i}.bin'] = base
+        corpus[f'/copies/file{i}.bin'] = base
+        corpus[f'/appended/file{i}.bin'] = base + rng.randbytes(size // 20)
+        cut = rng.randrange(size)
+        corpus[f'/edited/file{i}.bin'] = base[:cut] + b'inserted text ' * 10 + base[cut:]
+        start = rng.randrange(size)
+        corpus[f'/rewritten/file{i}.bin'] = base[:start] + rng.randbytes(size // 10) + base[start + size // 10:]
+    return corpus
+
+
+def unique_bytes(pieces) -> tuple:
+    """Bytes and count of the distinct pieces.
+
+    Args:
+        pieces (iterable): bytes
+
+    Returns:
+        tuple: (total bytes, unique bytes, pieces, unique pieces)
+    """
+    seen = set()
+    total = unique = count = 0
+    for piece in pieces:
+        count += 1
+        total += len(piece)
+        digest = hashlib.sha256(piece).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique += len(piece)
+    return total, unique, count, len(seen)
+
+
+def chunk_corpus(corpus: dict, sizes: tuple, threads: int) -> tuple:
+    """Chunks every file of the corpus, threads files at a time.
+
+    Args:
+        corpus (dict): {"path/filename": bytes}
+        sizes (tuple): (min_size, avg_size, max_size)
+        threads (int): Files chunked at the same time.
+
+    Returns:
+        tuple: ([chunk bytes] in corpus order, seconds)
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        parts = pool.map(lambda data: list(iter_chunks(io.BytesIO(data), *sizes)), corpus.values())
+        chunks = [chunk for part in parts for chunk in part]
+    return chunks, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=4, help='base files, each gets 4 near copies')
+    parser.add_argument('--size-mb', type=float, default=4, help='size of each base file')
+    parser.add_argument('--chunk-kb', type=int, default=1024, help='average chunk size, as dedup_chunk_kb')
+    parser.add_argument('--threads', type=int, default=4, help='files chunked at the same time')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.files, args.size_mb, args.seed)
+    min_size, avg_size, max_size = chunk_sizes(args.chunk_kb)
+    logical = sum(len(data) for data in corpus.values())
+    print(f'corpus: {len(corpus)} files, {logical / 1048576:.1f} MB, '
+          f'chunks {min_size // 1024}/{avg_size // 1024}/{max_size // 1024} KB min/avg/max')
+
+    sizes = (min_size, avg_size, max_size)
+    gear = chunker._GEAR_ARRAY
+    cdc = None
+    timings = []
+    for engine in ('numpy', 'python'):
+        if engine == 'numpy' and gear is None:
+            print('numpy not installed, only the pure Python gear hash is measured')
+            continue
+        chunker._GEAR_ARRAY = gear if engine == 'numpy' else None
+        for threads in sorted({1, args.threads}):
+            chunks, elapsed = chunk_corpus(corpus, sizes, threads)
+            assert cdc is None or chunks == cdc, 'numpy and Python gear hashes cut differently'
+            cdc = chunks
+            timings.append((engine, threads, elapsed))
+    chunker._GEAR_ARRAY = gear
+    fixed = [data[i:i + avg_size] for data in corpus.values() for i in range(0, len(data), avg_size)]
+
+    for name, pieces in (('content-defined', cdc), ('fixed blocks', fixed)):
+        total, unique, count, distinct = unique_bytes(pieces)
+        assert total == logical
+        print(f'{name:>16}: {count} chunks, {distinct} unique, avg {total // max(count, 1) // 1024} KB, '
+              f'stored {unique / 1048576:.1f} MB, dedup ratio {logical / max(unique, 1):.2f}x')
+
+    for engine, threads, elapsed in timings:
+        print(f'chunking throughput, {engine} gear hash, {threads} thread{"s" if threads > 1 else ""}: '
+              f'{logical / 1048576 / elapsed:.1f} MB/s ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()
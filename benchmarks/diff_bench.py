@@ -0,0 +1,102 @@
+"""Time and peak memory of syncPlan.diff_states against the comprehensions it replaced.
+
+Builds the four states one sync compares (local record, local scan, DB
+items, blob listing) for a tree of --files names, with --churn of them
+added, changed and removed locally and half as many by another client in
+the cloud. The old code is quadratic, it is only run up to --legacy-max
+files.
+
+    python benchmarks/diff_bench.py --files 10000 100000 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from syncPlan import diff_states
+
+
+def legacy_diff(before_local: dict, after_local: dict, before_cloud: dict, after_cloud: dict) -> tuple:
+    """FileTracker.find_changes before the SyncPlan, without the hash check.
+    """
+    file_time_added_cloud = {key: value for key, value in after_cloud.items() if key not in before_cloud}
+    file_time_removed_cloud = {key: value for key, value in before_cloud.items() if key not in after_cloud}
+    file_time_changed_cloud = {key: value for key,value in after_cloud.items() if key in dict(
+        set(before_cloud.items()) - set(after_cloud.items()))}
+
+    file_time_added_local = {key: value for key, value in after_local.items() if key not in before_local}
+    file_time_removed_local = {key: value for key, value in before_local.items() if key not in after_local}
+    file_time_changed = {key: value for key,value in after_local.items() if key in dict(
+                set(before_local.items()) - set(after_local.items()))}
+    file_time_changed_local = {key: value for key,value in file_time_changed.items() if key not in file_time_changed_cloud}
+
+    return (file_time_added_cloud, file_time_removed_cloud, file_time_changed_cloud,
+            file_time_added_local, file_time_removed_local, file_time_changed_local)
+
+
+def churned(state: dict, names: list, churn: int, rng: random.Random, prefix: str) -> dict:
+    """Copy of state with churn names added, changed and removed.
+    """
+    after = dict(state)
+    for name in rng.sample(names, churn * 2)[:churn]:
+        after[name] += 1.0
+    for name in rng.sample(names, churn):
+        after.pop(name, None)
+    for i in range(churn):
+        after[f'\\{prefix}\\f{i:07d}.dat'] = 1700000000.0 + i
+    return after
+
+
+def build_states(files: int, churn: float, seed: int) -> tuple:
+    """before_local, after_local, before_cloud, after_cloud for one sync.
+    """
+    rng = random.Random(seed)
+    names = [f'\\d{i // 10000:03d}\\s{i // 100 % 100:02d}\\f{i:07d}.dat' for i in range(files)]
+    before_local = {name: 1600000000.0 + i for i, name in enumerate(names)}
+    before_cloud = {name: 1650000000.0 + i for i, name in enumerate(names)}
+    count = max(1, int(files * churn))
+    after_local = churned(before_local, names, count, rng, 'new-local')
+    after_cloud = churned(before_cloud, names, max(1, count // 2), rng, 'new-cloud')
+    return before_local, after_local, before_cloud, after_cloud
+
+
+def measure(function, states: tuple) -> tuple:
+    """Seconds and peak MB of function(*states), both taken in separate runs.
+    """
+    start = time.perf_counter()
+    function(*states)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*states)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1048576
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--churn', type=float, default=0.01, help='share of files added, changed and removed')
+    parser.add_argument('--legacy-max', type=int, default=5000, help='largest tree the old code runs on')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{"files":>9} {"engine":<8} {"seconds":>9} {"peak MB":>8}  plan')
+    for files in args.files:
+        states = build_states(files, args.churn, args.seed)
+        seconds, peak = measure(diff_states, states)
+        print(f'{files:>9} {"plan":<8} {seconds:>9.3f} {peak:>8.1f}  {diff_states(*states).counts}')
+
+        if files <= args.legacy_max:
+            seconds, peak = measure(legacy_diff, states)
+            found = legacy_diff(*states)
+            print(f'{files:>9} {"legacy":<8} {seconds:>9.3f} {peak:>8.1f}  '
+                  f'{dict(zip(("cloud_added", "cloud_removed", "cloud_changed", "local_added", "local_removed", "local_changed"), map(len, found)))}')
+
+
+if __name__ == '__main__':
+    main()
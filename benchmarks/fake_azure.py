@@ -0,0 +1,506 @@
+"""In-memory stand-ins for the Blob Storage and Cosmos DB clients.
+
+FakeClientPool has the same surface as azClients.AzClientPool, so it can be
+given to FileTracker(clients=...) and every AZBlobStorage and AzCosmosContainer
+call lands here instead of Azure. Each call that would be one HTTP request is
+counted per operation, and can sleep latency_ms to stand in for the network,
+plus the time its bytes take on one connection of conn_mbps.
+"""
+import io
+import time
+import hashlib
+import threading
+import datetime
+from azure.core import MatchConditions
+from azure.core.exceptions import (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError,
+                                   ResourceNotModifiedError)
+from azure.storage.blob import BlobBlock, BlobPrefix
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosResourceNotFoundError
+
+# Blobs per List Blobs request, the service maximum
+LIST_PAGE_SIZE = 5000
+
+
+class RequestCounter:
+    """Thread safe count of requests per operation, with optional injected latency.
+    """
+    def __init__(self, latency_ms: float=0, conn_mbps: float=0):
+        """
+        Args:
+            latency_ms (float, optional): Sleep per request. Defaults to 0.
+            conn_mbps (float, optional): Throughput of one connection in Mbit/s, 0 is unlimited. Defaults to 0.
+        """
+        self.latency = latency_ms / 1000
+        self.conn_bytes_sec = conn_mbps * 125000
+        self.counts = {}
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self._lock = threading.Lock()
+
+
+    def request(self, operation: str, bytes_up: int=0, bytes_down: int=0) -> None:
+        """Counts one request, then waits the injected latency and transfer time.
+
+        Args:
+            operation (str): Example: 'blob.put'
+            bytes_up (int, optional): Bytes sent. Defaults to 0.
+            bytes_down (int, optional): Bytes received. Defaults to 0.
+        """
+        with self._lock:
+            self.counts[operation] = self.counts.get(operation, 0) + 1
+            self.bytes_up += bytes_up
+            self.bytes_down += bytes_down
+        delay = self.latency
+        if self.conn_bytes_sec:
+            delay += (bytes_up + bytes_down) / self.conn_bytes_sec
+        if delay:
+            time.sleep(delay)
+
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+    def snapshot(self) -> dict:
+        """Copy of the counters, subtract two of them to get the requests of one run.
+
+        Returns:
+            dict: {"operation": int, "bytes_up": int, "bytes_down": int}
+        """
+        with self._lock:
+            return dict(self.counts, bytes_up=self.bytes_up, bytes_down=self.bytes_down)
+
+
+class StoredBlob:
+    """One blob, also returned as its own BlobProperties by list_blobs and download_blob.
+    """
+    __slots__ = ('name', 'size', 'last_modified', 'etag', 'metadata', 'data')
+
+    def __init__(self, name: str, size: int, last_modified: datetime.datetime, etag: str,
+                 metadata: dict, data: bytes=None):
+        self.name = name
+        self.size = size
+        self.last_modified = last_modified
+        self.etag = etag
+        self.metadata = metadata
+        self.data = data
+
+
+class FakeDownloader:
+    """StorageStreamDownloader of one blob.
+    """
+    def __init__(self, blob: StoredBlob):
+        self.properties = blob
+        self._data = blob.data if blob.data is not None else bytes(blob.size)
+
+
+    def readinto(self, stream) -> int:
+        stream.write(self._data)
+        return len(self._data)
+
+
+    def readall(self) -> bytes:
+        return self._data
+
+
+    def chunks(self):
+        yield self._data
+
+
+class FakeBlobClient:
+    """BlobClient of one name in a FakeContainerClient.
+    """
+    def __init__(self, container: 'FakeContainerClient', name: str):
+        self.container = container
+        self.blob_name = name
+
+
+    def upload_blob(self, data, overwrite: bool=False, metadata: dict=None, etag: str=None,
+                    match_condition: MatchConditions=None, **kwargs) -> dict:
+        """Reads data to the end like the SDK would, the bytes are kept with keep_data or when
+        data is bytes (manifests), downloads of other blobs return zeros. overwrite=False and If-Match (etag with MatchConditions.IfNotModified) fail like the service.
+        """
+        current = self.container.blobs.get(self.blob_name)
+        if not overwrite and current is not None:
+            self.container.counter.request('blob.put')
+            raise ResourceExistsError(f'The specified blob already exists: {self.blob_name}')
+        if match_condition == MatchConditions.IfNotModified and (current is None or current.etag != etag):
+            self.container.counter.request('blob.put')
+            raise ResourceModifiedError('The condition specified using HTTP conditional header(s) is not met')
+        keep = self.container.keep_data or isinstance(data, (bytes, bytearray))
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+        kept = io.BytesIO() if keep else None
+        size = 0
+        pieces = iter(lambda: data.read(1048576), b'') if hasattr(data, 'read') else data
+        for piece in pieces:
+            size += len(piece)
+            if kept is not None:
+                kept.write(piece)
+
+        self.container.counter.request('blob.put', bytes_up=size)
+        blob = self.container._store(self.blob_name, size, metadata, kept.getvalue() if kept else None)
+        return {'last_modified': blob.last_modified, 'etag': blob.etag}
+
+
+    def stage_block(self, block_id: str, data: bytes, length: int=None, **kwargs) -> dict:
+        """Keeps the block until the next commit_block_list of this blob, one request.
+        """
+        self.container.counter.request('blob.put_block', bytes_up=len(data))
+        with self.container._lock:
+            self.container.uncommitted.setdefault(self.blob_name, {})[block_id] = (
+                bytes(data) if self.container.keep_data else len(data))
+        return {'content_md5': bytearray(hashlib.md5(data).digest())}
+
+
+    def get_block_list(self, block_list_type: str='committed', **kwargs) -> tuple:
+        """(committed BlobBlock, []) like the service, ResourceNotFoundError when there is no blob.
+        """
+        self.container.counter.request('blob.get_block_list')
+        blob = self.container.blobs.get(self.blob_name)
+        if blob is None:
+            raise ResourceNotFoundError(f'The specified blob does not exist: {self.blob_name}')
+        return [BlobBlock(block_id=block_id) for block_id in self.container.committed.get(self.blob_name, {})], []
+
+
+    def commit_block_list(self, block_list: list, metadata: dict=None, **kwargs) -> dict:
+        """Builds the blob from staged and committed blocks, uncommitted ones are dropped.
+        Blocks are kept as bytes with keep_data, as their length otherwise.
+        """
+        self.container.counter.request('blob.put_block_list')
+        with self.container._lock:
+            staged = self.container.uncommitted.pop(self.blob_name, {})
+            committed = self.container.committed.get(self.blob_name, {})
+            blocks = {block.id: staged[block.id] if block.id in staged else committed[block.id] for block in block_list}
+            pieces = [blocks[block.id] for block in block_list]
+        if self.container.keep_data:
+            data = b''.join(pieces)
+            blob = self.container._store(self.blob_name, len(data), metadata, data)
+        else:
+            blob = self.container._store(self.blob_name, sum(pieces), metadata, None)
+        with self.container._lock:
+            self.container.committed[self.blob_name] = blocks
+        return {'last_modified': blob.last_modified, 'etag': blob.etag}
+
+
+    def download_blob(self, etag: str=None, match_condition: MatchConditions=None, **kwargs) -> FakeDownloader:
+        """If-None-Match (etag with MatchConditions.IfModified) on the current etag is a 304.
+        """
+        blob = self.container.blobs.get(self.blob_name)
+        if blob is None:
+            self.container.counter.request('blob.get')
+            raise ResourceNotFoundError(f'The specified blob does not exist: {self.blob_name}')
+        if match_condition == MatchConditions.IfModified and blob.etag == etag:
+            self.container.counter.request('blob.not_modified')
+            raise ResourceNotModifiedError('The condition specified using HTTP conditional header(s) is not met')
+        self.container.counter.request('blob.get', bytes_down=blob.size)
+        return FakeDownloader(blob)
+
+
+class FakeBlobPager:
+    """ItemPaged of list_blobs and walk_blobs, one request per LIST_PAGE_SIZE results.
+    Blobs are looked up when their page is read, so blobs deleted since are left out.
+    """
+    def __init__(self, container: 'FakeContainerClient', results: list):
+        """
+        Args:
+            container (FakeContainerClient): Container listed.
+            results (list): Blob names and BlobPrefix, in name order.
+        """
+        self.container = container
+        self.results = results
+
+
+    def by_page(self):
+        for start in range(0, max(1, len(self.results)), LIST_PAGE_SIZE):
+            self.container.counter.request('blob.list')
+            yield self._page(self.results[start:start + LIST_PAGE_SIZE])
+
+
+    def _page(self, results: list):
+        for result in results:
+            if isinstance(result, BlobPrefix):
+                yield result
+                continue
+            blob = self.container.blobs.get(result)
+            if blob is not None:
+                yield blob
+
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+
+class FakeDeleteResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeContainerClient:
+    """ContainerClient over a dict of StoredBlob.
+    """
+    def __init__(self, counter: RequestCounter, keep_data: bool=False):
+        """
+        Args:
+            counter (RequestCounter): Shared request counter.
+            keep_data (bool, optional): Keep uploaded bytes so downloads return them,
+                zeros of the same size are returned otherwise. Defaults to False.
+        """
+        self.counter = counter
+        self.keep_data = keep_data
+        self.blobs = {}
+        # {"blob name": {"block id": bytes}} staged and committed blocks
+        self.uncommitted = {}
+        self.committed = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._epoch = datetime.datetime.now(datetime.timezone.utc)
+
+
+    def _store(self, name: str, size: int, metadata: dict, data: bytes) -> StoredBlob:
+        with self._lock:
+            self._version += 1
+            # one microsecond per write, so every write has its own last_modified
+            last_modified = self._epoch + datetime.timedelta(microseconds=self._version)
+            blob = StoredBlob(name, size, last_modified, f'"0x{self._version:x}"', dict(metadata or {}), data)
+            self.blobs[name] = blob
+            self.committed.pop(name, None)
+        return blob
+
+
+    def get_blob_client(self, blob: str) -> FakeBlobClient:
+        return FakeBlobClient(self, blob)
+
+
+    def list_blobs(self, name_starts_with: str=None, include: list=None, **kwargs) -> 'FakeBlobPager':
+        """StoredBlob in name order, one request per LIST_PAGE_SIZE blobs.
+        """
+        with self._lock:
+            names = sorted(name for name in self.blobs if not name_starts_with or name.startswith(name_starts_with))
+        return FakeBlobPager(self, names)
+
+
+    def walk_blobs(self, name_starts_with: str=None, include: list=None, delimiter: str='/', **kwargs) -> 'FakeBlobPager':
+        """StoredBlob and BlobPrefix one level under name_starts_with, in name order.
+        """
+        prefix = name_starts_with or ''
+        with self._lock:
+            names = sorted(name for name in self.blobs if name.startswith(prefix))
+        results = []
+        for name in names:
+            end = name.find(delimiter, len(prefix))
+            if end < 0:
+                results.append(name)
+            elif not results or not isinstance(results[-1], BlobPrefix) or results[-1].name != name[:end + 1]:
+                results.append(BlobPrefix(prefix=name[:end + 1], delimiter=delimiter))
+        return FakeBlobPager(self, results)
+
+
+    def delete_blob(self, blob: str, **kwargs) -> None:
+        self.counter.request('blob.delete')
+        with self._lock:
+            self.committed.pop(blob, None)
+            if self.blobs.pop(blob, None) is None:
+                raise ResourceNotFoundError(f'The specified blob does not exist: {blob}')
+
+
+    def delete_blobs(self, *blobs, raise_on_any_failure: bool=True, **kwargs):
+        """One batch request, 202 per deleted blob and 404 for the missing ones.
+        """
+        self.counter.request('blob.delete_batch')
+        with self._lock:
+            for blob in blobs:
+                self.committed.pop(blob, None)
+            return iter([FakeDeleteResponse(202 if self.blobs.pop(blob, None) is not None else 404)
+                         for blob in blobs])
+
+
+class FakeItemList(list):
+    """execute_item_batch result.
+    """
+    def __init__(self, items: list, headers: dict):
+        super().__init__(items)
+        self._headers = headers
+
+
+    def get_response_headers(self) -> dict:
+        return self._headers
+
+
+class FakeQueryPager:
+    """ItemPaged of query_items, one request per page.
+    """
+    def __init__(self, container: 'FakeCosmosContainer', items: list, page_size: int, response_hook=None):
+        self.container = container
+        self.items = items
+        self.page_size = page_size or 100
+        self.response_hook = response_hook
+
+
+    def by_page(self):
+        for start in range(0, max(len(self.items), 1), self.page_size):
+            self.container.counter.request('cosmos.query_page')
+            if self.response_hook:
+                self.response_hook({'x-ms-request-charge': str(2.5 + self.page_size / 100)}, None)
+            yield iter(self.items[start:start + self.page_size])
+
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+
+class FakeClientConnection:
+    def __init__(self):
+        self.last_response_headers = {}
+
+
+class FakeCosmosContainer:
+    """ContainerProxy over a dict of items, one physical partition.
+    """
+    def __init__(self, counter: RequestCounter):
+        self.counter = counter
+        self.items = {}
+        # every upserted item in order, read by the change feed
+        self.feed = []
+        self.client_connection = FakeClientConnection()
+        self._lock = threading.Lock()
+
+
+    def _upsert(self, body: dict) -> None:
+        item = dict(body)
+        self.items[item['id']] = item
+        self.feed.append(item)
+
+
+    def upsert_item(self, body: dict, response_hook=None, **kwargs) -> dict:
+        self.counter.request('cosmos.upsert')
+        with self._lock:
+            self._upsert(body)
+        if response_hook:
+            response_hook({'x-ms-request-charge': '10'}, body)
+        return body
+
+
+    def delete_item(self, item: str, partition_key=None, response_hook=None, **kwargs) -> None:
+        self.counter.request('cosmos.delete')
+        with self._lock:
+            if self.items.pop(item, None) is None:
+                raise CosmosResourceNotFoundError(message=f'Entity with the specified id does not exist: {item}')
+        if response_hook:
+            response_hook({'x-ms-request-charge': '5'}, None)
+
+
+    def execute_item_batch(self, batch_operations: list, partition_key=None, **kwargs) -> FakeItemList:
+        """All or nothing like the service, a delete of a missing item fails the batch.
+        """
+        self.counter.request('cosmos.batch')
+        with self._lock:
+            for index, (operation, args) in enumerate(batch_operations):
+                if operation == 'delete' and args[0] not in self.items:
+                    raise CosmosBatchOperationError(
+                        error_index=index, headers={}, status_code=404,
+                        message='Entity with the specified id does not exist', operation_responses=[])
+            for operation, args in batch_operations:
+                if operation == 'upsert':
+                    self._upsert(args[0])
+                else:
+                    del self.items[args[0]]
+        return FakeItemList([], {'x-ms-request-charge': str(len(batch_operations) * 6)})
+
+
+    def read_item(self, item: str, partition_key=None, **kwargs) -> dict:
+        self.counter.request('cosmos.read')
+        if item not in self.items:
+            raise CosmosResourceNotFoundError(message=f'Entity with the specified id does not exist: {item}')
+        return dict(self.items[item])
+
+
+    def read_all_items(self, max_item_count: int=None, **kwargs) -> FakeQueryPager:
+        with self._lock:
+            items = [dict(item) for item in self.items.values()]
+        return FakeQueryPager(self, items, max_item_count)
+
+
+    def read_feed_ranges(self, **kwargs) -> list:
+        self.counter.request('cosmos.feed_ranges')
+        return [{'range': 0}]
+
+
+    def query_items(self, query: str, max_item_count: int=None, response_hook=None, **kwargs) -> FakeQueryPager:
+        """Answers SCAN_QUERY: id and fileTime of the items that are not tombstones.
+        """
+        with self._lock:
+            items = [{key: item[key] for key in ('id', 'fileTime') if key in item}
+                     for item in self.items.values() if not item.get('deleted')]
+        return FakeQueryPager(self, items, max_item_count, response_hook)
+
+
+    def query_items_change_feed(self, continuation: str=None, start_time=None, **kwargs):
+        self.counter.request('cosmos.change_feed')
+        with self._lock:
+            start = len(self.feed) if start_time == 'Now' else int(continuation or 0)
+            changes = self.feed[start:]
+            self.client_connection.last_response_headers = {'etag': str(len(self.feed))}
+        return iter(changes)
+
+
+class FakeDatabase:
+    def __init__(self, counter: RequestCounter):
+        self.counter = counter
+        self.containers = {}
+
+
+    def create_container_if_not_exists(self, id: str, partition_key=None, **kwargs) -> FakeCosmosContainer:
+        self.counter.request('cosmos.create_container')
+        return self.get_container_client(id)
+
+
+    def get_container_client(self, container: str) -> FakeCosmosContainer:
+        return self.containers.setdefault(container, FakeCosmosContainer(self.counter))
+
+
+class FakeCosmosClient:
+    def __init__(self, counter: RequestCounter):
+        self.counter = counter
+        self.databases = {}
+
+
+    def create_database_if_not_exists(self, id: str, **kwargs) -> FakeDatabase:
+        self.counter.request('cosmos.create_database')
+        return self.databases.setdefault(id, FakeDatabase(self.counter))
+
+
+class FakeClientPool:
+    """AzClientPool backed by FakeContainerClient and FakeCosmosClient, all sharing one RequestCounter.
+    """
+    def __init__(self, latency_ms: float=0, keep_data: bool=False, pool_size: int=16, conn_mbps: float=0):
+        """
+        Args:
+            latency_ms (float, optional): Sleep per request. Defaults to 0.
+            keep_data (bool, optional): Keep uploaded bytes. Defaults to False.
+            pool_size (int, optional): Reported like AzClientPool.pool_size. Defaults to 16.
+            conn_mbps (float, optional): Throughput of one connection in Mbit/s, 0 is unlimited. Defaults to 0.
+        """
+        self.counter = RequestCounter(latency_ms, conn_mbps)
+        self.keep_data = keep_data
+        self.pool_size = pool_size
+        self.conn_timeout = 20
+        self.read_timeout = 60
+        self.cosmos_client = FakeCosmosClient(self.counter)
+        self._container_clients = {}
+
+
+    def container_client(self, container: str) -> FakeContainerClient:
+        return self._container_clients.setdefault(container, FakeContainerClient(self.counter, self.keep_data))
+
+
+    @property
+    def stats(self) -> dict:
+        return self.counter.snapshot()
+
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,155 @@
+"""Memory held by the file maps of one sync, as dicts and as fileIndex.FileIndex.
+
+Builds, for a tree of --files names, the maps FileTracker keeps during
+sync_all: local scan times and sizes, the local record with its saved rows,
+the DB items and hashes, the blob listing with its etags, hashes and local
+stats, and the hash cache. Every source hands out its own copy of each name
+and hash, as os.scandir, SQLite, CosmosDB and list_blobs do. The dict build
+is the one these maps had before FileIndex, the index build goes through the
+same helpers as the scanner, LocalState and AZBlobStorage.
+
+    python benchmarks/index_bench.py --files 100000 1000000
+"""
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fileIndex import FileIndex, sorted_columns
+from syncPlan import diff_states
+
+
+def fresh(text: str) -> str:
+    """Equal string that is not the same object, as a new source returns it.
+    """
+    return (text + '.')[:-1]
+
+
+def build_rows(files: int, seed: int) -> list:
+    """(name, mtime, size, hash, etag) of every file, in scan order.
+    """
+    rng = random.Random(seed)
+    rows = [(f'\\d{i // 10000:03d}\\s{i // 100 % 100:02d}\\f{i:07d}.dat', 1600000000.0 + i,
+             rng.randrange(64, 1 << 20), f'{rng.getrandbits(256):064x}', f'"0x8DC{rng.getrandbits(48):012X}"')
+            for i in range(files)]
+    rng.shuffle(rows)
+    return rows
+
+
+def dict_maps(rows: list) -> dict:
+    """The maps as plain dicts.
+    """
+    scan_times = {fresh(name): mtime for name, mtime, _, _, _ in rows}
+    scan_sizes = {name: size for name, (_, _, size, _, _) in zip(scan_times, rows)}
+    record = {}
+    saved = {}
+    for name, mtime, size, file_hash, etag in rows:
+        name = fresh(name)
+        record[name] = mtime
+        saved[name] = (mtime, size, fresh(file_hash), fresh(etag))
+    db_items = {}
+    db_hashes = {}
+    for name, mtime, _, file_hash, _ in rows:
+        name = fresh(name)
+        db_items[name] = mtime
+        db_hashes[name] = fresh(file_hash)
+    listed, etags, hashes, stats = {}, {}, {}, {}
+    for name, mtime, size, file_hash, etag in rows:
+        name = fresh(name)
+        listed[name] = mtime + 1.0
+        etags[name] = fresh(etag)
+        hashes[name] = fresh(file_hash)
+        stats[name] = (mtime, size)
+    hash_cache = {fresh(name): (size, mtime, fresh(file_hash)) for name, mtime, size, file_hash, _ in rows}
+    return dict(scan_times=scan_times, scan_sizes=scan_sizes, record=record, saved=saved, db_items=db_items,
+                db_hashes=db_hashes, listed=listed, etags=etags, hashes=hashes, stats=stats, hash_cache=hash_cache)
+
+
+def index_maps(rows: list) -> dict:
+    """The maps as FileIndex, built like fileScanner.scan_tree, LocalState.records,
+    AzCosmosContainer.scan_all_items and AZBlobStorage._index_listed.
+    """
+    intern = sys.intern
+    names, times, sizes = sorted_columns([(fresh(name), mtime, size) for name, mtime, size, _, _ in rows], ('d', 'q'))
+    scan_times, scan_sizes = FileIndex.from_sorted(names, times), FileIndex.from_sorted(names, sizes, typecode='q')
+
+    ordered = sorted(rows)
+    names, mtimes, saved = [], array('d'), []
+    for name, mtime, size, file_hash, etag in ordered:
+        names.append(intern(fresh(name)))
+        mtimes.append(mtime)
+        saved.append((mtime, size, intern(fresh(file_hash)), fresh(etag)))
+    record, saved = FileIndex.from_sorted(names, mtimes), FileIndex.from_sorted(names, saved, typecode=None)
+
+    db_rows = []
+    db_hashes = {}
+    for name, mtime, _, file_hash, _ in rows:
+        name = intern(fresh(name))
+        db_rows.append((name, mtime))
+        db_hashes[name] = intern(fresh(file_hash))
+    db_items = FileIndex(db_rows)
+
+    names, times, etags, hashes, stats = sorted_columns(
+        [(fresh(name), mtime + 1.0, fresh(etag), fresh(file_hash), (mtime, size)) for name, mtime, size, file_hash, etag in ordered],
+        ('d', None, None, None))
+    listed = FileIndex.from_sorted(names, times)
+    etags = FileIndex.from_sorted(names, etags, typecode=None)
+    hashes = FileIndex.from_sorted(names, [intern(file_hash) for file_hash in hashes], typecode=None)
+    stats = FileIndex.from_sorted(names, stats, typecode=None)
+
+    names, entries = [], []
+    for name, mtime, size, file_hash, _ in ordered:
+        names.append(intern(fresh(name)))
+        entries.append((size, mtime, intern(fresh(file_hash))))
+    hash_cache = FileIndex.from_sorted(names, entries, typecode=None)
+    return dict(scan_times=scan_times, scan_sizes=scan_sizes, record=record, saved=saved, db_items=db_items,
+                db_hashes=db_hashes, listed=listed, etags=etags, hashes=hashes, stats=stats, hash_cache=hash_cache)
+
+
+def measure(build, rows: list) -> tuple:
+    """Maps built by build, seconds to build them and MB they hold once built.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    maps = build(rows)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return maps, seconds, held / 1048576
+
+
+def diff_seconds(maps: dict) -> float:
+    """Seconds of diff_states over the record, the scan, the DB items and the listing.
+    """
+    start = time.perf_counter()
+    diff_states(maps['record'], maps['scan_times'], maps['db_items'], maps['listed'])
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{"files":>9} {"maps":<6} {"held MB":>8} {"bytes/file":>10} {"build s":>8} {"diff s":>7}')
+    for files in args.files:
+        rows = build_rows(files, args.seed)
+        held = {}
+        for label, build in (('dict', dict_maps), ('index', index_maps)):
+            maps, seconds, held[label] = measure(build, rows)
+            print(f'{files:>9} {label:<6} {held[label]:>8.1f} {held[label] * 1048576 / files:>10.0f} '
+                  f'{seconds:>8.2f} {diff_seconds(maps):>7.3f}')
+            del maps
+        print(f'{files:>9} {"saved":<6} {1 - held["index"] / held["dict"]:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
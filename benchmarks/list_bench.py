@@ -0,0 +1,57 @@
+"""Wall time and pages/s of the container listing, one pager against top-level prefixes in parallel.
+
+Fills an in-memory container (benchmarks/fake_azure.py) with --blobs blobs
+spread over --folders top-level folders, then takes the listing snapshot
+with AZBlobStorage.blob_file_time_list for each --list-workers value.
+--latency-ms stands in for the time Blob Storage takes to return one page
+of 5000 blobs, which is what a sequential listing waits for page after page.
+
+    python benchmarks/list_bench.py --blobs 200000 --folders 20 --latency-ms 300
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_azure import FakeClientPool
+from azStorage import AZBlobStorage, stat_metadata
+
+
+def fill(pool: FakeClientPool, container: str, blobs: int, folders: int) -> None:
+    """Stores blobs named like FileTracker names the files of a synced tree, with a leading
+    separator, and the metadata uploads write.
+    """
+    container_client = pool.container_client(container)
+    metadata = stat_metadata(os.stat(__file__))
+    for i in range(blobs):
+        container_client._store(f'/d{i % folders:03d}/s{i // folders % 100:02d}/f{i:07d}.dat', 1024, metadata, None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--blobs', type=int, default=200000)
+    parser.add_argument('--folders', type=int, default=20, help='top-level folders the blobs are spread over')
+    parser.add_argument('--latency-ms', type=float, default=300, help='sleep per fake List Blobs page')
+    parser.add_argument('--list-workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    pool = FakeClientPool(latency_ms=args.latency_ms)
+    fill(pool, 'bench', args.blobs, args.folders)
+    print(f'{args.blobs} blobs in {args.folders} folders, latency {args.latency_ms} ms per page')
+    print(f'{"workers":>7} {"wall s":>8} {"pages":>6} {"pages/s":>8} {"listed":>8}')
+    for workers in args.list_workers:
+        storage = AZBlobStorage(working_dir='', conn_str='', container='bench', clients=pool, list_workers=workers)
+        before = pool.stats.get('blob.list', 0)
+        start = time.perf_counter()
+        listed = storage.blob_file_time_list
+        wall = time.perf_counter() - start
+        pages = pool.stats['blob.list'] - before
+        print(f'{workers:>7} {wall:>8.2f} {pages:>6} {pages / wall:>8.1f} {len(listed):>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Wall time, requests and peak memory of FileTracker.sync_all, offline.
+
+Builds a synthetic working_dir (files of mixed sizes in folders of 100),
+points a FileTracker at the in-memory Blob Storage and Cosmos DB of
+fake_azure.py, then runs one sync per scenario on the same tree:
+
+    cold    empty cloud and local record, every file is uploaded
+    idle    nothing changed
+    add     churn * files new files
+    modify  churn * files rewritten with new content and time
+    delete  churn * files removed
+
+Every run works in a temp folder, config.ini is not read and nothing is
+sent to Azure or Splunk. Peak memory is traced with tracemalloc, which
+slows Python down, use --no-trace for wall times. --phases adds the
+phase timers of metrics.py to each line.
+
+    python benchmarks/sync_bench.py --files 10000 --churn 0.01 --latency-ms 0
+"""
+import io
+import os
+import sys
+import math
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Files per folder and folders per top-level folder of the synthetic tree
+FOLDER_FILES = 100
+TOP_FOLDERS = 100
+SCENARIOS = ('cold', 'idle', 'add', 'modify', 'delete')
+
+
+class SyntheticTree:
+    """Files named by number, size and content follow from the number and a version.
+    """
+    def __init__(self, root: str, max_kb: int, seed: int):
+        """
+        Args:
+            root (str): Folder the tree is written to.
+            max_kb (int): Largest file size in KB, sizes are log-uniform from 64 bytes.
+            seed (int): Random seed.
+        """
+        self.root = root
+        self.rng = random.Random(seed)
+        self.max_size = max(64, max_kb * 1024)
+        self.pool = self.rng.randbytes(self.max_size)
+        self.versions = {}
+        self.next_number = 0
+
+
+    def path(self, number: int) -> str:
+        return os.path.join(self.root, f'd{number // (FOLDER_FILES * TOP_FOLDERS):03d}',
+                            f's{number // FOLDER_FILES % TOP_FOLDERS:02d}', f'f{number:07d}.dat')
+
+
+    def write(self, number: int) -> int:
+        """Writes file number with its current version, a rewrite gets a later time.
+
+        Returns:
+            int: bytes written.
+        """
+        version = self.versions.get(number, -1) + 1
+        self.versions[number] = version
+        size = int(2 ** self.rng.uniform(6, math.log2(self.max_size)))
+        path = self.path(number)
+        if version == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_time = None
+        else:
+            old_time = os.stat(path).st_mtime
+        with open(path, 'wb') as data:
+            data.write(f'{number}:{version}\n'.encode())
+            data.write(self.pool[:size])
+        if old_time is not None:
+            os.utime(path, (old_time + 1, old_time + 1))
+        return size
+
+
+    def add(self, count: int) -> int:
+        for _ in range(count):
+            self.write(self.next_number)
+            self.next_number += 1
+        return count
+
+
+    def modify(self, count: int) -> int:
+        numbers = self.rng.sample(sorted(self.versions), min(count, len(self.versions)))
+        for number in numbers:
+            self.write(number)
+        return len(numbers)
+
+
+    def delete(self, count: int) -> int:
+        numbers = self.rng.sample(sorted(self.versions), min(count, len(self.versions)))
+        for number in numbers:
+            os.remove(self.path(number))
+            del self.versions[number]
+        return len(numbers)
+
+
+def request_delta(before: dict, after: dict) -> dict:
+    """Requests and bytes issued between two FakeClientPool.stats.
+    """
+    return {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}
+
+
+def run_sync(tracker, pool, trace: bool) -> dict:
+    """One sync_all, measured.
+
+    Returns:
+        dict: {"wall_sec": float, "requests": dict, "peak_mb": float or None, "phases": {"phase": float}}
+    """
+    from metrics import metrics
+    before = pool.stats
+    phases = phase_times(metrics.render())
+    if trace:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracker.sync_all()
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1048576 if trace else None
+    phases = {phase: seconds - phases.get(phase, 0) for phase, seconds in phase_times(metrics.render()).items()}
+    return dict(wall_sec=wall, requests=request_delta(before, pool.stats), peak_mb=peak,
+                phases={phase: seconds for phase, seconds in phases.items() if seconds > 0})
+
+
+def phase_times(text: str) -> dict:
+    """phase_seconds_total of a metrics render.
+
+    Returns:
+        dict: {"phase": float}
+    """
+    times = {}
+    for line in text.splitlines():
+        if line.startswith('azsync_phase_seconds_total{'):
+            labels, value = line.rsplit(' ', 1)
+            times[labels.split('"')[1]] = float(value)
+    return times
+
+
+def check_in_sync(tracker, pool, container: str, tree: SyntheticTree) -> str:
+    """Empty when the blobs and DB items (recorded etags with --state-backend blob)
+    match the tree, a message otherwise. The container manifest is not counted.
+    """
+    from containerManifest import MANIFEST_BLOB
+    blobs = sum(1 for name in pool.container_client(container).blobs if name != MANIFEST_BLOB)
+    if tracker.blob_state:
+        items = sum(1 for etag in tracker.state.etags.values() if etag)
+    else:
+        items = sum(1 for item in tracker.db_resource.container.items.values() if not item.get('deleted'))
+    files = len(tree.versions)
+    if blobs == items == files:
+        return ''
+    return f'out of sync: {files} files, {blobs} blobs, {items} DB items'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=10000, help='files in the tree, 10k to 1M')
+    parser.add_argument('--max-kb', type=int, default=64, help='largest file, sizes are log-uniform from 64 bytes')
+    parser.add_argument('--churn', type=float, default=0.01, help='share of files added, modified and deleted')
+    parser.add_argument('--latency-ms', type=float, default=0, help='sleep per fake Azure request')
+    parser.add_argument('--workers', default='8', help='as the workers setting')
+    parser.add_argument('--scan-workers', default='4', help='as the scan_workers setting')
+    parser.add_argument('--hash-check', default='true', help='as the hash_check setting')
+    parser.add_argument('--change-feed', default='false', help='as the change_feed setting')
+    parser.add_argument('--state-backend', default='cosmos', help='as the state_backend setting')
+    parser.add_argument('--container-manifest', default='false', help='as the container_manifest setting')
+    parser.add_argument('--list-workers', default='1', help='as the list_workers setting')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, run in this order')
+    parser.add_argument('--no-trace', action='store_true', help='skip tracemalloc, faster but no peak memory')
+    parser.add_argument('--phases', action='store_true', help='print the time of each sync phase')
+    parser.add_argument('--keep', action='store_true', help='keep the temp folder')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {sorted(unknown)}')
+
+    work_dir = tempfile.mkdtemp(prefix='sync-bench-')
+    # config.ini, log.log and the local state are looked up in the current folder
+    os.chdir(work_dir)
+    from fake_azure import FakeClientPool
+    from main import FileTracker
+    logging.disable(logging.INFO)
+
+    try:
+        tree = SyntheticTree(os.path.join(work_dir, 'tree'), args.max_kb, args.seed)
+        start = time.perf_counter()
+        tree.add(args.files)
+        print(f'tree: {args.files} files up to {args.max_kb} KB in {time.perf_counter() - start:.1f}s, '
+              f'churn {args.churn:.1%}, latency {args.latency_ms} ms, workers {args.workers}')
+
+        if not args.no_trace:
+            tracemalloc.start()
+        pool = FakeClientPool(latency_ms=args.latency_ms)
+        tracker = FileTracker(
+            working_dir=tree.root, t_sec='0', conn_str='', sto_container='bench', db_name='bench',
+            uri='', key='', db_container='bench', workers=args.workers, scan_workers=args.scan_workers,
+            hash_check=args.hash_check, change_feed=args.change_feed, state_backend=args.state_backend,
+            container_manifest=args.container_manifest, list_workers=args.list_workers, clients=pool,
+            metrics_file='metrics.prom' if args.phases else '')
+
+        churn = max(1, int(args.files * args.churn))
+        actions = dict(cold=lambda: args.files, idle=lambda: 0, add=lambda: tree.add(churn),
+                       modify=lambda: tree.modify(churn), delete=lambda: tree.delete(churn))
+
+        print(f'{"scenario":<8} {"files":>8} {"wall s":>8} {"requests":>9} {"peak MB":>8}  detail')
+        for name in scenarios:
+            files = actions[name]()
+            result = run_sync(tracker, pool, not args.no_trace)
+            requests = result['requests']
+            detail = ' '.join(f'{key}={value}' for key, value in sorted(requests.items()))
+            count = sum(value for key, value in requests.items() if not key.startswith('bytes_'))
+            peak = f'{result["peak_mb"]:.1f}' if result['peak_mb'] is not None else '-'
+            print(f'{name:<8} {files:>8} {result["wall_sec"]:>8.2f} {count:>9} {peak:>8}  {detail}')
+            if args.phases:
+                print(' ' * 9 + ' '.join(f'{phase}={seconds:.3f}s' for phase, seconds in sorted(
+                    result['phases'].items(), key=lambda item: -item[1]) if phase != 'sync_all'))
+            problem = check_in_sync(tracker, pool, 'bench', tree)
+            if problem:
+                print(f'{name}: {problem}')
+
+        tracker.state.close()
+    finally:
+        os.chdir(os.path.dirname(work_dir))
+        if args.keep:
+            print(f'kept {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
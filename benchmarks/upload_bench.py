@@ -0,0 +1,63 @@
+"""Wall time and MB/s of one large file uploaded as a single put and as blocks staged in parallel.
+
+Writes a --size-mb file of random bytes, then uploads it with
+AZBlobStorage.put_file to an in-memory container (benchmarks/fake_azure.py),
+once through the single upload_blob put and once through the large-file path
+for each --block-workers value. --conn-mbps caps what one connection carries,
+as a single stream to Blob Storage does long before the uplink is full, and
+--latency-ms is added to every request.
+
+    python benchmarks/upload_bench.py --size-mb 256 --conn-mbps 200 --block-workers 1 4 8 16
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_azure import FakeClientPool
+from azStorage import AZBlobStorage
+
+
+def upload(working_dir: str, file_name: str, conn_mbps: float, latency_ms: float, **settings) -> tuple:
+    """Seconds put_file takes on a fresh container, and the requests it made.
+    """
+    pool = FakeClientPool(latency_ms=latency_ms, conn_mbps=conn_mbps, pool_size=64)
+    storage = AZBlobStorage(working_dir=working_dir, conn_str='', container='bench', clients=pool, **settings)
+    start = time.perf_counter()
+    storage.put_file(file_name)
+    return time.perf_counter() - start, pool.counter.total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--block-mb', type=float, default=4, help='block size of the large-file path')
+    parser.add_argument('--block-workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--conn-mbps', type=float, default=200, help='Mbit/s of one fake connection')
+    parser.add_argument('--latency-ms', type=float, default=20, help='sleep per fake request')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as working_dir:
+        file_name = 'large.bin'
+        with open(os.path.join(working_dir, file_name), 'wb') as file_data:
+            for _ in range(args.size_mb):
+                file_data.write(os.urandom(1048576))
+
+        print(f'{args.size_mb} MB file, {args.conn_mbps:g} Mbit/s per connection, latency {args.latency_ms:g} ms')
+        print(f'{"path":<10} {"workers":>7} {"wall s":>8} {"MB/s":>7} {"requests":>8}')
+        wall, requests = upload(working_dir, file_name, args.conn_mbps, args.latency_ms)
+        print(f'{"put":<10} {1:>7} {wall:>8.2f} {args.size_mb / wall:>7.1f} {requests:>8}')
+        for workers in args.block_workers:
+            wall, requests = upload(working_dir, file_name, args.conn_mbps, args.latency_ms,
+                                    large_file_size=1, block_size=int(args.block_mb * 1048576),
+                                    block_workers=workers)
+            print(f'{"blocks":<10} {workers:>7} {wall:>8.2f} {args.size_mb / wall:>7.1f} {requests:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Blob metadata key holding the codec a blob was compressed with.
+CODEC_KEY = 'azcodec'
+# Bytes read and compressed at a time.
+CHUNK_SIZE = 1048576
+# Sample compressed to decide if a file is worth compressing.
+SAMPLE_SIZE = 65536
+# Sample must shrink below this ratio or the file is sent raw.
+MIN_RATIO = 0.9
+
+# Formats that are already compressed.
+SKIP_EXTENSIONS = {
+    '.7z', '.aac', '.avi', '.br', '.bz2', '.cab', '.docx', '.epub', '.flac', '.gif', '.gz', '.heic',
+    '.jar', '.jpeg', '.jpg', '.lz4', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.odp', '.ods', '.odt',
+    '.ogg', '.png', '.pptx', '.rar', '.tgz', '.webm', '.webp', '.whl', '.xlsx', '.xz', '.zip', '.zst',
+}
+
+
+def available(codec: str) -> bool:
+    """True if this client can read and write codec.
+
+    Args:
+        codec (str): 'zstd' or 'gzip'
+
+    Returns:
+        bool
+    """
+    if codec == 'zstd':
+        return zstandard is not None
+    return codec == 'gzip'
+
+
+def compressor(codec: str) -> object:
+    """Streaming compressor with compress(bytes) and flush().
+
+    Args:
+        codec (str): 'zstd' or 'gzip'
+
+    Returns:
+        object: compress object
+    """
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if codec == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    raise ValueError(f"Unsupported codec: {codec}")
+
+
+def decompressor(codec: str) -> object:
+    """Streaming decompressor with decompress(bytes).
+
+    Args:
+        codec (str): codec from the blob metadata.
+
+    Returns:
+        object: decompress object
+    """
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("Blob is zstd compressed, install the 'zstandard' package to download it")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == 'gzip':
+        return zlib.decompressobj(31)
+    raise ValueError(f"Blob is compressed with '{codec}', which this client can't read")
+
+
+def worth_compressing(file_name: str, file_data: object) -> bool:
+    """Skips known compressed formats, then compresses a sample from the
+    start of the file and checks it shrinks below MIN_RATIO. The read
+    position of file_data is restored.
+
+    Args:
+        file_name (str): "path/filename"
+        file_data (object): file object open for reading.
+
+    Returns:
+        bool: True if the file should be compressed.
+    """
+    if os.path.splitext(file_name)[1].lower() in SKIP_EXTENSIONS:
+        return False
+
+    position = file_data.tell()
+    sample = file_data.read(SAMPLE_SIZE)
+    file_data.seek(position)
+    if not sample:
+        return False
+
+    return len(zlib.compress(sample, 1)) < len(sample) * MIN_RATIO
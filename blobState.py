@@ -0,0 +1,116 @@
+from log import setup_logger
+from metrics import metrics
+from azStorage import AZBlobStorage
+from localState import LocalState
+from fileIndex import FileIndex, joined
+
+logger=setup_logger(__name__)
+
+
+class BlobStateRecord:
+    """Cloud state without CosmosDB: the local record keeps the etag of the blob each file
+    was last synced with, and the blob listing of the run shows what other clients changed.
+    Used by FileTracker in place of AzCosmosContainer, nothing is sent to Azure.
+    """
+    def __init__(self, state:LocalState, storage:AZBlobStorage, container_name:str):
+        """
+        Args:
+            state (LocalState): Local record holding the synced etags.
+            storage (AZBlobStorage): Storage whose listing snapshot is compared with them.
+            container_name (str): Storage container, for log lines.
+        """
+        self.state = state
+        self.storage = storage
+        self.container_name = container_name
+        self.change_feed = False
+        # {"path/filename": etag or None} of the blob each file was last synced with
+        self.etags = None
+
+
+    @property
+    def create_load_db(self) -> None:
+        """Nothing to create, the state is in the local record.
+        """
+
+
+    @property
+    def create_load_container(self) -> None:
+        """Nothing to create, the state is in the local record.
+        """
+
+
+    @property
+    def scan_all_items(self) -> FileIndex:
+        """Cloud state of the last run, rebuilt from the recorded etags and the listing snapshot,
+        so the container must be listed first.
+        A file whose blob kept its etag gets the listed time, a file whose blob changed or is gone
+        gets 0.0, which diff_states reports as changed or removed. A file recorded without an
+        etag (older versions, state_backend=cosmos) takes the listing as it is.
+
+        Returns:
+            FileIndex: Format: {fileName:str, fileTime:float}
+        """
+        listed = self.storage.cloud_index or {}
+        listed_etags = self.storage.cloud_etags
+        self.etags = self.state.etags
+        rows = []
+        adopted = {}
+
+        for key, etag, listed_etag, listed_time in joined(self.etags, listed_etags, listed):
+            if etag is None:
+                if listed_time is not None:
+                    rows.append((key, listed_time))
+                    adopted[key] = listed_etag
+            elif listed_etag == etag:
+                rows.append((key, listed_time))
+            else:
+                rows.append((key, 0.0))
+        self.etags.update(adopted)
+        file_time_list = FileIndex(rows)
+
+        metrics.gauge('db_scanned_items', len(file_time_list))
+        logger.info(f'Container: {self.container_name} state of {len(file_time_list)} files from the listing')
+        return file_time_list
+
+
+    @property
+    def scan_changes(self) -> FileIndex:
+        """Same as scan_all_items, the listing already holds every change.
+        """
+        return self.scan_all_items
+
+
+    def add_update_dictionary(self, dictionary:dict, hashes:dict=None) -> dict:
+        """Records the listed etag of files that were uploaded or downloaded,
+        written to the local record by FileTracker.after_save_local.
+
+        Args:
+            dictionary (dict): Format: {fileName: fileTime}
+            hashes (dict, optional): Not used, the hash is blob metadata. Defaults to None.
+
+        Returns:
+            dict: {fileName: "local"} outcome per file.
+        """
+        if self.etags is None:
+            self.etags = self.state.etags
+        listed_etags = self.storage.cloud_etags
+        for key in dictionary:
+            self.etags[key] = listed_etags.get(key)
+        return dict.fromkeys(dictionary, "local")
+
+
+    def delete_item_list(self, item_list:list, par_key={}) -> dict:
+        """Forgets the etag of files removed on one side.
+
+        Args:
+            item_list (list): fileName, The str() of the file.
+            par_key (dict, optional): Not used. Defaults to {}.
+
+        Returns:
+            dict: {fileName: "local"} outcome per file.
+        """
+        if self.etags is None:
+            self.etags = self.state.etags
+        for key in item_list:
+            self.etags.pop(key, None)
+        return dict.fromkeys(item_list, "local")
@@ -0,0 +1,151 @@
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bytes read from the file at a time while chunking.
+READ_SIZE = 8388608
+# Bytes hashed at a time by the numpy gear hash, a cut is searched block by block.
+SCAN_BLOCK = 65536
+# Fixed seed, every client must cut the same bytes at the same places.
+GEAR_SEED = 0x6a09e667
+_gear_random = random.Random(GEAR_SEED)
+GEAR = tuple(_gear_random.getrandbits(64) for _ in range(256))
+HASH_BITS = 0xFFFFFFFFFFFFFFFF
+_GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64) if numpy is not None else None
+
+
+def _masks(avg_size: int) -> tuple:
+    """Boundary masks for normalized chunking, taken from the top bits of the
+    64 bit hash so a boundary depends on the last 64 bytes.
+
+    Args:
+        avg_size (int): Target average chunk size, rounded down to a power of two.
+
+    Returns:
+        tuple: (mask used before avg_size, mask used after avg_size)
+    """
+    bits = max(avg_size.bit_length() - 1, 4)
+    strict = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+    loose = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+    return strict, loose
+
+
+def cut_point(data: bytes, min_size: int, avg_size: int, max_size: int) -> int:
+    """Length of the first chunk of data (FastCDC gear hash, normalized chunking).
+    Below avg_size a stricter mask is used and past it a looser one, so chunk
+    sizes stay close to avg_size. The first min_size bytes are never hashed.
+    Hashed with numpy when it is installed, one Python step per byte otherwise,
+    both cut at the same places.
+
+    Args:
+        data (bytes): Bytes to cut, a chunk never spans more than max_size of it.
+        min_size (int): Smallest chunk, unless data is shorter.
+        avg_size (int): Target average chunk size.
+        max_size (int): Largest chunk.
+
+    Returns:
+        int: Chunk length.
+    """
+    size = len(data)
+    if size <= min_size:
+        return size
+    end = min(size, max_size)
+    normal = min(end, avg_size)
+    strict, loose = _masks(avg_size)
+    if _GEAR_ARRAY is not None:
+        return _cut_point_numpy(data, min_size, normal, end, strict, loose)
+    gear = GEAR
+    h = 0
+
+    position = min_size
+    for byte in data[min_size:normal]:
+        h = ((h << 1) + gear[byte]) & HASH_BITS
+        position += 1
+        if not h & strict:
+            return position
+    for byte in data[normal:end]:
+        h = ((h << 1) + gear[byte]) & HASH_BITS
+        position += 1
+        if not h & loose:
+            return position
+    return end
+
+
+def _cut_point_numpy(data: bytes, min_size: int, normal: int, end: int, strict: int, loose: int) -> int:
+    """cut_point with the gear hash of SCAN_BLOCK bytes at a time computed by numpy, which
+    releases the GIL so upload workers chunk in parallel. The hash of a byte is the sum of
+    the gear values of the last 64 bytes, each shifted by its distance, built in 6 doubling
+    steps. Bytes before min_size count as 0, like the hash starting at 0 there.
+
+    Args:
+        data (bytes): Bytes to cut.
+        min_size (int): First byte hashed.
+        normal (int): Where the strict mask gives way to the loose one.
+        end (int): Cut when no boundary is found before it.
+        strict (int): Mask used before normal.
+        loose (int): Mask used from normal on.
+
+    Returns:
+        int: Chunk length.
+    """
+    values = numpy.frombuffer(data, dtype=numpy.uint8)
+    for start, stop, mask in ((min_size, normal, strict), (normal, end, loose)):
+        mask = numpy.uint64(mask)
+        for block in range(start, stop, SCAN_BLOCK):
+            block_end = min(block + SCAN_BLOCK, stop)
+            first = max(min_size, block - 63)
+            hashes = _GEAR_ARRAY[values[first:block_end]]
+            for shift in (1, 2, 4, 8, 16, 32):
+                hashes[shift:] += hashes[:-shift] << numpy.uint64(shift)
+            hits = numpy.flatnonzero((hashes[block - first:] & mask) == 0)
+            if hits.size:
+                return block + int(hits[0]) + 1
+    return end
+
+
+def iter_chunks(file_data: object, min_size: int, avg_size: int, max_size: int) -> object:
+    """Cuts a file into content-defined chunks. The same bytes give the same chunks
+    wherever they sit in the file, so an insert only changes the chunks around it.
+
+    Args:
+        file_data (object): file object open for reading.
+        min_size (int): Smallest chunk, only the last one can be shorter.
+        avg_size (int): Target average chunk size.
+        max_size (int): Largest chunk.
+
+    Returns:
+        generator: chunk bytes in file order.
+    """
+    buffer = b''
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - offset < max_size:
+            block = file_data.read(max(READ_SIZE, max_size))
+            eof = not block
+            buffer = buffer[offset:] + block
+            offset = 0
+            continue
+        if offset >= len(buffer):
+            return
+
+        window = buffer[offset:offset + max_size]
+        length = cut_point(window, min_size, avg_size, max_size)
+        yield window[:length]
+        offset += length
+
+
+def chunk_sizes(avg_kb: int) -> tuple:
+    """Min, average and max chunk size for an average in KB.
+
+    Args:
+        avg_kb (int): Target average chunk size in KB.
+
+    Returns:
+        tuple: (min_size, avg_size, max_size) in bytes
+    """
+    avg_size = 1 << max(int(avg_kb) * 1024, 64).bit_length() - 1
+    return avg_size // 4, avg_size, avg_size * 4
@@ -0,0 +1,228 @@
+import os
+import gzip
+import json
+from azure.core import MatchConditions
+from azure.core.exceptions import (AzureError, ResourceExistsError, ResourceModifiedError,
+                                   ResourceNotFoundError, ResourceNotModifiedError)
+from log import setup_logger
+from metrics import metrics
+from fileIndex import FileIndex
+
+logger=setup_logger(__name__)
+
+# Blob holding the container manifest, left out of every listing.
+MANIFEST_BLOB = '.azsync-manifest.json.gz'
+# Format of the manifest blob.
+MANIFEST_VERSION = 1
+# Writes tried when other clients keep changing the manifest first.
+WRITE_RETRIES = 5
+
+
+def encode(entries: dict) -> bytes:
+    """Gzipped JSON of the manifest, names use '/' whatever the OS.
+
+    Args:
+        entries (dict): {"path\\filename": [blob time, etag, hash, mtime, size]}
+
+    Returns:
+        bytes: Blob content.
+    """
+    names = {name.replace(os.sep, '/'): entry for name, entry in entries.items()}
+    return gzip.compress(json.dumps({"version": MANIFEST_VERSION, "entries": names},
+                                    separators=(',', ':')).encode(), compresslevel=6)
+
+
+def decode(data: bytes) -> FileIndex:
+    """Entries of a manifest blob.
+
+    Args:
+        data (bytes): Blob content.
+
+    Raises:
+        ValueError: Not a manifest this version can read.
+
+    Returns:
+        FileIndex: {"path\\filename": [blob time, etag, hash, mtime, size]}
+    """
+    try:
+        manifest = json.loads(gzip.decompress(data))
+        if manifest["version"] != MANIFEST_VERSION:
+            raise ValueError(f'manifest version {manifest["version"]}')
+        return FileIndex(((name.replace('/', os.sep), entry) for name, entry in manifest["entries"].items()),
+                         typecode=None)
+    except (OSError, KeyError, TypeError, AttributeError) as err:
+        raise ValueError(f'unreadable manifest: {err}')
+
+
+def diff_entries(before: dict, after: dict) -> dict:
+    """Entries that differ between two copies of the manifest.
+
+    Args:
+        before (dict): Cached copy.
+        after (dict): New copy.
+
+    Returns:
+        dict: {"path\\filename": entry, or None when removed}
+    """
+    if isinstance(before, FileIndex) and isinstance(after, FileIndex):
+        added, changes, removed = before.diff(after)
+        changes.update(added)
+        changes.update(dict.fromkeys(removed))
+        return changes
+
+    changes = {name: entry for name, entry in after.items() if before.get(name) != entry}
+    # every name of before is also in after when the counts match
+    if len(before) > len(after) - sum(1 for name in changes if name not in before):
+        changes.update({name: None for name in before if name not in after})
+    return changes
+
+
+class ContainerManifest:
+    """Compressed copy of the container listing kept in one blob: time, etag, content hash,
+    local mtime and size of every blob. Writers merge their changes into it with optimistic
+    concurrency (If-Match on its etag), readers fetch it with If-None-Match, so a run where
+    no client wrote anything costs one 304 response instead of a full listing.
+    """
+    def __init__(self, clients: object, container: str, blob_name: str=MANIFEST_BLOB):
+        """
+        Args:
+            clients (AzClientPool): Shared clients.
+            container (str): Storage Actual Name
+            blob_name (str, optional): Manifest blob. Defaults to MANIFEST_BLOB.
+        """
+        self.clients = clients
+        self.container = container
+        self.blob_name = blob_name
+        # FileIndex {"path\\filename": [blob time, etag, hash, mtime, size]} as of self.etag
+        self.entries = None
+        self.etag = None
+        # {"path\\filename": entry or None} written by this client, not in the manifest yet
+        self.pending = {}
+        # {"path\\filename": entry or None} of other clients, merged while writing, not returned by fetch yet
+        self.unseen = {}
+        # True until the manifest was checked against a full listing, and after a failed write
+        self.stale = True
+
+
+    def _blob_client(self) -> object:
+        return self.clients.container_client(self.container).get_blob_client(blob=self.blob_name)
+
+
+    def fetch(self) -> dict:
+        """Downloads the manifest unless its etag is the one of the cached copy,
+        then compares it with the cached copy.
+
+        Raises:
+            ResourceNotFoundError: There is no manifest.
+            ValueError: The manifest can't be read, it has to be rebuilt.
+
+        Returns:
+            dict: {"path\\filename": entry, or None when removed} changed since the last fetch.
+        """
+        changes, self.unseen = self.unseen, {}
+        kwargs = {}
+        if self.etag is not None and self.entries is not None:
+            kwargs = dict(etag=self.etag, match_condition=MatchConditions.IfModified)
+
+        try:
+            downloader = self._blob_client().download_blob(**kwargs)
+            data = downloader.readall()
+        except ResourceNotModifiedError:
+            metrics.count('manifest_fetch_total', result='not_modified')
+            return changes
+        except ResourceNotFoundError:
+            metrics.count('manifest_fetch_total', result='missing')
+            raise
+
+        self.etag = downloader.properties.etag
+        try:
+            entries = decode(data)
+        except ValueError:
+            self.entries = FileIndex(typecode=None)
+            metrics.count('manifest_fetch_total', result='unreadable')
+            raise
+
+        changes.update(diff_entries(self.entries or {}, entries))
+        self.entries = entries
+        metrics.count('manifest_fetch_total', result='changed')
+        metrics.count('manifest_changed_paths_total', len(changes))
+        logger.info(f'Container manifest: {len(data)} bytes, {len(entries)} entries, {len(changes)} changed')
+        return changes
+
+
+    def rebuild(self, listed: dict) -> None:
+        """Writes the differences between a full listing and the manifest,
+        the listing is taken as the truth.
+
+        Args:
+            listed (FileIndex): {"path\\filename": entry} of every blob.
+        """
+        try:
+            self.fetch()
+        except ResourceNotFoundError:
+            self.entries, self.etag = FileIndex(typecode=None), None
+        except ValueError as err:
+            logger.error("Container manifest rewritten. Here's why: %s", err)
+        except AzureError as err:
+            logger.error("Couldn't read the container manifest. Here's why: %s", err)
+            return
+
+        self.unseen = {}
+        self.pending = diff_entries(self.entries, listed)
+        if self.save():
+            self.stale = False
+
+
+    def save(self) -> bool:
+        """Writes the pending changes, merged into the newest manifest when another client
+        wrote it first. A write that keeps failing marks the manifest stale,
+        so the next run lists the container and rebuilds it.
+
+        Returns:
+            bool: True when the manifest holds every pending change.
+        """
+        if not self.pending:
+            return True
+
+        for _ in range(WRITE_RETRIES):
+            entries = self.entries.copy() if self.entries is not None else FileIndex(typecode=None)
+            for name, entry in self.pending.items():
+                if entry is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = entry
+
+            if self.etag is None:
+                kwargs = dict(overwrite=False)
+            else:
+                kwargs = dict(overwrite=True, etag=self.etag, match_condition=MatchConditions.IfNotModified)
+            try:
+                response = self._blob_client().upload_blob(encode(entries), **kwargs)
+
+            except (ResourceModifiedError, ResourceExistsError):
+                # another client wrote first, merge into its version
+                metrics.count('manifest_write_total', result='conflict')
+                try:
+                    self.unseen = self.fetch()
+                except ResourceNotFoundError:
+                    self.entries, self.etag = FileIndex(typecode=None), None
+                except (AzureError, ValueError) as err:
+                    logger.error("Couldn't read the container manifest. Here's why: %s", err)
+                    break
+                continue
+
+            except AzureError as err:
+                logger.error("Couldn't write the container manifest. Here's why: %s", err)
+                break
+
+            self.entries = entries
+            self.etag = response['etag']
+            logger.info(f'Container manifest: {len(self.pending)} changes written, {len(entries)} entries')
+            self.pending = {}
+            metrics.count('manifest_write_total', result='ok')
+            return True
+
+        metrics.count('manifest_write_total', result='failed')
+        logger.error(f'Container manifest: {len(self.pending)} changes not written, the next run lists the container')
+        self.stale = True
+        return False
@@ -0,0 +1,358 @@
+import sys
+from array import array
+from bisect import bisect_left
+from operator import eq, itemgetter
+from itertools import islice
+from collections.abc import ItemsView, Mapping, MutableMapping, ValuesView
+
+# Marks a name missing from an index
+_MISSING = object()
+# Added names kept in the overlay before they are merged into the sorted columns
+MIN_OVERLAY = 4096
+# Names compared at a time by FileIndex.diff while both sides are the same
+DIFF_RUN = 64
+
+
+def column(typecode: str, values) -> object:
+    """Storage for one column of values.
+
+    Args:
+        typecode (str): array typecode, 'd' for times and 'q' for sizes, None keeps Python objects.
+        values (iterable): Values in name order.
+
+    Returns:
+        array or list
+    """
+    return array(typecode, values) if typecode else list(values)
+
+
+def sorted_columns(rows, typecodes: tuple=('d',)) -> tuple:
+    """Sorts (name, value, ...) rows by name and splits them into a list of interned names
+    and one column per value. A name listed twice keeps its last row.
+
+    Args:
+        rows (list): [(name, value, ...)], sorted in place.
+        typecodes (tuple, optional): Typecode of each value column, see column. Defaults to ('d',).
+
+    Returns:
+        tuple: ([names], column, ...)
+    """
+    rows.sort(key=itemgetter(0))
+    names = list(map(itemgetter(0), rows))
+    if any(map(eq, names, islice(names, 1, None))):
+        rows = list({row[0]: row for row in rows}.values())
+        names = list(map(itemgetter(0), rows))
+    names = list(map(sys.intern, names))
+    return (names, *(column(typecode, map(itemgetter(i), rows)) for i, typecode in enumerate(typecodes, 1)))
+
+
+def joined(index, *others, default=None):
+    """Every (name, value) of index with the value of the same name in each of others.
+    FileIndex columns are matched by one merge of the sorted names, or taken as they are
+    when the names are the same, so no name is looked up one by one. Other mappings use get.
+
+    Args:
+        index (FileIndex or dict): Names to walk.
+        *others (FileIndex or dict): Values to join.
+        default (optional): Value of a name missing from one of others. Defaults to None.
+
+    Returns:
+        iterator: (name, value, other value, ...)
+    """
+    if not isinstance(index, FileIndex):
+        return ((name, value, *(other.get(name, default) for other in others)) for name, value in index.items())
+
+    index.compact()
+    names = index._names
+    columns = []
+    for other in others:
+        if isinstance(other, FileIndex):
+            columns.append(other._aligned(names, default))
+        else:
+            columns.append([other.get(name, default) for name in names])
+    return zip(names, index._values, *columns)
+
+
+class _IndexItems(ItemsView):
+    __slots__ = ()
+
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+
+class _IndexValues(ValuesView):
+    __slots__ = ()
+
+    def __iter__(self):
+        for _, value in self._mapping._iter_items():
+            yield value
+
+
+class FileIndex(MutableMapping):
+    """{"path/filename": value} for trees of millions of files, used in place of a dict.
+    Names are interned and kept sorted in a list, so every index of the same files (local scan,
+    local record, DB items, blob listing) shares one copy of each path, and the values sit in an
+    array column (8 bytes per time or size). Indexes built from the same scan share the names list.
+    Changes after the build are written in place, added names wait in a small overlay dict
+    and removed ones in a set until they are merged into the columns.
+    """
+    __slots__ = ('_names', '_values', '_typecode', '_added', '_removed', '_size')
+
+    def __init__(self, items=None, typecode: str='d'):
+        """
+        Args:
+            items (dict or iterable, optional): {name: value} or (name, value) pairs. Defaults to None.
+            typecode (str, optional): array typecode of the values, None for any object. Defaults to 'd'.
+        """
+        pairs = list(items.items() if isinstance(items, Mapping) else items or ())
+        self._init(*sorted_columns(pairs, (typecode,)), typecode)
+
+
+    def _init(self, names: list, values: object, typecode: str) -> None:
+        self._names = names
+        self._values = values
+        self._typecode = typecode
+        self._added = {}
+        self._removed = set()
+        self._size = len(names)
+
+
+    @classmethod
+    def from_sorted(cls, names: list, values: object, typecode: str='d') -> 'FileIndex':
+        """Index over columns already in name order, nothing is copied.
+
+        Args:
+            names (list): Sorted, interned names, never changed afterwards so indexes can share it.
+            values (array or list): Values in the same order.
+            typecode (str, optional): Typecode of values, None for a list. Defaults to 'd'.
+
+        Returns:
+            FileIndex
+        """
+        index = cls.__new__(cls)
+        index._init(names, values, typecode)
+        return index
+
+
+    def _find(self, name) -> int:
+        """Position of name in the columns, -1 when it is not there or removed."""
+        names = self._names
+        try:
+            i = bisect_left(names, name)
+        except TypeError:
+            return -1
+        if i < len(names) and names[i] == name and not (self._removed and name in self._removed):
+            return i
+        return -1
+
+
+    def __getitem__(self, name):
+        value = self._added.get(name, _MISSING)
+        if value is not _MISSING:
+            return value
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        return self._values[i]
+
+
+    def get(self, name, default=None):
+        value = self._added.get(name, _MISSING)
+        if value is not _MISSING:
+            return value
+        i = self._find(name)
+        return default if i < 0 else self._values[i]
+
+
+    def __contains__(self, name) -> bool:
+        return name in self._added or self._find(name) >= 0
+
+
+    def __setitem__(self, name: str, value) -> None:
+        added = self._added
+        if name in added:
+            added[name] = value
+            return
+        names = self._names
+        i = bisect_left(names, name)
+        if i < len(names) and names[i] == name:
+            if self._removed and name in self._removed:
+                self._removed.discard(name)
+                self._size += 1
+            self._values[i] = value
+            return
+        added[sys.intern(name)] = value
+        self._size += 1
+        if len(added) > max(MIN_OVERLAY, len(names) >> 3):
+            self.compact()
+
+
+    def __delitem__(self, name) -> None:
+        if name in self._added:
+            del self._added[name]
+            self._size -= 1
+            return
+        i = self._find(name)
+        if i < 0:
+            raise KeyError(name)
+        self._removed.add(self._names[i])
+        self._size -= 1
+
+
+    def pop(self, name, default=_MISSING):
+        value = self.get(name, _MISSING)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(name)
+            return default
+        del self[name]
+        return value
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def __iter__(self):
+        if self._removed:
+            removed = self._removed
+            yield from (name for name in self._names if name not in removed)
+        else:
+            yield from self._names
+        yield from list(self._added)
+
+
+    def _iter_items(self):
+        if self._removed:
+            removed = self._removed
+            yield from ((name, value) for name, value in zip(self._names, self._values) if name not in removed)
+        else:
+            yield from zip(self._names, self._values)
+        yield from list(self._added.items())
+
+
+    def items(self) -> ItemsView:
+        return _IndexItems(self)
+
+
+    def values(self) -> ValuesView:
+        return _IndexValues(self)
+
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        get = other.get
+        return all(get(name, _MISSING) == value for name, value in self._iter_items())
+
+
+    __hash__ = None
+
+
+    def __repr__(self) -> str:
+        return f'FileIndex({len(self)} names)'
+
+
+    def copy(self) -> 'FileIndex':
+        """Copy sharing the names, values and overlay are copied.
+        """
+        index = self.from_sorted(self._names, self._values[:], self._typecode)
+        index._added = dict(self._added)
+        index._removed = set(self._removed)
+        index._size = self._size
+        return index
+
+
+    def compact(self) -> None:
+        """Merges the overlay into new sorted columns, the old names list is left to the indexes sharing it.
+        """
+        if not self._added and not self._removed:
+            return
+        if self._removed:
+            removed = self._removed
+            rows = [(name, value) for name, value in zip(self._names, self._values) if name not in removed]
+        else:
+            rows = list(zip(self._names, self._values))
+        # two sorted runs once the overlay is sorted, merged by one pass of the sort
+        rows.extend(sorted(self._added.items(), key=itemgetter(0)))
+        self._init(*sorted_columns(rows, (self._typecode,)), self._typecode)
+
+
+    def diff(self, after: 'FileIndex') -> tuple:
+        """Added, changed and removed names from self to after in one merge of the sorted columns.
+        Runs of DIFF_RUN equal names (the same interned strings) and values are compared as slices.
+
+        Args:
+            after (FileIndex): Current state.
+
+        Returns:
+            tuple: ({added}, {changed}, {removed}), values from after, or self for removed.
+        """
+        self.compact()
+        after.compact()
+        before_names, before_values = self._names, self._values
+        after_names, after_values = after._names, after._values
+        before_len, after_len = len(before_names), len(after_names)
+        added, changed, removed = {}, {}, {}
+
+        i = j = 0
+        while i < before_len and j < after_len:
+            run = before_names[i:i + DIFF_RUN]
+            if run == after_names[j:j + DIFF_RUN]:
+                if before_values[i:i + DIFF_RUN] != after_values[j:j + DIFF_RUN]:
+                    for k, (old, new) in enumerate(zip(before_values[i:i + DIFF_RUN], after_values[j:j + DIFF_RUN])):
+                        if old != new:
+                            changed[after_names[j + k]] = new
+                i += len(run)
+                j += len(run)
+                continue
+
+            stop = min(i + DIFF_RUN, before_len)
+            while i < stop and j < after_len:
+                old, new = before_names[i], after_names[j]
+                if old is new or old == new:
+                    if before_values[i] != after_values[j]:
+                        changed[new] = after_values[j]
+                    i += 1
+                    j += 1
+                elif old < new:
+                    removed[old] = before_values[i]
+                    i += 1
+                else:
+                    added[new] = after_values[j]
+                    j += 1
+
+        removed.update(zip(before_names[i:], before_values[i:]))
+        added.update(zip(after_names[j:], after_values[j:]))
+        return added, changed, removed
+
+
+    def _aligned(self, names: list, default) -> object:
+        """Values of self in the order of names, sorted like self, default where self has none.
+
+        Args:
+            names (list): Sorted names.
+            default: Value of the names self doesn't have.
+
+        Returns:
+            array or list: One value per name.
+        """
+        self.compact()
+        own_names, own_values = self._names, self._values
+        if own_names is names or own_names == names:
+            return own_values
+
+        values = [default] * len(names)
+        i, own_len = 0, len(own_names)
+        for j, name in enumerate(names):
+            while i < own_len and own_names[i] < name:
+                i += 1
+            if i == own_len:
+                break
+            if own_names[i] is name or own_names[i] == name:
+                values[j] = own_values[i]
+                i += 1
+        return values
+
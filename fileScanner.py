@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fileIndex import FileIndex, sorted_columns
+
+def _scan_entries(root_len: int, path: str, skip_suffix: str, rows: list) -> list:
+    """Reads one folder with os.scandir, time and size come from the directory entry.
+
+    Args:
+        root_len (int): Length of working_dir, cut from each path.
+        path (str): Folder to read.
+        skip_suffix (str): Files ending with it are left out.
+        rows (list): [("path/filename", float, int)] filled in place.
+
+    Returns:
+        list: Sub-folders found in path.
+    """
+    folders = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                    continue
+                if entry.is_dir():
+                    # link to a folder, not followed like os.walk(followlinks=False)
+                    continue
+                if skip_suffix and entry.name.endswith(skip_suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # vanished or broken link since the folder was read
+                    continue
+                rows.append((entry.path[root_len:], stat.st_mtime, stat.st_size))
+    except OSError:
+        pass
+
+    return folders
+
+
+def _scan_dir(root_len: int, path: str, skip_suffix: str, rows: list) -> None:
+    """Walks path and all of its sub-folders.
+
+    Args:
+        root_len (int): Length of working_dir, cut from each path.
+        path (str): Folder to walk.
+        skip_suffix (str): Files ending with it are left out.
+        rows (list): [("path/filename", float, int)] filled in place.
+    """
+    stack = [path]
+    while stack:
+        stack.extend(_scan_entries(root_len, stack.pop(), skip_suffix, rows))
+
+
+def scan_tree(working_dir: str, workers: int=4, skip_suffix: str='') -> tuple:
+    """Lists all files under working_dir with their time and size in one pass.
+    Each top-level sub-folder is walked on its own thread.
+
+    Args:
+        working_dir (str): Example: 'c:\\Users\\User123\\backup-folder'
+        workers (int, optional): Threads walking top-level sub-folders. Defaults to 4.
+        skip_suffix (str, optional): Files ending with it are left out. Defaults to ''.
+
+    Returns:
+        tuple: (FileIndex {"path/filename": float}, FileIndex {"path/filename": int}) times and sizes,
+        sharing one sorted list of names. Paths are relative to working_dir like FileTracker.file_list.
+    """
+    # Same names as os.walk + replace(working_dir, ""), with a leading
+    # separator when working_dir has no trailing one
+    root_len = len(working_dir)
+
+    rows = []
+    folders = _scan_entries(root_len, working_dir, skip_suffix, rows)
+
+    if int(workers) <= 1 or len(folders) <= 1:
+        for folder in folders:
+            _scan_dir(root_len, folder, skip_suffix, rows)
+    else:
+        # Each thread fills its own list, joined once all are done
+        parts = [[] for _ in folders]
+        with ThreadPoolExecutor(max_workers=int(workers)) as pool:
+            list(pool.map(lambda job: _scan_dir(root_len, job[0], skip_suffix, job[1]), zip(folders, parts)))
+        for part in parts:
+            rows.extend(part)
+            part.clear()
+
+    names, times, sizes = sorted_columns(rows, ('d', 'q'))
+    return FileIndex.from_sorted(names, times), FileIndex.from_sorted(names, sizes, typecode='q')
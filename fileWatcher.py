@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from fileScanner import scan_tree
+from log import setup_logger
+
+logger=setup_logger(__name__)
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class FileWatcher:
+    """Collects the names of changed files under working_dir.
+    Uses inotify on Linux and falls back to polling with scan_tree elsewhere.
+    """
+    def __init__(self, working_dir: str, debounce_sec: float=2, poll_sec: float=10, skip_suffix: str=''):
+        """Starts watching working_dir.
+
+        Args:
+            working_dir (str): Example: 'c:\\Users\\User123\\backup-folder'
+            debounce_sec (float, optional): Quiet time before a set of changes is handed out. Defaults to 2.
+            poll_sec (float, optional): Seconds between scans when polling. Defaults to 10.
+            skip_suffix (str, optional): Files ending with it are ignored. Defaults to ''.
+        """
+        self.working_dir = working_dir
+        self.debounce_sec = float(debounce_sec)
+        self.poll_sec = float(poll_sec)
+        self.skip_suffix = skip_suffix
+        self.fd = None
+        self.watches = {}
+        self.snapshot = None
+
+        if sys.platform.startswith('linux'):
+            try:
+                self._start_inotify()
+            except OSError as err:
+                logger.error("inotify unavailable, polling instead. Here's why: %s", err)
+                self.fd = None
+
+        if self.fd is None:
+            self.snapshot = scan_tree(self.working_dir, skip_suffix=self.skip_suffix)[0]
+            logger.info(f'Watching: {self.working_dir} by polling every {self.poll_sec}s')
+        else:
+            logger.info(f'Watching: {self.working_dir} with inotify, {len(self.watches)} folders')
+
+
+    def _start_inotify(self) -> None:
+        """Opens an inotify instance and watches every folder under working_dir.
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.fd = fd
+        self._add_tree(self.working_dir)
+
+
+    def _add_watch(self, path: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'{os.strerror(errno)}: {path}')
+        self.watches[wd] = path
+
+
+    def _add_tree(self, path: str) -> set:
+        """Watches path and its sub-folders.
+
+        Args:
+            path (str): Folder to watch.
+
+        Returns:
+            set: Names of the files already in the folders.
+        """
+        found = set()
+        stack = [path]
+        while stack:
+            folder = stack.pop()
+            try:
+                self._add_watch(folder)
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif not entry.is_dir():
+                            found.add(entry.path[len(self.working_dir):])
+            except OSError as err:
+                logger.error("Couldn't watch %s. Here's why: %s", folder, err)
+
+        return found
+
+
+    def _read_events(self, changed: set) -> bool:
+        """Reads all queued inotify events into changed.
+
+        Args:
+            changed (set): Names of changed files, filled in place.
+
+        Returns:
+            bool: True when the events can't be trusted and a full scan is needed.
+        """
+        full = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return full
+
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    logger.error("inotify queue overflow, full scan needed")
+                    full = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+
+                folder = self.watches.get(wd)
+                if folder is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    continue
+
+                path = os.path.join(folder, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & IN_CREATE:
+                        changed.update(self._add_tree(path))
+                    elif mask & (IN_MOVED_FROM | IN_MOVED_TO):
+                        # files inside a moved folder are not reported one by one
+                        full = True
+                        if mask & IN_MOVED_TO:
+                            self._add_tree(path)
+                    continue
+
+                if self.skip_suffix and path.endswith(self.skip_suffix):
+                    continue
+                changed.add(path[len(self.working_dir):])
+
+
+    def _poll(self) -> set:
+        """Rescans working_dir and compares it with the last scan.
+
+        Returns:
+            set: Names of added, removed and changed files.
+        """
+        current = scan_tree(self.working_dir, skip_suffix=self.skip_suffix)[0]
+        before = self.snapshot
+        self.snapshot = current
+        added, changed, removed = before.diff(current)
+        return {*added, *changed, *removed}
+
+
+    def wait(self, timeout: float) -> tuple:
+        """Waits up to timeout seconds for changes, then collects more until
+        nothing has changed for debounce_sec.
+
+        Args:
+            timeout (float): Max seconds to wait for the first change.
+
+        Returns:
+            tuple: (set of changed names, True if a full scan is needed)
+        """
+        changed = set()
+        full = False
+        deadline = time.monotonic() + max(float(timeout), 0)
+
+        if self.fd is None:
+            while not changed and time.monotonic() < deadline:
+                time.sleep(min(self.poll_sec, max(deadline - time.monotonic(), 0)))
+                changed = self._poll()
+            if not changed:
+                return changed, full
+
+            # debounce: poll until one poll finds nothing, at most 10 x debounce_sec
+            give_up = time.monotonic() + self.debounce_sec * 10
+            while time.monotonic() < give_up:
+                time.sleep(min(self.poll_sec, self.debounce_sec, max(give_up - time.monotonic(), 0)))
+                more = self._poll()
+                if not more:
+                    break
+                changed |= more
+            return changed, full
+
+        while not changed and not full:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return changed, full
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready:
+                full = self._read_events(changed)
+
+        # debounce: keep collecting until it goes quiet, at most 10 x debounce_sec
+        quiet_until = time.monotonic() + self.debounce_sec
+        give_up = time.monotonic() + self.debounce_sec * 10
+        while time.monotonic() < min(quiet_until, give_up):
+            ready, _, _ = select.select([self.fd], [], [], max(min(quiet_until, give_up) - time.monotonic(), 0))
+            if ready:
+                full = self._read_events(changed) or full
+                quiet_until = time.monotonic() + self.debounce_sec
+
+        return changed, full
+
+
+    def close(self) -> None:
+        """Stops watching.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.watches = {}
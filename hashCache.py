@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+from log import setup_logger
+from fileIndex import joined
+
+logger=setup_logger(__name__)
+
+# Bytes read at a time while hashing.
+READ_SIZE = 1048576
+
+def file_digest(file_path: str) -> str:
+    """sha256 of a file, read in READ_SIZE blocks.
+
+    Args:
+        file_path (str): Full path of the file.
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as data:
+        for block in iter(lambda: data.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """Content hashes of local files, kept on disk between runs.
+    A file is only read again when its size or time changed.
+    """
+    def __init__(self, working_dir: str, cache_name: str='hash-cache.json', state: object=None):
+        """Loads the cache from state, or from cache_name if it exists.
+
+        Args:
+            working_dir (str): Example: 'c:\\Users\\User123\\backup-folder'
+            cache_name (str, optional): Cache file name. Defaults to 'hash-cache.json'.
+            state (LocalState, optional): Keeps the cache in its database, only changed 
+                entries are written. Defaults to None.
+        """
+        self.working_dir = working_dir
+        self.cache_name = cache_name
+        self.state = state
+        # {"path/filename": [size, filetime, hash]}, a FileIndex of tuples when loaded from state
+        self.entries = {}
+        self.dirty = False
+        # names changed since the last save
+        self.changed = set()
+
+        if self.state is not None:
+            self.entries = self.state.load_hashes()
+        elif os.path.exists(self.cache_name):
+            try:
+                with open(self.cache_name, 'r') as data:
+                    self.entries = json.loads(data.read())
+            except (OSError, ValueError) as err:
+                logger.error("Failed: %s Issue: hash cache unreadable, starting empty" % err)
+
+
+    def file_hash(self, file: str, size: int, file_time: float) -> str:
+        """Hash of a file, read from disk only when size or time differ from the cache.
+
+        Args:
+            file (str): "path/filename"
+            size (int): Current size in bytes.
+            file_time (float): Current os time.
+
+        Returns:
+            str: hex digest, None if the file can't be read.
+        """
+        entry = self.entries.get(file)
+        if entry and entry[0] == size and entry[1] == file_time:
+            return entry[2]
+
+        try:
+            file_hash = file_digest(self.working_dir + file)
+        except OSError as err:
+            logger.error("Failed: %s Issue: couldn't hash %s" % (err, file))
+            return None
+
+        self.entries[file] = [size, file_time, file_hash]
+        self.changed.add(file)
+        self.dirty = True
+        return file_hash
+
+
+    def content_changed(self, file: str, size: int, file_time: float, other_hash: str=None, 
+                        check_previous: bool=True) -> bool:
+        """True when the content differs from the last synced version and from other_hash.
+        The cache holds the last synced hash, so (size, time) equal to it means 
+        unchanged without reading the file.
+
+        Args:
+            file (str): "path/filename"
+            size (int): Current size in bytes.
+            file_time (float): Current os time.
+            other_hash (str, optional): Known copy elsewhere, e.g. the blob. Defaults to None.
+            check_previous (bool, optional): Compare with the cached hash too. Defaults to True.
+
+        Returns:
+            bool: False if the bytes are the same.
+        """
+        entry = self.entries.get(file)
+        previous = entry[2] if check_previous and entry and entry[0] == size else None
+
+        file_hash = self.file_hash(file, size, file_time)
+        if file_hash is None:
+            return True
+        return file_hash != previous and file_hash != other_hash
+
+
+    def forget(self, files) -> None:
+        """Drops cached hashes, used when a file failed to sync.
+
+        Args:
+            files (list): ["path/filename"]
+        """
+        for file in files:
+            if self.entries.pop(file, None) is not None:
+                self.changed.add(file)
+                self.dirty = True
+
+
+    def prune(self, files) -> None:
+        """Drops files that are no longer tracked.
+
+        Args:
+            files (dict): {"path/filename": filetime} of current files.
+        """
+        for file in [file for file, _, current in joined(self.entries, files) if current is None]:
+            del self.entries[file]
+            self.changed.add(file)
+            self.dirty = True
+
+
+    def save(self) -> None:
+        """Writes the changed entries to state, or all of cache_name, when something changed.
+        """
+        if not self.dirty:
+            return
+        if self.state is not None:
+            if self.state.save_hashes({file: self.entries.get(file) for file in self.changed}):
+                self.changed = set()
+                self.dirty = False
+            return
+        try:
+            with open(self.cache_name, 'w') as data:
+                data.write(json.dumps(self.entries))
+            self.dirty = False
+        except OSError as err:
+            logger.error("Failed: %s Issue" % err)
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+from log import setup_logger
+from fileIndex import FileIndex, joined, sorted_columns
+
+logger=setup_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER,
+    hash TEXT,
+    etag TEXT
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cloud_items (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS feed_state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+# Suffix given to the JSON files once their content is in the database.
+MIGRATED_SUFFIX = '.migrated'
+# PRAGMA user_version once the paths are stored as UTF-8 BLOBs.
+BLOB_PATHS_VERSION = 1
+
+
+def to_blob(path: str) -> bytes:
+    """Path as stored, a name that isn't valid UTF-8 (surrogate escaped by os.scandir)
+    keeps its raw bytes.
+
+    Args:
+        path (str): "path/filename"
+
+    Returns:
+        bytes: UTF-8 with surrogateescape.
+    """
+    return path.encode('utf-8', 'surrogateescape')
+
+
+def from_blob(path: bytes) -> str:
+    """Path as loaded, the reverse of to_blob.
+
+    Args:
+        path (bytes): Stored path.
+
+    Returns:
+        str: "path/filename"
+    """
+    return path.decode('utf-8', 'surrogateescape')
+
+
+
+class LocalState:
+    """Local record of synced files, the hash cache and the CosmosDB table cached for the
+    change feed, in one SQLite database (WAL mode).
+    Saves write only the rows that changed since the last load or save, in one transaction,
+    so a crash never leaves a half written record.
+    """
+    def __init__(self, db_name: str='local-state.db', record_name: str='after-before-record.txt',
+                 hash_cache_name: str='hash-cache.json'):
+        """Opens or creates db_name, the JSON record and hash cache are imported on first use.
+
+        Args:
+            db_name (str, optional): SQLite file. Defaults to 'local-state.db'.
+            record_name (str, optional): Old JSON record to migrate. Defaults to 'after-before-record.txt'.
+            hash_cache_name (str, optional): Old JSON hash cache to migrate. Defaults to 'hash-cache.json'.
+        """
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_name, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self._blob_paths()
+        # FileIndex {"path/filename": (mtime, size, hash, etag)} as last loaded or saved
+        self._saved = None
+
+        self._migrate(record_name, 'files', lambda record: [
+            (to_blob(path), float(mtime), None, None, None) for path, mtime in record.items()])
+        self._migrate(hash_cache_name, 'hashes', lambda cache: [
+            (to_blob(path), int(entry[0]), float(entry[1]), entry[2]) for path, entry in cache.items()])
+
+
+    def _blob_paths(self) -> None:
+        """Converts the TEXT paths of older versions to BLOBs once, TEXT and BLOB never match
+        as keys so both can't be mixed in a table.
+        """
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] >= BLOB_PATHS_VERSION:
+            return
+        with self._lock, self.connection:
+            for table in ('files', 'hashes', 'cloud_items'):
+                self.connection.execute(
+                    f"UPDATE {table} SET path = CAST(path AS BLOB) WHERE typeof(path) = 'text'")
+            self.connection.execute(f'PRAGMA user_version = {BLOB_PATHS_VERSION}')
+
+
+    def _migrate(self, file_name: str, table: str, to_rows) -> None:
+        """Imports an old JSON file into an empty table once, then renames the file.
+
+        Args:
+            file_name (str): JSON file.
+            table (str): 'files' or 'hashes'.
+            to_rows (function): Turns the loaded JSON into table rows.
+        """
+        if not os.path.exists(file_name):
+            return
+        if self.connection.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+            return
+
+        try:
+            with open(file_name, 'r') as data:
+                rows = to_rows(json.loads(data.read() or '{}'))
+            if rows:
+                marks = ', '.join('?' * len(rows[0]))
+                with self._lock, self.connection:
+                    self.connection.executemany(f'INSERT OR REPLACE INTO {table} VALUES ({marks})', rows)
+            os.replace(file_name, file_name + MIGRATED_SUFFIX)
+            logger.info(f'Migrated {len(rows)} entries from {file_name} to {self.db_name}')
+
+        except (OSError, ValueError, TypeError, IndexError, sqlite3.Error) as err:
+            logger.error("Failed: %s Issue: couldn't migrate %s" % (err, file_name))
+
+
+    @property
+    def records(self) -> FileIndex:
+        """Loads the record, names and content hashes are interned.
+
+        Returns:
+            FileIndex: {"path/filename": filetime}
+        """
+        intern = sys.intern
+        with self._lock:
+            cursor = self.connection.execute('SELECT path, mtime, size, hash, etag FROM files ORDER BY path')
+            # byte order, sorted again by name (the same unless a name isn't valid UTF-8)
+            rows = [(from_blob(path), mtime, (mtime, size, file_hash and intern(file_hash), etag))
+                    for path, mtime, size, file_hash, etag in cursor]
+        names, mtimes, saved = sorted_columns(rows, ('d', None))
+        self._saved = FileIndex.from_sorted(names, saved, typecode=None)
+        return FileIndex.from_sorted(names, mtimes)
+
+
+    @property
+    def etags(self) -> FileIndex:
+        """Blob etags of the record as last loaded or saved.
+
+        Returns:
+            FileIndex: {"path/filename": etag or None}
+        """
+        if self._saved is None:
+            self.records
+        return FileIndex(((path, row[3]) for path, row in self._saved.items()), typecode=None)
+
+
+    def save_records(self, save: dict, sizes: dict=None, hashes: dict=None, etags: dict=None) -> int:
+        """Writes the rows of save that differ from the database and deletes the ones no longer in it.
+
+        Args:
+            save (dict): {"path/filename": filetime}
+            sizes (dict, optional): {"path/filename": int}. Defaults to None.
+            hashes (dict, optional): {"path/filename": content hash}. Defaults to None.
+            etags (dict, optional): {"path/filename": blob etag}. Defaults to None.
+
+        Returns:
+            int: Rows written or deleted.
+        """
+        if self._saved is None:
+            self.records
+        sizes = sizes or {}
+        hashes = hashes or {}
+        etags = etags or {}
+        saved = self._saved
+
+        rows = {}
+        for path, mtime, size, file_hash, etag, old in joined(save, sizes, hashes, etags, saved):
+            row = (mtime, size, file_hash, etag)
+            if old != row:
+                rows[path] = row
+        removed = [path for path, _, current in joined(saved, save) if current is None]
+        if not rows and not removed:
+            return 0
+
+        try:
+            with self._lock, self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                    [(to_blob(path), *row) for path, row in rows.items()])
+                self.connection.executemany('DELETE FROM files WHERE path = ?', [(to_blob(path),) for path in removed])
+        except (sqlite3.Error, UnicodeError) as err:
+            logger.error("Failed: %s Issue" % err)
+            return 0
+
+        saved.update(rows)
+        for path in removed:
+            del saved[path]
+        return len(rows) + len(removed)
+
+
+    def load_hashes(self) -> FileIndex:
+        """Loads the hash cache, names and hashes are interned.
+
+        Returns:
+            FileIndex: {"path/filename": (size, filetime, hash)}
+        """
+        intern = sys.intern
+        with self._lock:
+            cursor = self.connection.execute('SELECT path, size, mtime, hash FROM hashes ORDER BY path')
+            rows = [(from_blob(path), (size, mtime, intern(file_hash))) for path, size, mtime, file_hash in cursor]
+        return FileIndex.from_sorted(*sorted_columns(rows, (None,)), typecode=None)
+
+
+    def save_hashes(self, changes: dict) -> bool:
+        """Writes changed hash cache entries, None deletes the entry.
+
+        Args:
+            changes (dict): {"path/filename": [size, filetime, hash] or None}
+
+        Returns:
+            bool: True when written.
+        """
+        try:
+            with self._lock, self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)',
+                    [(to_blob(path), *entry) for path, entry in changes.items() if entry is not None])
+                self.connection.executemany(
+                    'DELETE FROM hashes WHERE path = ?',
+                    [(to_blob(path),) for path, entry in changes.items() if entry is None])
+        except (sqlite3.Error, UnicodeError) as err:
+            logger.error("Failed: %s Issue" % err)
+            return False
+        return True
+
+
+    def load_cloud_items(self) -> tuple:
+        """Loads the CosmosDB table cached for the change feed, names are interned.
+
+        Returns:
+            tuple: (FileIndex {"path/filename": fileTime}, continuation token or None)
+        """
+        with self._lock:
+            cursor = self.connection.execute('SELECT path, mtime FROM cloud_items ORDER BY path')
+            rows = [(from_blob(path), mtime) for path, mtime in cursor]
+            token = self.connection.execute("SELECT value FROM feed_state WHERE name = 'continuation'").fetchone()
+        return FileIndex.from_sorted(*sorted_columns(rows)), token and token[0]
+
+
+    def save_cloud_items(self, changes: dict, token: str, replace: bool=False) -> bool:
+        """Writes the items of one change feed read and its continuation token in one transaction.
+
+        Args:
+            changes (dict): {"path/filename": fileTime or None}, None deletes the item.
+            token (str): Continuation token to read the next changes from.
+            replace (bool, optional): changes is the whole table, from a full scan. Defaults to False.
+
+        Returns:
+            bool: True when written.
+        """
+        try:
+            with self._lock, self.connection:
+                if replace:
+                    self.connection.execute('DELETE FROM cloud_items')
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO cloud_items VALUES (?, ?)',
+                    [(to_blob(path), mtime) for path, mtime in changes.items() if mtime is not None])
+                self.connection.executemany(
+                    'DELETE FROM cloud_items WHERE path = ?',
+                    [(to_blob(path),) for path, mtime in changes.items() if mtime is None])
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO feed_state VALUES ('continuation', ?)", (token,))
+        except (sqlite3.Error, UnicodeError) as err:
+            logger.error("Failed: %s Issue" % err)
+            return False
+        return True
+
+
+    def close(self) -> None:
+        """Closes the database.
+        """
+        with self._lock:
+            self.connection.close()
@@ -1,45 +1,179 @@
 from config import config
+import sys
 import json
+import time
+import queue
+import threading
 import logging
 from logging.handlers import RotatingFileHandler
 import requests
+from requests.adapters import HTTPAdapter
 import urllib3
 
 urllib3.disable_warnings() # using default cert.
-params = config(section='splunk_log_config') # loads splunk log settings
+try:
+    params = config(section='splunk_log_config') # loads splunk log settings
+except Exception:
+    params = None # no splunk_log_config section, events go to std out and the log file only
 
 class CustomHttpHandler(logging.Handler):
     
-    def __init__(self, url:str, headers:dict, index:str) -> None:
+    def __init__(self, url:str, headers:dict, index:str, batch_size:str='100', flush_sec:str='2', 
+                 max_queue:str='10000', retries:str='3') -> None:
         """Custom Handler for Splunk HEC *ONLY*
+        Events are queued and sent from a background thread in batched HEC payloads 
+        over one pooled session, so logging never waits on Splunk. When the queue is 
+        full new events are dropped and counted, they are still in the log file.
 
         Args:
             url (str): HTTP URL of Splunk Server
             headers (dict): Example: {"Authorization": "Splunk aaabbbcc-11111-22222-1x1x1-ab2ab2ab2"}
             index (str): Actual Splunk index name (in Splunk Portal under indexes)
+            batch_size (str, optional): Events per HEC request. Defaults to '100'.
+            flush_sec (str, optional): Max seconds an event waits to be sent. Defaults to '2'.
+            max_queue (str, optional): Events held while Splunk is slow or down. Defaults to '10000'.
+            retries (str, optional): Tries per batch before it is dropped. Defaults to '3'.
         """
         self.url = url
         self.headers = json.loads(headers)
         self.index = index
+        self.batch_size = max(1, int(batch_size))
+        self.flush_sec = float(flush_sec)
+        self.retries = max(1, int(retries))
+        self.queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.dropped = 0
+        self.sent = 0
         super().__init__()
+        
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        
+        self._closed = False
+        self._failing = False
+        self._worker = threading.Thread(target=self._run, name='splunk-hec', daemon=True)
+        self._worker.start()
     
     
     def emit(self, record:str) -> None:
         """This function gets called when a log event gets emitted. It receives a
-        record, formats it and sends it to the url
+        record, formats it and queues it for the background thread.
 
         Args:
             record (str): a log record (created by logging module)
         """
-        log_entry = self.format(record)
-        response = requests.post(
-            url=self.url, headers=self.headers, 
-            json={"index": self.index, "event": log_entry}, 
-            verify=False)
-        print(response.status_code)
+        try:
+            event = json.dumps({"time": record.created, "index": self.index, "event": self.format(record)})
+        except Exception:
+            self.handleError(record)
+            return
+        
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+    
+    
+    def _run(self) -> None:
+        """Background thread: collects events into batches of batch_size,
+        a batch is sent early when its oldest event waited flush_sec.
+        """
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                event = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                event = ''
+            
+            if event is None:
+                self._send(batch)
+                self.queue.task_done()
+                return
+            if event:
+                batch.append(event)
+                self.queue.task_done()
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_sec
+            
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._send(batch)
+                batch = []
+                deadline = None
+    
+    
+    def _send(self, batch:list) -> None:
+        """Posts one HEC payload, retried with a growing pause. 
+        A batch that still fails is dropped and counted.
+
+        Args:
+            batch (list): JSON encoded events.
+        """
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            batch = batch + [json.dumps({"time": time.time(), "index": self.index, 
+                                         "event": f"Splunk handler dropped {dropped} events, queue was full"})]
+        if not batch:
+            return
+        
+        payload = "\n".join(batch)
+        for attempt in range(self.retries):
+            try:
+                response = self.session.post(url=self.url, data=payload, timeout=(5, 30))
+                if response.status_code < 300:
+                    self.sent += len(batch)
+                    self._failing = False
+                    return
+                status = response.status_code
+                if status < 500 and status != 429:
+                    break
+            except requests.RequestException as err:
+                status = err
+            if attempt + 1 < self.retries:
+                time.sleep(min(2 ** attempt, 10))
+        
+        self.dropped += len(batch)
+        if not self._failing:
+            # once per outage, not per batch
+            self._failing = True
+            print(f'Splunk HEC unreachable, dropping events until it is back: {status}', file=sys.stderr)
+    
+    
+    def close(self) -> None:
+        """Sends what is queued, stops the thread and closes the session. 
+        Called by logging.shutdown at exit.
+        """
+        if not self._closed:
+            self._closed = True
+            try:
+                self.queue.put(None, timeout=self.flush_sec)
+            except queue.Full:
+                pass
+            self._worker.join(timeout=self.flush_sec + 30)
+            self.session.close()
+        super().close()
+
+
+# One Splunk handler and thread shared by every logger
+_splunk_handler = None
+
+def splunk_handler() -> CustomHttpHandler:
+    """Shared CustomHttpHandler, created on first use.
+
+    Returns:
+        CustomHttpHandler: handler for params, None when Splunk is not configured.
+    """
+    global _splunk_handler
+    if _splunk_handler is None and params is not None:
+        _splunk_handler = CustomHttpHandler(**params)
+    return _splunk_handler
+
 
 def setup_logger(logger_name:str=__name__, logfile:str='log.log') -> object:
-    """Creates Logging Object: std out, log file w/1mb max, and Events sent to Splunk.
+    """Creates Logging Object: std out, log file w/1mb max, and Events sent to Splunk when configured.
 
     Args:
         logger_name (str, optional): Logger Name.. Defaults to __name__. 
@@ -68,15 +202,16 @@ def setup_logger(logger_name:str=__name__, logfile:str='log.log') -> object:
         '%(asctime)s | %(name)s | %(levelname)s | %(message)s', 
         '%m-%d-%Y %H:%M:%S')    
     
-    splunk_handler = CustomHttpHandler(**params)
+    splunk = splunk_handler()
     
     fh.setFormatter(formatter)
     ch.setFormatter(formatter)
-    splunk_handler.setFormatter(formatter)
 
     logger.addHandler(fh)
     logger.addHandler(ch)
-    logger.addHandler(splunk_handler)
+    if splunk is not None:
+        splunk.setFormatter(formatter)
+        logger.addHandler(splunk)
     
     return logger
 
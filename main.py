@@ -1,8 +1,18 @@
-import os, time, json
+import os, time
 from config import config
 from log import setup_logger
-from azStorage import AZBlobStorage
+from metrics import metrics
+from azStorage import AZBlobStorage, PARTIAL_SUFFIX, local_path
+from azDedupStorage import AZDedupStorage
+from azClients import AzClientPool
+from fileScanner import scan_tree
+from fileWatcher import FileWatcher
+from hashCache import HashCache
+from localState import LocalState
+from syncPlan import SyncPlan, diff_states
+from fileIndex import FileIndex, joined
 from azCosmosContainer import AzCosmosContainer
+from blobState import BlobStateRecord
 
 logger=setup_logger(__name__)
 
@@ -12,7 +22,16 @@ class FileTracker:
     """
     def __init__(self, 
                  working_dir: str, t_sec: str, conn_str: str, sto_container: str, 
-                 db_name: str, uri: str, key: str, db_container: str
+                 db_name: str, uri: str, key: str, db_container: str,
+                 workers: str = '8', pool_size: str = '16', conn_timeout: str = '20', 
+                 read_timeout: str = '60', change_feed: str = 'false', db_page_size: str = '1000', 
+                 scan_workers: str = '4', watch: str = 'false', debounce_sec: str = '2', 
+                 reconcile_sec: str = '3600', hash_check: str = 'true', 
+                 delta_min_mb: str = '0', block_size_mb: str = '4', compression: str = '', 
+                 storage_backend: str = 'blob', dedup_chunk_kb: str = '1024', 
+                 state_db: str = 'local-state.db', metrics_file: str = '', metrics_port: str = '0', 
+                 state_backend: str = 'cosmos', container_manifest: str = 'false', list_workers: str = '1', 
+                 large_file_mb: str = '0', block_workers: str = '4', clients: AzClientPool = None
                  ):
         """Constructs all the necessary attributes: FileTracker object.
 
@@ -25,26 +44,87 @@ class FileTracker:
             uri (str): URI for CosmosDB connection
             key (str): Unique Key as Per Azure Acct.
             db_container (str): CosmosDB Actual Name
+            workers (str, optional): Max concurrent transfers. Defaults to '8'.
+            pool_size (str, optional): Max keep-alive HTTP connections. Defaults to '16'.
+            conn_timeout (str, optional): Connect timeout in seconds. Defaults to '20'.
+            read_timeout (str, optional): Read timeout in seconds. Defaults to '60'.
+            change_feed (str, optional): 'true' reads only DB changes each run. Defaults to 'false'.
+            db_page_size (str, optional): Items per page when scanning the DB. Defaults to '1000'.
+            scan_workers (str, optional): Threads walking top-level sub-folders. Defaults to '4'.
+            watch (str, optional): 'true' syncs only the files the OS reports as changed. Defaults to 'false'.
+            debounce_sec (str, optional): Quiet time before changes are synced in watch mode. Defaults to '2'.
+            reconcile_sec (str, optional): Seconds between full syncs in watch mode. Defaults to '3600'.
+            hash_check (str, optional): 'true' skips transfers of files whose content did not change. Defaults to 'true'.
+            delta_min_mb (str, optional): Files this big or bigger (MB) only send changed blocks, '0' is off. Defaults to '0'.
+            block_size_mb (str, optional): Block size (MB) for delta and large file uploads. Defaults to '4'.
+            compression (str, optional): 'zstd' or 'gzip' compresses uploads, '' is off. Defaults to ''.
+            storage_backend (str, optional): 'dedup' stores each unique chunk of content once. Defaults to 'blob'.
+            dedup_chunk_kb (str, optional): Average chunk size (KB) of the dedup backend. Defaults to '1024'.
+            state_db (str, optional): SQLite file holding the local record and hash cache. Defaults to 'local-state.db'.
+            metrics_file (str, optional): File rewritten with the metrics after every sync, '' is off. Defaults to ''.
+            metrics_port (str, optional): Serves the metrics on 127.0.0.1:port/metrics, '0' is off. Defaults to '0'.
+            state_backend (str, optional): 'blob' keeps the cloud state in blob metadata and the local record, without CosmosDB. Defaults to 'cosmos'.
+            container_manifest (str, optional): 'true' reads the listing from a manifest blob fetched with If-None-Match. Defaults to 'false'.
+            list_workers (str, optional): Top-level prefixes of the container listed at the same time, '1' lists it as one. Defaults to '1'.
+            large_file_mb (str, optional): Files this big or bigger (MB) are staged as blocks in parallel, '0' is off. Defaults to '0'.
+            block_workers (str, optional): Blocks of one large file staged at the same time. Defaults to '4'.
+            clients (AzClientPool, optional): Shared clients, built from the settings above when not given. Defaults to None.
         """
         self.working_dir = working_dir
         self.t_sec = int(t_sec) 
         self.record_name = 'after-before-record.txt'
+        self.scan_workers = int(scan_workers)
+        self.watch = watch.lower() == 'true'
+        self.debounce_sec = float(debounce_sec)
+        self.reconcile_sec = float(reconcile_sec)
+        self.hash_check = hash_check.lower() == 'true'
+        metrics.enable(metrics_file=metrics_file, port=int(metrics_port))
+        # Local record and hash cache, the JSON files of older versions are migrated once
+        self.state = LocalState(db_name=state_db, record_name=self.record_name)
+        self.hash_cache = HashCache(self.working_dir, state=self.state)
+        # {"path/filename": int} from the last scan
+        self.file_sizes = {}
+        
+        # Shared Azure clients, kept for the life of the process
+        self.clients = clients or AzClientPool(
+            conn_str=conn_str, uri=uri, key=key, pool_size=pool_size, 
+            conn_timeout=conn_timeout, read_timeout=read_timeout)
         
         # Blob Storage
         self.sto_container = sto_container
         self.conn_str = conn_str
-        self.storage_resource = AZBlobStorage(
-            working_dir=self.working_dir,conn_str=self.conn_str, 
-            container=self.sto_container)
+        self.workers = int(workers)
+        if storage_backend.lower() == 'dedup':
+            if container_manifest.lower() == 'true':
+                logger.error("container_manifest is not used with storage_backend=dedup, the container is listed")
+            self.storage_resource = AZDedupStorage(
+                working_dir=self.working_dir,conn_str=self.conn_str, 
+                container=self.sto_container, workers=self.workers, clients=self.clients, 
+                chunk_kb=int(dedup_chunk_kb), compression=compression.lower(), list_workers=int(list_workers))
+        else:
+            self.storage_resource = AZBlobStorage(
+                working_dir=self.working_dir,conn_str=self.conn_str, 
+                container=self.sto_container, workers=self.workers, clients=self.clients, 
+                delta_min_size=int(float(delta_min_mb) * 1048576), block_size=int(float(block_size_mb) * 1048576), 
+                compression=compression.lower(), container_manifest=container_manifest.lower() == 'true', 
+                list_workers=int(list_workers), large_file_size=int(float(large_file_mb) * 1048576), 
+                block_workers=int(block_workers))
         
         # File Track DB
         self.db_name = db_name
         self.uri = uri
         self.key = key
         self.db_container = db_container
-        self.db_resource = AzCosmosContainer(
-            uri=self.uri, key=self.key, 
-            database_name=self.db_name, container_name=self.db_container)
+        self.blob_state = state_backend.lower() == 'blob'
+        if self.blob_state:
+            self.db_resource = BlobStateRecord(
+                state=self.state, storage=self.storage_resource, container_name=self.sto_container)
+        else:
+            self.db_resource = AzCosmosContainer(
+                uri=self.uri, key=self.key, 
+                database_name=self.db_name, container_name=self.db_container, clients=self.clients, 
+                workers=self.workers, change_feed=change_feed.lower() == 'true', page_size=db_page_size, 
+                state=self.state)
         self.db_load = self.db_resource.create_load_db
         self.db_container = self.db_resource.create_load_container
         
@@ -52,26 +132,27 @@ class FileTracker:
     @property   
     def file_list(self) -> list:
         """Creates a list of all files.
-            Lists: Pwd and Sub-folder files, including hidden.           
+            Lists: Pwd and Sub-folder files, including hidden. 
+            Skips downloads still in progress (PARTIAL_SUFFIX).
  
         Returns:
             list: A list of path/file_name for working_dir
         """
-        return [os.path.join(dirpath, file).replace(self.working_dir, "") for (
-            dirpath, dirnames, filenames) in os.walk(self.working_dir) for file in filenames]
+        return list(self.file_time_list)
         
         
     @property
-    def file_time_list(self) -> dict:
-        """Creates a Dictionary of filenames as key and os time for values
+    def file_time_list(self) -> FileIndex:
+        """Creates a Dictionary of filenames as key and os time for values.
+        One os.scandir pass, sizes are kept in self.file_sizes.
 
         Returns:
-            dict: {"path/filename": float}
+            FileIndex: {"path/filename": float}
         """
-        file_list = self.file_list
-        time_list = [os.path.getmtime(self.working_dir+file) for file in file_list]
+        times, self.file_sizes = scan_tree(
+            self.working_dir, workers=self.scan_workers, skip_suffix=PARTIAL_SUFFIX)
         
-        return dict(zip(file_list, time_list))
+        return times
     
     
     def file_select_times(self, file_list: list, after_local: dict) ->dict:
@@ -92,35 +173,28 @@ class FileTracker:
     
     
     @property
-    def before_save_local(self) -> dict:
-        """Loads file name self.record_name
+    def before_save_local(self) -> FileIndex:
+        """Loads the local record from self.state
 
         Returns:
-            dict: {"filename": filetime}
+            FileIndex: {"filename": filetime}
         """
-        try: 
-            with open(self.record_name, 'r') as data:
-                out = json.loads(data.read())
-
-        except Exception as err:
-            logger.error("Failed: %s Issue:" % err)
-
-        return out
+        return self.state.records
     
     
     def after_save_local(self, save:dict) ->None:
-        """Saves self.record_name
+        """Saves the local record to self.state, only changed rows are written.
+        Size, content hash and blob etag are kept next to each file time, 
+        with state_backend=blob only the etag of the last synced blob.
 
         Args:
             save (dict): {"filename": filetime}
         """
-        record = json.dumps(save)
-        try:
-            with open(self.record_name, 'w') as data:
-                data.write(record)
-
-        except Exception as err:
-            logger.error("Failed: %s Issue" % err)
+        hashes = {key: entry[2] for key, mtime, entry in joined(save, self.hash_cache.entries) 
+                  if entry is not None and entry[1] == mtime}
+        etags = self.db_resource.etags if self.blob_state else self.storage_resource.cloud_etags
+        written = self.state.save_records(save, sizes=self.file_sizes, hashes=hashes, etags=etags)
+        logger.info(f'Local record saved: {written} rows changed')
     
     
     def delete_files(self, file_list:dict) ->None: 
@@ -132,7 +206,7 @@ class FileTracker:
         for file in file_list:
 
             # Format path
-            file_path = os.path.join(self.working_dir, file)
+            file_path = local_path(self.working_dir, file)
             # If file exists, delete it.
             if os.path.isfile(path=file_path):
                 os.remove(path=file_path)
@@ -149,118 +223,332 @@ class FileTracker:
                 logger.info("Success: %s folder removed" % folder_path)
                 
     
-    @property
-    def backup_svc(self) ->None:
-        """Compares the state of the files from the last time the script was run, 
-        and compares it with the current state of the files to detect changes, 
-        ensuring that the files in the cloud storage 
-        and the files in the local storage are always in sync.
+    def file_size(self, file:str) ->int:
+        """Size from the last scan, read from disk when the file was not scanned.
+
+        Args:
+            file (str): "path/filename"
+
+        Returns:
+            int: size in bytes
+        """
+        if file not in self.file_sizes:
+            self.file_sizes[file] = os.path.getsize(self.working_dir + file)
+        return self.file_sizes[file]
+    
+    
+    def drop_same_content(self, file_list:dict, check_previous:bool=True) ->dict:
+        """Leaves out files whose bytes match the last synced version or the blob, 
+        using (size, time) first and the content hash only when those differ.
+
+        Args:
+            file_list (dict): {"filename": filetime}
+            check_previous (bool, optional): Compare with the last synced hash too. Defaults to True.
+
+        Returns:
+            dict: {"filename": filetime} of files with new content.
+        """
+        changed = {key: value for key, value in file_list.items() if self.hash_cache.content_changed(
+            key, self.file_size(key), value, self.storage_resource.cloud_hashes.get(key), check_previous)}
+        
+        if len(changed) < len(file_list):
+            logger.info(f"Same content, not uploaded: {[key for key in file_list if key not in changed]}")
+        return changed
+    
+    
+    def same_as_local(self, file_list:dict, after_local:dict) ->set:
+        """Cloud files uploaded from the local copy as it is now (same time and size in blob metadata) 
+        or, with hash_check, whose blob hash matches the local copy, nothing to download.
+
+        Args:
+            file_list (dict): {"filename": filetime} of cloud files.
+            after_local (dict): Local record.
+
+        Returns:
+            set: {"filename"}
+        """
+        cloud_stats = self.storage_resource.cloud_stats
+        cloud_hashes = self.storage_resource.cloud_hashes
+        same = set()
+        for key in file_list:
+            if key not in after_local:
+                continue
+            if cloud_stats.get(key) == (after_local[key], self.file_size(key)):
+                same.add(key)
+            elif self.hash_check and key in cloud_hashes and \
+                    self.hash_cache.file_hash(key, self.file_size(key), after_local[key]) == cloud_hashes[key]:
+                same.add(key)
+        return same
+    
+    
+    def upload_local(self, file_list:dict, after_local:dict) ->None:
+        """Uploads local files and updates the DB. 
+        Failed uploads are left out of after_local so the next run retries them.
+
+        Args:
+            file_list (dict): {"filename": filetime}
+            after_local (dict): Local record, updated in place.
+        """
+        hashes = None
+        if self.hash_check:
+            hashes = {key: self.hash_cache.file_hash(key, self.file_size(key), value) for key, value in file_list.items()}
+        
+        with metrics.phase('upload'):
+            self.storage_resource.put_list(file_list.keys(), hashes=hashes)
+        [after_local.pop(key, None) for key in self.storage_resource.failed]
+        self.hash_cache.forget(self.storage_resource.failed)
+        # Function to update DB with current values
+        db_cloud = self.storage_resource.blob_file_select_time_list(file_list.keys())
+        with metrics.phase('db_update'):
+            self.db_resource.add_update_dictionary(db_cloud, hashes=hashes)
+    
+    
+    def remove_cloud(self, file_list:dict, after_local:dict) ->None:
+        """Deletes blobs and DB items of files removed locally. 
+        Blobs that failed to delete stay in after_local so the next run retries them.
+
+        Args:
+            file_list (dict): {"filename": filetime}
+            after_local (dict): Local record, updated in place.
+        """
+        with metrics.phase('blob_delete'):
+            self.storage_resource.delete_list(file_list.keys())
+        failed = self.storage_resource.failed
+        after_local.update({key: file_list[key] for key in failed})
+        # Function to Remove Entry from DB
+        with metrics.phase('db_update'):
+            self.db_resource.delete_item_list([key for key in file_list if key not in failed])
+    
+    
+    @metrics.timed('sync_paths')
+    def sync_paths(self, file_list) ->None:
+        """Syncs only the given local files, used by watch mode. 
+        Each name is compared with the local record and uploaded or removed from the cloud.
+
+        Args:
+            file_list (list): ["path/filename"] reported as changed.
         """
         before_local = self.before_save_local
-        after_local = self.file_time_list
-  
-        logger.info("Scanning DB for Cloud Changes")
-        before_cloud = self.db_resource.scan_all_items
-        after_cloud = self.storage_resource.blob_file_time_list 
+        after_local = before_local.copy()
+        added, removed, changed = {}, {}, {}
         
-        print('-----------------------------------------------------------------------------------')
-        logger.info(f"Local Directory file count before: {len(before_local)}")
-      
-        file_time_added_cloud = {key: value for key, value in after_cloud.items() if key not in before_cloud}
-        file_time_removed_cloud = {key: value for key, value in before_cloud.items() if key not in after_cloud}
-        file_time_changed_cloud = {key: value for key,value in after_cloud.items() if key in dict(
-            set(before_cloud.items()) - set(after_cloud.items()))} 
+        for file in file_list:
+            try:
+                stat = os.stat(self.working_dir + file)
+            except OSError:
+                if file in before_local:
+                    removed[file] = after_local.pop(file)
+                continue
+            
+            file_time = stat.st_mtime
+            self.file_sizes[file] = stat.st_size
+            
+            if file not in before_local:
+                added[file] = file_time
+            elif before_local[file] != file_time:
+                changed[file] = file_time
+            after_local[file] = file_time
         
-        file_time_added_local = {key: value for key, value in after_local.items() if key not in before_local}   
-        file_time_removed_local = {key: value for key, value in before_local.items() if key not in after_local}   
-        file_time_changed = {key: value for key,value in after_local.items() if key in dict(
-                    set(before_local.items()) - set(after_local.items()))} 
-        file_time_changed_local = {key: value for key,value in file_time_changed.items() if key not in file_time_changed_cloud}
+        if self.hash_check:
+            added = self.drop_same_content(added, check_previous=False)
+            changed = self.drop_same_content(changed)
         
-        ###################################################
-        # before_cloud vs after_cloud if Added
-        if file_time_added_cloud:
-        # Action: download from remote storage. For: Added
-            logger.info(f"|1| Cloud Added: Downloading: {file_time_added_cloud.keys()}")
-            # Function to download files from Cloud
-            self.storage_resource.get_list(file_time_added_cloud.keys())
-            # updates local record
-            self.file_select_times(file_list=file_time_added_cloud.keys(), after_local=after_local)
+        if added:
+            logger.info(f"|4| Local Added, Upload to Cloud: {added.keys()}")
+            self.upload_local(added, after_local)
+        if removed:
+            logger.info(f"|5| Local Removed.. Delete Cloud: {removed.keys()}")
+            self.remove_cloud(removed, after_local)
+        if changed:
+            logger.info(f"|6| Local Changed.. Update to Cloud: {changed.keys()}")
+            self.upload_local(changed, after_local)
+        
+        self.storage_resource.save_manifest()
+        if after_local != before_local:
+            self.after_save_local(after_local)
+        self.hash_cache.save()
+    
+    
+    @property
+    def backup_svc(self) ->None:
+        """Runs sync_all then waits self.t_sec seconds.
+        """
+        self.sync_all()
+        metrics.flush()
+        logger.info(f'All Done waiting:{self.t_sec} seconds.')
+        time.sleep(self.t_sec)
+    
+    
+    @property
+    def watch_svc(self) ->None:
+        """Watches working_dir (inotify on Linux, polling elsewhere) and syncs only 
+        the changed files after a quiet period of self.debounce_sec. 
+        sync_all runs at start, every self.reconcile_sec, and when the watcher lost events.
+        """
+        watcher = FileWatcher(self.working_dir, debounce_sec=self.debounce_sec, 
+                              poll_sec=self.t_sec, skip_suffix=PARTIAL_SUFFIX)
+        next_full = 0
+        try:
+            while True:
+                if time.monotonic() >= next_full:
+                    self.sync_all()
+                    metrics.flush()
+                    next_full = time.monotonic() + self.reconcile_sec
+                
+                changed, full = watcher.wait(timeout=next_full - time.monotonic())
+                if full:
+                    next_full = 0
+                elif changed:
+                    logger.info(f'Watch: {len(changed)} changed paths')
+                    self.sync_paths(changed)
+                    metrics.flush()
+        finally:
+            watcher.close()
+    
+    
+    @metrics.timed('diff')
+    def plan_sync(self, before_local:dict, after_local:dict, before_cloud:dict, after_cloud:dict) ->SyncPlan:
+        """Builds the SyncPlan of this run with diff_states. 
+        With hash_check, files whose bytes did not change are left out of the uploads. 
+        Cloud files whose bytes are already local move from download to keep_local.
+
+        Args:
+            before_local (dict): Local record of the last run.
+            after_local (dict): Current local files.
+            before_cloud (dict): DB items.
+            after_cloud (dict): Blob listing.
+
+        Returns:
+            SyncPlan: Actions for run_plan.
+        """
+        plan = diff_states(before_local, after_local, before_cloud, after_cloud)
+        
+        if self.hash_check:
+            # A new time with the same bytes only updates the record
+            plan.upload_new = self.drop_same_content(plan.upload_new, check_previous=False)
+            plan.upload_changed = self.drop_same_content(plan.upload_changed)
+        # Cloud files already present locally with the same bytes are not downloaded
+        for key in self.same_as_local(plan.download, after_local):
+            plan.keep_local[key] = plan.download.pop(key)
+        
+        for key, resolution in plan.conflicts.items():
+            logger.warning(f'Conflict: {key}: {resolution}')
+        for action, files in plan.counts.items():
+            metrics.count('plan_files_total', files, action=action)
+        return plan
+    
+    
+    def run_plan(self, plan:SyncPlan, after_local:dict) ->None:
+        """Carries out a SyncPlan: downloads, local deletes, uploads, then cloud deletes, 
+        each followed by its DB update. Files that fail are left for the next run.
+
+        Args:
+            plan (SyncPlan): From plan_sync.
+            after_local (dict): Local record, updated in place.
+        """
+        pulled = {**plan.download, **plan.keep_local}
+        if pulled:
+        # Action: download from remote storage. For: Added or Changed
+            logger.info(f"|1|3| Cloud Added or Changed: Downloading: {plan.download.keys()}")
+            with metrics.phase('download'):
+                self.storage_resource.get_list(plan.download.keys())
+            # updates local record, failed downloads are retried next run
+            [pulled.pop(key) for key in self.storage_resource.failed]
+            self.file_select_times(file_list=pulled.keys(), after_local=after_local)
             # Function to update DB
-            db_cloud_add = self.storage_resource.blob_file_select_time_list(file_time_added_cloud.keys())
-            self.db_resource.add_update_dictionary(db_cloud_add)
+            db_cloud = self.storage_resource.blob_file_select_time_list(pulled.keys())
+            with metrics.phase('db_update'):
+                self.db_resource.add_update_dictionary(db_cloud, hashes=self.storage_resource.cloud_hashes)
         ####################################################
-        # Check to see what was removed by another client in cloud.
-        if file_time_removed_cloud: 
+        if plan.delete_local:
         # Action: remove file from: client
-            logger.info(f"|2| Cloud Removed: Deleting locally: {file_time_removed_cloud.keys()}")
-            # Function to Remove files from Folder in client
-            self.delete_files(file_time_removed_cloud.keys())
-            [after_local.pop(key) for key in file_time_removed_cloud.keys()]
-            # Function to update DB
-            self.db_resource.delete_item_list(file_time_removed_cloud.keys()) 
+            logger.info(f"|2| Cloud Removed: Deleting locally: {plan.delete_local.keys()}")
+            with metrics.phase('local_delete'):
+                self.delete_files(plan.delete_local.keys())
+            [after_local.pop(key, None) for key in plan.delete_local]
+            with metrics.phase('db_update'):
+                self.db_resource.delete_item_list(plan.delete_local.keys())
         ####################################################
-        # What existing files have changed in Cloud since last scan
-        if file_time_changed_cloud:
-        # Action: Download from Storage 
-            logger.info(f"|3| Cloud Changed: {file_time_changed_cloud.keys()}")
-            # Function to add files from Storage
-            self.storage_resource.get_list(file_time_changed_cloud.keys())
-            # updates local record
-            self.file_select_times(file_list=file_time_changed_cloud.keys(), after_local=after_local)
-            # Function to update DB
-            db_cloud_changed = self.storage_resource.blob_file_select_time_list(file_time_changed_cloud.keys())
-            self.db_resource.add_update_dictionary(db_cloud_changed)
-        ####################################################
-        # files added to local 
-        if file_time_added_local:
+        pushed = {**plan.upload_new, **plan.upload_changed}
+        if pushed:
         # Action: upload to cloud and update db
-            logger.info(f"|4| Local Added, Upload to Cloud: {file_time_added_local.keys()}")
-            # Function to Upload files to Storage
-            self.storage_resource.put_list(file_time_added_local.keys())
-            # Function to update DB with current values
-            db_cloud_add = self.storage_resource.blob_file_select_time_list(file_time_added_local.keys())
-            self.db_resource.add_update_dictionary(db_cloud_add) 
+            logger.info(f"|4|6| Local Added or Changed, Upload to Cloud: {pushed.keys()}")
+            self.upload_local(pushed, after_local)
         ####################################################
-        # file removed from local
-        if file_time_removed_local:
+        if plan.delete_cloud:
         # Action: Remove both object(s) from storage and Entry(s) from DB.
-            logger.info(f"|5| Local Removed.. Delete Cloud: {file_time_removed_local.keys()}")
-            # Function to Remove file for Remote Storage
-            self.storage_resource.delete_list(file_time_removed_local.keys())
-            # Function to Remove Entry from DB
-            self.db_resource.delete_item_list(file_time_removed_local.keys())
+            logger.info(f"|5| Local Removed.. Delete Cloud: {plan.delete_cloud.keys()}")
+            self.remove_cloud(plan.delete_cloud, after_local)
         ####################################################
-        # Existing file have changed in local.
-        if  file_time_changed_local:
-        # Action update files to storage if files were not changed in storage.
-            logger.info(f"|6| Local Changed.. Update to Cloud: {file_time_changed_local.keys()}")
-            # Func to update to Storage
-            self.storage_resource.put_list(file_time_changed_local.keys())
-            # func to update DB
-            db_cloud_changed = self.storage_resource.blob_file_select_time_list(file_time_changed_local.keys())
-            self.db_resource.add_update_dictionary(db_cloud_changed)
+        if plan.forget:
+        # Action: blob and local file are gone already, drop the DB items
+            logger.info(f"Removed on both sides, DB items dropped: {plan.forget.keys()}")
+            with metrics.phase('db_update'):
+                self.db_resource.delete_item_list(plan.forget.keys())
         ####################################################
-        else:
+        if plan.empty:
             print('-----------------------------------------------------------------------------------')
             logger.info("No Local or Cloud File Changes Detected..")
             print('-----------------------------------------------------------------------------------')
+    
+    
+    @metrics.timed('sync_all')
+    def sync_all(self) ->None:
+        """Compares the state of the files from the last time the script was run, 
+        and compares it with the current state of the files to detect changes, 
+        ensuring that the files in the cloud storage 
+        and the files in the local storage are always in sync.
+        """
+        with metrics.phase('state_load'):
+            before_local = self.before_save_local
+        with metrics.phase('local_scan'):
+            after_local = self.file_time_list
+  
+        # One listing per run, later lookups and updates use this snapshot
+        with metrics.phase('blob_list'):
+            after_cloud = self.storage_resource.blob_file_time_list 
+        logger.info("Scanning DB for Cloud Changes")
+        with metrics.phase('db_scan'):
+            # with state_backend=blob the DB state is rebuilt from the listing
+            if self.db_resource.change_feed:
+                before_cloud = self.db_resource.scan_changes
+            else:
+                before_cloud = self.db_resource.scan_all_items
+        
+        print('-----------------------------------------------------------------------------------')
+        logger.info(f"Local Directory file count before: {len(before_local)}")
+        
+        plan = self.plan_sync(before_local, after_local, before_cloud, after_cloud)
+        logger.info(f"Sync plan: {plan.counts}")
+        self.run_plan(plan, after_local)
+        with metrics.phase('manifest_save'):
+            self.storage_resource.save_manifest()
                
-        self.after_save_local(after_local) # Saves Changes to after_local
+        with metrics.phase('state_save'):
+            self.after_save_local(after_local) # Saves Changes to after_local
+            self.hash_cache.prune(after_local)
+            self.hash_cache.save()
+        metrics.gauge('local_files', len(after_local))
               
         logger.info(f'Local Directory file count after: {len(after_local)}')
+        logger.info(f'Azure client reuse: {self.clients.stats}')
+        logger.info(f'Transfer bytes local/wire and codec CPU: {self.storage_resource.pop_transfer_stats()}')
         print('-----------------------------------------------------------------------------------')
-        logger.info(f'All Done waiting:{self.t_sec} seconds.')
-        time.sleep(self.t_sec)
         
         
-params = config()
-my_backup_folder = FileTracker(**params)
-
-#while True:
-for i in range(50):
+if __name__ == "__main__":
     
-    print('--------------------------------------------------------------------------------------------------------------------')
-    print('Run:', i)
-    my_backup_folder.backup_svc
-    print('--------------------------------------------------------------------------------------------------------------------')
\ No newline at end of file
+    params = config()
+    my_backup_folder = FileTracker(**params)
+
+    if my_backup_folder.watch:
+        my_backup_folder.watch_svc
+
+    else:
+        #while True:
+        for i in range(50):
+        
+            print('--------------------------------------------------------------------------------------------------------------------')
+            print('Run:', i)
+            my_backup_folder.backup_svc
+            print('--------------------------------------------------------------------------------------------------------------------')
@@ -0,0 +1,167 @@
+import os
+import time
+import functools
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from log import setup_logger
+
+logger=setup_logger(__name__)
+
+# Prefix of every metric name
+PREFIX = 'azsync_'
+# Timer handed out while metrics are off, it does nothing
+_OFF = contextlib.nullcontext()
+
+
+class Metrics:
+    """Counters, gauges and phase timers of the sync in the Prometheus text format,
+    written to a file and/or served on 127.0.0.1:port/metrics.
+    While off, count, gauge and phase return after one attribute check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.metrics_file = ''
+        self._lock = threading.Lock()
+        # {(name, ((label, value), ...)): float}
+        self._counters = {}
+        self._gauges = {}
+        self._server = None
+
+
+    def enable(self, metrics_file: str='', port: int=0) -> None:
+        """Turns metrics on when a file or a port is given.
+
+        Args:
+            metrics_file (str, optional): Rewritten by flush, '' is off. Defaults to ''.
+            port (int, optional): Serves /metrics on 127.0.0.1, 0 is off. Defaults to 0.
+        """
+        self.metrics_file = metrics_file
+        self.enabled = bool(metrics_file) or bool(port)
+        if port and self._server is None:
+            self._server = ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+            logger.info(f'Metrics served on http://127.0.0.1:{port}/metrics')
+
+
+    def count(self, name: str, value: float=1, **labels) -> None:
+        """Adds value to counter name{labels}.
+
+        Args:
+            name (str): Example: 'blob_files_total'
+            value (float, optional): Defaults to 1.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        """Sets gauge name{labels} to value.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+    def phase(self, name: str):
+        """Times a with block: phase_seconds_total and phase_runs_total count every run,
+        phase_last_seconds keeps the last one.
+
+        Args:
+            name (str): Example: 'local_scan'
+
+        Returns:
+            context manager
+        """
+        return self._timer(name) if self.enabled else _OFF
+
+
+    def timed(self, name: str):
+        """Decorator, times every call of the function as phase name.
+
+        Args:
+            name (str): Example: 'sync_all'
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+    @contextlib.contextmanager
+    def _timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.count('phase_seconds_total', seconds, phase=name)
+            self.count('phase_runs_total', phase=name)
+            self.gauge('phase_last_seconds', seconds, phase=name)
+
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format.
+
+        Returns:
+            str: '# TYPE azsync_name counter\\nazsync_name{label="value"} 1\\n...'
+        """
+        with self._lock:
+            series = [(name, labels, value, 'counter') for (name, labels), value in self._counters.items()]
+            series += [(name, labels, value, 'gauge') for (name, labels), value in self._gauges.items()]
+
+        lines = []
+        typed = set()
+        for name, labels, value, kind in sorted(series):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {PREFIX}{name} {kind}')
+            # counts stay exact, byte totals are far past the 6 digits of :g
+            value = int(value) if float(value).is_integer() else value
+            label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f'{PREFIX}{name}{{{label_text}}} {value}' if labels else f'{PREFIX}{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    def flush(self) -> None:
+        """Rewrites metrics_file in one step, readers never see half a file.
+        """
+        if not self.enabled or not self.metrics_file:
+            return
+        temp_name = self.metrics_file + '.tmp'
+        try:
+            with open(temp_name, 'w') as data:
+                data.write(self.render())
+            os.replace(temp_name, self.metrics_file)
+        except OSError as err:
+            logger.error("Failed: %s Issue: couldn't write %s" % (err, self.metrics_file))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes are not logged
+        pass
+
+
+# Shared by every module, turned on by FileTracker
+metrics = Metrics()
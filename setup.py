@@ -2,6 +2,7 @@ import configparser
 from log import setup_logger
 from azCosmosContainer import AzCosmosContainer
 from azStorage import AZBlobStorage
+from localState import LocalState
 
 logger = setup_logger()
 
@@ -16,16 +17,15 @@ class INICreator:
         """
         self.file_name = file_name
         self.config = configparser.ConfigParser()
-        self.record_name = 'after-before-record.txt'
+        self.state_db = 'local-state.db'
 
     @property
     def create_local_db(self) ->None:
-        """Creates local file for tracking file changes.
+        """Creates the local SQLite database for tracking file changes.
         """
         try:
-            with open(self.record_name, 'x') as f:
-                f.write()
-                logger.info(f"Created: {self.record_name} File")
+            LocalState(db_name=self.state_db).close()
+            logger.info(f"Created: {self.state_db} File")
         except Exception as err:
             logger.error(f"Failed: {err}")
             
@@ -82,7 +82,8 @@ class CreateAZResource:
     """
     def __init__(self, 
             working_dir: str, t_sec: str, conn_str: str, sto_container: str, 
-            db_name: str, uri: str, key: str, db_container: str) -> None:
+            db_name: str, uri: str, key: str, db_container: str, **tuning) -> None:
+        """Optional tuning keys from the [config] section are accepted and ignored here."""
         
         self.working_dir = working_dir
         self.t_sec = int(t_sec) 
@@ -0,0 +1,118 @@
+from fileIndex import FileIndex
+
+# Marks a name missing from a dict
+_MISSING = object()
+
+
+class SyncPlan:
+    """What one sync does, built by diff_states and carried out by FileTracker.run_plan.
+    Each action is a dict {"path/filename": filetime}, a file is in one action at most.
+    """
+    # Actions in the order run_plan carries them out
+    ACTIONS = ('download', 'keep_local', 'delete_local', 'upload_new', 'upload_changed',
+               'delete_cloud', 'forget')
+
+    def __init__(self):
+        # cloud added or changed, blob time: download then update the DB item
+        self.download = {}
+        # cloud added or changed with the same bytes as the local file, blob time: DB item only
+        self.keep_local = {}
+        # cloud removed, DB time: delete the local file and the DB item
+        self.delete_local = {}
+        # local added, local time: upload then update the DB item
+        self.upload_new = {}
+        # local changed, local time: upload then update the DB item
+        self.upload_changed = {}
+        # local removed, record time: delete the blob and the DB item
+        self.delete_cloud = {}
+        # removed on both sides, DB time: delete the DB item only
+        self.forget = {}
+        # {"path/filename": str} how a file changed on both sides was resolved
+        self.conflicts = {}
+
+
+    @property
+    def counts(self) -> dict:
+        """Files per action.
+
+        Returns:
+            dict: {"action": int}
+        """
+        return {action: len(getattr(self, action)) for action in self.ACTIONS}
+
+
+    @property
+    def empty(self) -> bool:
+        """True when there is nothing to do.
+        """
+        return not any(getattr(self, action) for action in self.ACTIONS)
+
+
+def _diff(before: dict, after: dict) -> tuple:
+    """Added, changed and removed entries of one side, one pass over each dict.
+
+    Args:
+        before (dict): {"path/filename": filetime} last known state.
+        after (dict): {"path/filename": filetime} current state.
+
+    Returns:
+        tuple: ({added}, {changed}, {removed}), values from after, or before for removed.
+    """
+    if isinstance(before, FileIndex) and isinstance(after, FileIndex):
+        return before.diff(after)
+
+    added = {}
+    changed = {}
+    for key, value in after.items():
+        old = before.get(key, _MISSING)
+        if old is _MISSING:
+            added[key] = value
+        elif old != value:
+            changed[key] = value
+
+    removed = {}
+    # every key of before is also in after when the counts match, no second pass needed
+    if len(before) > len(after) - len(added):
+        removed = {key: value for key, value in before.items() if key not in after}
+    return added, changed, removed
+
+
+def diff_states(before_local: dict, after_local: dict, before_cloud: dict, after_cloud: dict) -> SyncPlan:
+    """Compares the local and cloud state with the last run and resolves files changed on both sides:
+    the cloud version wins, except that a local edit is uploaded again instead of being
+    deleted because another client removed the file.
+
+    Args:
+        before_local (dict): Local record of the last run.
+        after_local (dict): Current local files.
+        before_cloud (dict): DB items.
+        after_cloud (dict): Blob listing.
+
+    Returns:
+        SyncPlan: Actions of this run, nothing is read from disk or the cloud.
+    """
+    plan = SyncPlan()
+    cloud_added, cloud_changed, cloud_removed = _diff(before_cloud, after_cloud)
+    local_added, local_changed, local_removed = _diff(before_local, after_local)
+
+    for changes, kind in ((cloud_added, 'added'), (cloud_changed, 'changed')):
+        for key, value in changes.items():
+            plan.download[key] = value
+            if key in local_added or key in local_changed:
+                plan.conflicts[key] = f'{kind} on both sides, cloud version downloaded'
+            elif key in local_removed:
+                plan.conflicts[key] = f'{kind} in the cloud and removed locally, cloud version downloaded'
+
+    for key, value in cloud_removed.items():
+        if key in local_removed:
+            plan.forget[key] = value
+        elif key in local_changed or key in local_added:
+            plan.conflicts[key] = 'removed in the cloud and changed locally, local version uploaded'
+        else:
+            plan.delete_local[key] = value
+
+    plan.upload_new = {key: value for key, value in local_added.items() if key not in plan.download}
+    plan.upload_changed = {key: value for key, value in local_changed.items() if key not in plan.download}
+    plan.delete_cloud = {key: value for key, value in local_removed.items()
+                         if key not in plan.download and key not in plan.forget}
+    return plan
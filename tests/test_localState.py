@@ -0,0 +1,78 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from localState import LocalState
+
+# A file name that isn't valid UTF-8, as os.scandir returns it (surrogate escaped)
+UNDECODABLE = os.fsdecode(b'/a\x80b.txt') if os.name != 'nt' else '/a\udc80b.txt'
+
+
+class LocalStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.folder.name, 'local-state.db')
+        self.state = LocalState(db_name=self.db_name, record_name='', hash_cache_name='')
+
+
+    def tearDown(self):
+        self.state.close()
+        self.folder.cleanup()
+
+
+    def test_records_keep_undecodable_names(self):
+        save = {'/z.txt': 3.0, UNDECODABLE: 1.0, '/é.txt': 2.0, '/.txt': 4.0}
+        self.state.records
+        self.assertEqual(self.state.save_records(save, sizes={UNDECODABLE: 10}), 4)
+
+        reopened = LocalState(db_name=self.db_name, record_name='', hash_cache_name='')
+        records = reopened.records
+        self.assertEqual(dict(records.items()), save)
+        self.assertEqual(list(records), sorted(save))
+        self.assertEqual(records[UNDECODABLE], 1.0)
+
+        del save[UNDECODABLE]
+        self.assertEqual(reopened.save_records(save), 1)
+        self.assertNotIn(UNDECODABLE, LocalState(db_name=self.db_name, record_name='', hash_cache_name='').records)
+        reopened.close()
+
+
+    def test_hashes_keep_undecodable_names(self):
+        self.assertTrue(self.state.save_hashes({UNDECODABLE: [10, 1.0, 'ab'], '/b.txt': [5, 2.0, 'cd']}))
+        self.assertEqual(self.state.load_hashes()[UNDECODABLE], (10, 1.0, 'ab'))
+
+        self.assertTrue(self.state.save_hashes({UNDECODABLE: None}))
+        self.assertEqual(list(self.state.load_hashes()), ['/b.txt'])
+
+
+    def test_cloud_items_keep_undecodable_names(self):
+        self.assertTrue(self.state.save_cloud_items({UNDECODABLE: 1.0, '/b.txt': 2.0}, 'token-1', replace=True))
+        self.assertTrue(self.state.save_cloud_items({'/b.txt': None}, 'token-2'))
+        items, token = self.state.load_cloud_items()
+        self.assertEqual(dict(items.items()), {UNDECODABLE: 1.0})
+        self.assertEqual(token, 'token-2')
+
+
+    def test_text_paths_of_older_versions_are_converted(self):
+        self.state.close()
+        os.remove(self.db_name)
+        connection = sqlite3.connect(self.db_name)
+        connection.execute('CREATE TABLE files (path TEXT PRIMARY KEY, mtime REAL NOT NULL, '
+                           'size INTEGER, hash TEXT, etag TEXT)')
+        connection.execute("INSERT INTO files VALUES ('/a.txt', 1.0, 1, NULL, NULL)")
+        connection.commit()
+        connection.close()
+
+        self.state = LocalState(db_name=self.db_name, record_name='', hash_cache_name='')
+        self.assertEqual(dict(self.state.records.items()), {'/a.txt': 1.0})
+        self.state.save_records({'/a.txt': 2.0})
+        rows = self.state.connection.execute('SELECT path, mtime FROM files').fetchall()
+        self.assertEqual(rows, [(b'/a.txt', 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()